@@ -1,318 +1,259 @@
-from __future__ import print_function
-import cPickle
-import math
-import os
+"""Benchmark the field index sort algorithms.
+
+For each index size (``numdocs``), the docids of a random sample of the
+documents (``rlen`` of them) are sorted with each algorithm, in both
+directions, for a series of limits; each time is the median of several
+runs, and the results of the algorithms are checked against each other.
+
+The timings are written as a tab-separated table (one row per numdocs,
+rlen, limit and direction, one column per algorithm), followed by the
+accuracy of the heuristics ``FieldIndex.sort`` uses to pick an algorithm
+when ``sort_type`` is ``OPTIMAL`` (``fwscan_wins``, ``nbest_ascending_wins``
+and ``nbest_descending_wins``).  With ``--fit``, the thresholds of simple
+rules based on the same ratios are fit to the timings, to see whether the
+heuristics need revising on the current interpreter.
+
+Usage::
+
+  python benchmark/sortbench.py [--numdocs 1024,16384,65536] [--base 4]
+      [--repeat 5] [--values N] [--table sort.tsv] [--fit]
+"""
+import argparse
+import itertools
 import random
+import statistics
 import sys
 import time
 
-from pychart import theme
-from pychart import canvas
-from pychart import axis
-from pychart import area
-from pychart import line_plot
-from pychart import legend
-from pychart import text_box
-
-from BTrees.IFBTree import IFSet
-#from hypatia.indexes.field import fwscan_wins
-from hypatia.indexes.field import nbest_ascending_wins
-
-theme.get_options()
-theme.use_color = True
-theme.scale_factor = 2
-
-# db keys:
-# 64
-# 512
-# 1024
-# 2048
-# 4096
-# 8192
-# 16384
-# 32768
-# 65536
-
-class FieldIndexForwardSort:
-    """ Benchmark and compare the field index forward sort algorithms """
-
-    def __init__(self, limitbase=2, rlenbase=2, dbfn='sort.db', dbkey='65536'):
-        self.limitbase = limitbase
-        self.rlenbase = rlenbase
-        self.dbfn = dbfn
-        self.dbkey = dbkey
-        self.index = self.get_index()
-        self.numdocs = self.index._num_docs.value
-        self.dbkey = dbkey
-        # the set of rlens and limits are series generated via
-        # exponents to the power of the base base, e.g.  [4, 16, 64,
-        # 256, 1024, 4096, 16384, 65535 ] if numdocs = 65708 and the
-        # base is 4
-        self.rlens = series(self.numdocs+1, self.rlenbase)
-        self.limits = series(self.numdocs+1, self.limitbase)
-
-        self.sorts = (
-            ('nbest', self.index.nbest_ascending),
-            ('fwscan', self.index.scan_forward),
-            ('timsort', self.index.timsort_ascending)
-            )
- 
-    def get_index(self):
-        if not os.path.exists(self.dbfn):
-            raise NotImplementedError # XXX create index-creation code
-        from ZODB.FileStorage.FileStorage import FileStorage
-        from ZODB.DB import DB
-        s = FileStorage(self.dbfn)
-        db = DB(s, cache_size=300000)
-        c = db.open()
-        root = c.root()
-        return root[self.dbkey]
-
-    def __call__(self):
-        if not os.path.exists('%s.pck' % self.dbkey):
-            self.bench()
-        self.chart()
-
-    def bench(self):
-        tf = open('%s.txt' % self.dbkey, 'w')
-
-        def output(msg):
-            tf.write(msg + '\n')
-            tf.flush()
-            print(msg)
-
-        all_docids = list(self.index._rev_index.keys())
-        random.shuffle(all_docids)
-
-        main = []
-
-        for rlen in self.rlens:
-            docids = IFSet(random.sample(all_docids,
-                                         min(rlen, len(all_docids))))
-            output('for %s' % rlen)
-            output('-----------------------------------')
-
-            control = []
-            for k, s in self.index._fwd_index.items():
-                for docid in s:
-                    if docid in docids:
-                        control.append(docid)
-
-            capture = {}
-            result = None
-            for name, fn in self.sorts:
-                data = capture.setdefault(name, [])
-                for limit in self.limits:
-                    t, result = timer(fn, docids, limit)
-                    result = list(result)
-                    if control[:limit] != result:
-                        raise AssertionError((control[:limit], result))
-                    data.append(t)
-                    output('%0.6f %s at limit %s' % (t, name, limit))
-
-            main.append({'rlen':rlen, 'capture':capture})
-
-        cPickle.dump(main, open('%s.pck' % self.dbkey, 'w'))
-
-    def chart(self):
-
-        self.main = cPickle.load(open('%s.pck' % self.dbkey))
-
-        for chartable in self.main:
-            self.detailchart(chartable)
-
-        sortnames = [ x[0] for x in self.sorts ]
-
-        for sortname1, sortname2 in product(sortnames, sortnames):
-            if sortname1 == sortname2:
-                continue
-            self.comparisonchart(sortname1, sortname2)
-
-    def detailchart(self, chartable):
-        theme.reinitialize()
-
-        min_y = 0
-        max_y = 0
-        capture = chartable.get('capture')
-        for sortname, sortfn in self.sorts:
-            data = capture[sortname]
-            m = median(data)
-            if m > max_y:
-                max_y = m
-
-        max_x = max(self.limits)
-        min_x = min(self.limits)
-
-        ipoints = 10.0
-
-        x_interval = (max_x - min_x) / ipoints
-        y_interval = (max_y - min_y) / ipoints
-
-        xaxis = axis.X(label='Limit',
-                       tic_interval = x_interval,
-                       format='/4{}%d')
-        yaxis = axis.Y(label='Seconds',
-                       tic_interval = y_interval,
-                       format='/4{}%0.3f')
-
-        ar = area.T(
-            x_range = (min_x, max_x),
-            y_range = (min_y, max_y),
-            x_axis  = xaxis,
-            y_axis  = yaxis,
-            legend =  legend.T(),
-            )
-        tb = text_box.T(loc=(140,90), text='Rlen\n%s' % chartable['rlen'])
-
-        for sortname, sortfn in self.sorts:
-            data = capture[sortname]
-            linedata = [ (self.limits[x], data[x]) for x in range(len(data)) ]
-            ar.add_plot(
-                line_plot.T(label="%s" % sortname, data=linedata)
-                )
-        fd = open('detail-%s-%s.pdf' % (self.dbkey, chartable['rlen']), 'w')
-        can = canvas.init(fd, 'pdf')
-        ar.draw(can)
-        tb.draw(can)
-        can.close()
-
-    def comparisonchart(self, sortname1, sortname2):
-        linedata = []
-        test_total = 0
-        test_wrong = 0
-
-        for rlendata in self.main:
-            rlen = rlendata['rlen']
-            capture = rlendata['capture']
-            values1 = capture[sortname1]
-            values2 = capture[sortname2]
-            doc_ratio = rlen / float(self.numdocs)
-            cutoff = None
-            wins = []
-
-            #test = sortname1 == 'fwscan' and sortname2 in ('nbest', 'timsort')
-            #test_fn = fwscan_wins
-            test = sortname1 == 'nbest' and sortname2 == 'timsort'
-            test_fn = nbest_ascending_wins
-
-            for x in xrange(0, min(len(values1), len(values2))):
-                t1 = values1[x]
-                t2 = values2[x]
-                limit = self.limits[x]
-                limitratio = limit / float(self.numdocs)
-                won = t1 < t2
-                if won:
-                    wins.append(limit)
-
-                wrongmsg = "wrong %s? rlen %s, limit %s (%0.5f > %0.5f)%s"
-
-                if test:
-                    test_total += 1
-                    curvewin = test_fn(limit, rlen, self.numdocs)
-                    if won and (not curvewin):
-                        extra = ''
-                        if (t1 /  t2) < .90: # more than 10% difference
-                            extra = " * (%0.2f)" % (t1/t2)
-                        print(wrongmsg
-                                % ('curvelose', rlen, limit, t2, t1, extra))
-                        test_wrong +=1
-                    elif (not won) and curvewin:
-                        extra = ''
-                        if (t2 /  t1) < .90: # more than 10% difference
-                            extra = " * (%0.2f)" % (t2/t1)
-                        print(wrongmsg
-                                % ('curvewin', rlen, limit, t1, t2, extra))
-                        test_wrong +=1
-
-            for limit in wins:
-                limitratio = limit / float(self.numdocs)
-                linedata.append((doc_ratio, limitratio))
-
-        if test:
-            if test_total:
-                test_right = test_total - test_wrong
-                test_percent = test_right / float(test_total)
-                print("test percentage %0.2f: (%s wrong out of %s)"
-                        % ( test_percent, test_wrong, test_total))
-
-        comparename = 'compare-%s-%s-beats-%s' % (self.dbkey,
-                                                  sortname1, sortname2)
-
-        xaxis=axis.X(label='Doc Ratio (rlen//numdocs)',
-                     tic_interval=.1,
-                     format='/4{}%0.2f')
-        yaxis=axis.Y(label='Limit Ratio (limit//numdocs)',
-                     tic_interval=.1,
-                     format='/4{}%0.2f')
-
-        ar = area.T(
-            x_range = (0, 1),
-            y_range = (0, 1),
-            x_axis  = xaxis,
-            y_axis  = yaxis,
-            legend =  legend.T(),
-            )
-
-        ar.add_plot(
-            line_plot.T(label="%s \nbeats \n%s" % (sortname1, sortname2),
-                        data=linedata),
-            )
-
-        tb = text_box.T(loc=(140,90), text='Numdocs\n%s' % self.numdocs)
-
-        fd = open('%s.pdf' % comparename, 'w')
-        can = canvas.init(fd, 'pdf')
-        ar.draw(can)
-        tb.draw(can)
-        can.close()
-
-def timer(fn, *args, **kw):
-    times = []
-    for x in xrange(7):
-        start = time.time()
-        result = fn(*args, **kw)
-        if not hasattr(result, '__len__'):
-            result = list(result)
-        end = time.time()
-        times.append(end-start)
-    return median(times), result
-
-def isect(seq1, seq2):
-    res = []                     # start empty
-    for x in seq1:               # scan seq1
-        if x in seq2:            # common item?
-            res.append(x)        # add to end
-    return res
-
-def product(*args):
-    # product('ABCD', 'xy') --> Ax Ay Bx By Cx Cy Dx Dy
-    # product(range(2), repeat=3) --> 000 001 010 011 100 101 110 111
-    pools = map(tuple, args)
-    result = [[]]
-    for pool in pools:
-        result = [x+[y] for x in result for y in pool]
-    for prod in result:
-        yield tuple(prod)
-
-def avg(numbers):
-    return sum(numbers) / len(numbers)
-
-def median(numbers):
-    "Return the median of the list of numbers."
-    # Sort the list and take the middle element.
-    n = len(numbers)
-    copy = numbers[:] # So that "numbers" keeps its original order
-    copy.sort()
-    if n & 1:         # There is an odd number of elements
-        return copy[n // 2]
+from hypatia.field import FieldIndex
+from hypatia.field import fwscan_wins
+from hypatia.field import nbest_ascending_wins
+from hypatia.field import nbest_descending_wins
+
+ASCENDING = (
+    ('fwscan', 'scan_forward'),
+    ('nbest', 'nbest_ascending'),
+    ('timsort', 'timsort_ascending'),
+    )
+
+DESCENDING = (
+    ('nbest', 'nbest_descending'),
+    ('timsort', 'timsort_descending'),
+    )
+
+
+def make_index(numdocs, values=None, seed=0):
+    """ Return a field index of ``numdocs`` documents, whose values are
+    distinct unless ``values`` is the number of distinct values. """
+    rnd = random.Random(seed)
+    if values is None:
+        docvalues = list(range(numdocs))
+        rnd.shuffle(docvalues)
     else:
-        return (copy[n // 2 - 1] + copy[n // 2]) / 2
-  
+        docvalues = [rnd.randrange(values) for docid in range(numdocs)]
+    index = FieldIndex(lambda obj, default: obj)
+    index.index_docs(enumerate(docvalues))
+    return index
+
+
 def series(numdocs, base):
-    exp = int(math.ceil(math.log(numdocs) / math.log(base)))
-    return [ pow(base, x) for x in range(1, exp) ]
+    """ Return the powers of ``base`` up to ``numdocs``, and ``numdocs``. """
+    result = []
+    n = base
+    while n < numdocs:
+        result.append(n)
+        n *= base
+    result.append(numdocs)
+    return result
 
-def main(argv=sys.argv):
-    bench = FieldIndexForwardSort()
-    bench()
 
+def timer(fn, repeat, *args):
+    times = []
+    for x in range(repeat):
+        start = time.perf_counter()
+        result = list(fn(*args))
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def bench(numdocs, base=4, repeat=5, values=None, output=None):
+    """ Time the sort algorithms on an index of ``numdocs`` documents and
+    return a list of rows: ``(numdocs, rlen, limit, reverse, {name:
+    seconds})``. """
+    index = make_index(numdocs, values)
+    rev_index = index._rev_index
+    rnd = random.Random(numdocs)
+    all_docids = list(rev_index.keys())
+    rows = []
+    for rlen in series(numdocs, base):
+        docids = index.family.IF.Set(rnd.sample(all_docids, rlen))
+        for reverse, sorts in ((False, ASCENDING), (True, DESCENDING)):
+            control = [rev_index[docid] for docid in
+                       sorted(docids, key=rev_index.get, reverse=reverse)]
+            for limit in series(rlen, base):
+                times = {}
+                for name, method in sorts:
+                    t, result = timer(
+                        getattr(index, method), repeat, docids, limit)
+                    # ties may be broken differently: compare the values
+                    if [rev_index[docid] for docid in result] != (
+                            control[:limit]):
+                        raise AssertionError((name, numdocs, rlen, limit))
+                    times[name] = t
+                row = (numdocs, rlen, limit, reverse, times)
+                rows.append(row)
+                if output is not None:
+                    write_row(output, row)
+    return rows
+
+
+def write_header(output):
+    output.write('numdocs\trlen\tlimit\treverse\tfwscan\tnbest\ttimsort\t'
+                 'fastest\theuristic\n')
+    output.flush()
+
+
+def write_row(output, row):
+    numdocs, rlen, limit, reverse, times = row
+    cells = [str(numdocs), str(rlen), str(limit), str(int(reverse))]
+    for name in ('fwscan', 'nbest', 'timsort'):
+        t = times.get(name)
+        cells.append('' if t is None else '%0.6f' % t)
+    cells.append(fastest(times))
+    cells.append(heuristic(numdocs, rlen, limit, reverse))
+    output.write('\t'.join(cells) + '\n')
+    output.flush()
+
+
+def fastest(times):
+    return min(times, key=times.get)
+
+
+def heuristic(numdocs, rlen, limit, reverse):
+    """ The algorithm ``FieldIndex.sort`` picks for an ``OPTIMAL`` sort. """
+    if reverse:
+        if nbest_descending_wins(limit, rlen, numdocs):
+            return 'nbest'
+        return 'timsort'
+    if fwscan_wins(limit, rlen, numdocs):
+        return 'fwscan'
+    if limit and nbest_ascending_wins(limit, rlen, numdocs):
+        return 'nbest'
+    return 'timsort'
+
+
+def score(rows, choose):
+    """ Return the share of ``rows`` for which ``choose(numdocs, rlen,
+    limit, reverse)`` picks the fastest algorithm, and the total time lost
+    to its wrong picks. """
+    right = 0
+    lost = 0.0
+    for numdocs, rlen, limit, reverse, times in rows:
+        chosen = choose(numdocs, rlen, limit, reverse)
+        best = fastest(times)
+        if chosen == best:
+            right += 1
+        lost += times[chosen] - times[best]
+    return right / float(len(rows)), lost
+
+
+def reverse_rule(max_limitratio):
+    """ A rule for descending sorts: n-best if ``limit / rlen <=
+    max_limitratio``. """
+    def choose(numdocs, rlen, limit, reverse):
+        if limit / float(rlen) <= max_limitratio:
+            return 'nbest'
+        return 'timsort'
+    return choose
+
+
+def forward_rule(min_docratio, max_scanratio, max_limitratio):
+    """ A rule for ascending sorts: forward scan if ``rlen / numdocs >=
+    min_docratio`` and ``limit / rlen <= max_scanratio``, else n-best if
+    ``limit / rlen <= max_limitratio``. """
+    def choose(numdocs, rlen, limit, reverse):
+        limitratio = limit / float(rlen)
+        if (rlen / float(numdocs) >= min_docratio and
+                limitratio <= max_scanratio):
+            return 'fwscan'
+        if limitratio <= max_limitratio:
+            return 'nbest'
+        return 'timsort'
+    return choose
+
+
+def fit(rows, rule, *candidates):
+    """ Return the parameters of ``rule``, among the combinations of
+    ``candidates``, which lose the least time on ``rows``. """
+    return min(itertools.product(*candidates),
+               key=lambda params: score(rows, rule(*params))[1])
+
+
+def report(rows, fit_rules=False, output=sys.stdout):
+    forward = [row for row in rows if not row[3]]
+    reverse = [row for row in rows if row[3]]
+    results = [
+        ('ascending heuristics', forward, heuristic),
+        ('descending heuristics', reverse, heuristic),
+        ]
+    if fit_rules:
+        docratios = sorted(set(row[1] / float(row[0]) for row in forward))
+        docratios.append(2.0)
+        limitratios = sorted(set(row[2] / float(row[1]) for row in rows))
+        limitratios.insert(0, 0.0)
+        params = fit(forward, forward_rule,
+                     docratios, limitratios, limitratios)
+        results.append((
+            'ascending fit: fwscan if rlen / numdocs >= %0.4f and '
+            'limit / rlen <= %0.4f, else nbest if limit / rlen <= %0.4f'
+            % params, forward, forward_rule(*params)))
+        params = fit(reverse, reverse_rule, limitratios)
+        results.append((
+            'descending fit: nbest if limit / rlen <= %0.4f' % params,
+            reverse, reverse_rule(*params)))
+    for label, selected, choose in results:
+        accuracy, lost = score(selected, choose)
+        output.write('# %s: %0.1f%% right, %0.4fs lost\n'
+                     % (label, accuracy * 100, lost))
+
+
+def main(argv=sys.argv):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the field index sort algorithms.')
+    parser.add_argument(
+        '--numdocs', default='1024,16384,65536',
+        help='comma-separated index sizes (default: %(default)s)')
+    parser.add_argument(
+        '--base', type=int, default=4,
+        help='ratio between successive rlens and limits '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--repeat', type=int, default=5,
+        help='runs per timing, of which the median is kept '
+             '(default: %(default)s)')
+    parser.add_argument(
+        '--values', type=int, default=None,
+        help='number of distinct values (default: one per document)')
+    parser.add_argument(
+        '--table', default=None,
+        help='write the table to this file rather than to stdout')
+    parser.add_argument(
+        '--fit', action='store_true',
+        help='fit the thresholds of the heuristics to the timings')
+    args = parser.parse_args(argv[1:])
+
+    output = sys.stdout if args.table is None else open(args.table, 'w')
+    try:
+        write_header(output)
+        rows = []
+        for numdocs in args.numdocs.split(','):
+            rows.extend(bench(int(numdocs), args.base, args.repeat,
+                              args.values, output))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    report(rows, args.fit)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,392 @@
+"""Compressed bitmaps of document ids
+
+A :class:`Bitmap` stores a set of docids the way roaring bitmaps do: the
+docids are grouped by their high bits into chunks of 65536 possible
+values, and each chunk is stored either as a sorted array of its low 16
+bits, when it holds few docids, or as a 65536 bit bitmap (a Python int),
+when it holds more.  Unions, intersections and differences are computed a
+chunk at a time, mostly as operations on ints.
+
+Bitmaps are persisted as a single binary string, so changing one rewrites
+all of it: they suit large postings which don't change often, like those
+of low-cardinality fields (a status or a type), much better than small or
+busy ones.
+"""
+from array import array
+import struct
+import sys
+
+import BTrees
+from persistent import Persistent
+
+try:
+    import numpy
+except ImportError: #pragma NO COVERAGE
+    numpy = None
+
+# a chunk holding more docids than this is stored as a bitmap
+ARRAY_MAX = 4096
+
+_CHUNK_BYTES = 65536 // 8
+_HEADER = struct.Struct('<qBI') # high bits, kind, number of docids
+_ARRAY, _BITMAP = 0, 1
+_VERSION = b'\x01'
+
+# the positions of the bits set in each byte value
+_BYTE_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1)
+              for byte in range(256)]
+
+try:
+    _popcount = int.bit_count
+except AttributeError: #pragma NO COVERAGE
+    def _popcount(x):
+        return bin(x).count('1')
+
+
+class Bitmap(Persistent):
+    """ A compressed set of integer docids.
+
+    Bitmaps support ``len()``, iteration (in ascending order), ``in`` and
+    the ``add``, ``insert``, ``remove`` and ``update`` methods of
+    ``BTrees`` sets, which lets indexes use them as postings.
+    """
+
+    def __init__(self, docids=()):
+        self._chunks = {} # high bits -> array('H') or int
+        groups = {}
+        for docid in docids:
+            lows = groups.get(docid >> 16)
+            if lows is None:
+                groups[docid >> 16] = lows = set()
+            lows.add(docid & 0xFFFF)
+        for high, lows in groups.items():
+            self._chunks[high] = _pack(array('H', sorted(lows)))
+
+    def __getstate__(self):
+        parts = [_VERSION]
+        for high in sorted(self._chunks):
+            chunk = self._chunks[high]
+            if isinstance(chunk, int):
+                parts.append(_HEADER.pack(high, _BITMAP, _popcount(chunk)))
+                parts.append(chunk.to_bytes(_CHUNK_BYTES, 'little'))
+            else:
+                parts.append(_HEADER.pack(high, _ARRAY, len(chunk)))
+                if sys.byteorder == 'big': #pragma NO COVERAGE
+                    chunk = array('H', chunk)
+                    chunk.byteswap()
+                parts.append(chunk.tobytes())
+        return b''.join(parts)
+
+    def __setstate__(self, state):
+        if state[:len(_VERSION)] != _VERSION:
+            raise ValueError('Unknown bitmap format %r' % state[:1])
+        chunks = self._chunks = {}
+        offset = len(_VERSION)
+        size = _HEADER.size
+        while offset < len(state):
+            high, kind, count = _HEADER.unpack_from(state, offset)
+            offset += size
+            if kind == _BITMAP:
+                end = offset + _CHUNK_BYTES
+                chunks[high] = int.from_bytes(state[offset:end], 'little')
+            else:
+                end = offset + 2 * count
+                chunk = array('H')
+                chunk.frombytes(state[offset:end])
+                if sys.byteorder == 'big': #pragma NO COVERAGE
+                    chunk.byteswap()
+                chunks[high] = chunk
+            offset = end
+
+    def __len__(self):
+        n = 0
+        for chunk in self._chunks.values():
+            if isinstance(chunk, int):
+                n += _popcount(chunk)
+            else:
+                n += len(chunk)
+        return n
+
+    def __bool__(self):
+        return bool(self._chunks)
+
+    def __iter__(self):
+        chunks = self._chunks
+        for high in sorted(chunks):
+            base = high << 16
+            for low in _lows(chunks[high]):
+                yield base + low
+
+    def __contains__(self, docid):
+        chunk = self._chunks.get(docid >> 16)
+        if chunk is None:
+            return False
+        low = docid & 0xFFFF
+        if isinstance(chunk, int):
+            return bool(chunk >> low & 1)
+        i = _bisect(chunk, low)
+        return i < len(chunk) and chunk[i] == low
+
+    def __repr__(self):
+        return '<%s of %d docids>' % (self.__class__.__name__, len(self))
+
+    def insert(self, docid):
+        """ Add ``docid``; return True if it wasn't in the bitmap. """
+        high, low = docid >> 16, docid & 0xFFFF
+        chunk = self._chunks.get(high)
+        if chunk is None:
+            chunk = array('H', [low])
+        elif isinstance(chunk, int):
+            if chunk >> low & 1:
+                return False
+            chunk |= 1 << low
+        else:
+            i = _bisect(chunk, low)
+            if i < len(chunk) and chunk[i] == low:
+                return False
+            chunk = array('H', chunk)
+            chunk.insert(i, low)
+            chunk = _pack(chunk)
+        self._chunks[high] = chunk
+        self._p_changed = True
+        return True
+
+    add = insert
+
+    def remove(self, docid):
+        """ Remove ``docid``; raise KeyError if it isn't in the bitmap. """
+        high, low = docid >> 16, docid & 0xFFFF
+        chunk = self._chunks.get(high)
+        if chunk is None:
+            raise KeyError(docid)
+        if isinstance(chunk, int):
+            if not chunk >> low & 1:
+                raise KeyError(docid)
+            chunk = _pack(chunk & ~(1 << low))
+        else:
+            i = _bisect(chunk, low)
+            if i == len(chunk) or chunk[i] != low:
+                raise KeyError(docid)
+            chunk = array('H', chunk)
+            del chunk[i]
+            chunk = _pack(chunk)
+        if chunk is None:
+            del self._chunks[high]
+        else:
+            self._chunks[high] = chunk
+        self._p_changed = True
+
+    def update(self, docids):
+        """ Add ``docids``; return the number of docids added. """
+        before = len(self)
+        other = docids if isinstance(docids, Bitmap) else Bitmap(docids)
+        self._chunks = self.union(other)._chunks
+        self._p_changed = True
+        return len(self) - before
+
+    def union(self, other):
+        """ Return a new bitmap of the docids in ``self`` or ``other``. """
+        return multiunion([self, other])
+
+    def intersection(self, other):
+        """ Return a new bitmap of the docids in ``self`` and ``other``. """
+        result = Bitmap()
+        chunks = other._chunks
+        for high, chunk in self._chunks.items():
+            other_chunk = chunks.get(high)
+            if other_chunk is not None:
+                chunk = _pack(_and(chunk, other_chunk))
+                if chunk is not None:
+                    result._chunks[high] = chunk
+        return result
+
+    def difference(self, other):
+        """ Return a new bitmap of the docids in ``self`` but not in
+        ``other``. """
+        result = Bitmap()
+        chunks = other._chunks
+        for high, chunk in self._chunks.items():
+            other_chunk = chunks.get(high)
+            if other_chunk is not None:
+                chunk = _pack(_andnot(chunk, other_chunk))
+            if chunk is not None:
+                result._chunks[high] = chunk
+        return result
+
+    def to_set(self, family=None):
+        """ Return the docids as a ``family.IF.Set``. """
+        if family is None:
+            family = BTrees.family64
+        result = family.IF.Set()
+        if self._chunks:
+            # a flat tuple of sorted keys is the state of a (bucket) Set
+            result.__setstate__((tuple(_docids(self._chunks)),))
+        return result
+
+
+def multiunion(bitmaps):
+    """ Return a new bitmap of the docids in any of ``bitmaps``. """
+    groups = {}
+    for bitmap in bitmaps:
+        for high, chunk in bitmap._chunks.items():
+            group = groups.get(high)
+            if group is None:
+                groups[high] = group = []
+            group.append(chunk)
+    result = Bitmap()
+    for high, group in groups.items():
+        if len(group) == 1:
+            chunk = group[0]
+        elif (all(not isinstance(chunk, int) for chunk in group) and
+                sum(map(len, group)) <= ARRAY_MAX):
+            lows = set()
+            for chunk in group:
+                lows.update(chunk)
+            chunk = array('H', sorted(lows))
+        else:
+            chunk = 0
+            for other in group:
+                chunk |= _to_int(other)
+            chunk = _pack(chunk)
+        result._chunks[high] = chunk
+    return result
+
+
+def union_postings(sets, family=None):
+    """ Return the union of postings, some of which may be bitmaps, as a
+    ``family.IF.Set``.
+
+    The bitmaps are merged as bitmaps, and their union is only converted
+    once, before being merged with the other postings.
+    """
+    if family is None:
+        family = BTrees.family64
+    bitmaps = []
+    others = []
+    for set in sets:
+        if isinstance(set, Bitmap):
+            bitmaps.append(set)
+        else:
+            others.append(set)
+    if bitmaps:
+        result = multiunion(bitmaps).to_set(family)
+        if not others:
+            return result
+        others.append(result)
+    return family.IF.multiunion(others)
+
+
+def intersect_postings(sets, family=None):
+    """ Return the intersection of postings, some of which may be bitmaps,
+    as a ``family.IF.Set``. """
+    if family is None:
+        family = BTrees.family64
+    IF = family.IF
+    bitmaps = sorted([set for set in sets if isinstance(set, Bitmap)],
+                     key=len)
+    others = sorted([set for set in sets if not isinstance(set, Bitmap)],
+                    key=len)
+    result = None
+    for set in others:
+        result = IF.intersection(result, set)
+        if not result:
+            return IF.Set()
+    if bitmaps:
+        if result is not None:
+            bitmaps.insert(0, Bitmap(result))
+        bitmap = bitmaps[0]
+        for other in bitmaps[1:]:
+            if not bitmap:
+                break
+            bitmap = bitmap.intersection(other)
+        return bitmap.to_set(family)
+    if result is None:
+        return IF.Set()
+    return result
+
+
+def _bisect(chunk, low):
+    lo, hi = 0, len(chunk)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if chunk[mid] < low:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+def _pack(chunk):
+    # Return ``chunk`` in the representation its size calls for, or None if
+    # it is empty.
+    if isinstance(chunk, int):
+        if not chunk:
+            return None
+        if _popcount(chunk) <= ARRAY_MAX:
+            return array('H', _lows(chunk))
+        return chunk
+    if not chunk:
+        return None
+    if len(chunk) > ARRAY_MAX:
+        return _to_int(chunk)
+    return chunk
+
+def _to_int(chunk):
+    if isinstance(chunk, int):
+        return chunk
+    bits = bytearray(_CHUNK_BYTES)
+    for low in chunk:
+        bits[low >> 3] |= 1 << (low & 7)
+    return int.from_bytes(bits, 'little')
+
+def _lows(chunk):
+    # the low bits in ``chunk``, in ascending order
+    if not isinstance(chunk, int):
+        return chunk
+    lows = []
+    for i, byte in enumerate(chunk.to_bytes(_CHUNK_BYTES, 'little')):
+        if byte:
+            base = i << 3
+            lows.extend([base + bit for bit in _BYTE_BITS[byte]])
+    return lows
+
+def _and(chunk, other):
+    if isinstance(chunk, int) and isinstance(other, int):
+        return chunk & other
+    if isinstance(chunk, int):
+        chunk, other = other, chunk
+    if isinstance(other, int):
+        bits = other.to_bytes(_CHUNK_BYTES, 'little')
+        return array('H', [low for low in chunk
+                           if bits[low >> 3] >> (low & 7) & 1])
+    return array('H', sorted(set(chunk).intersection(other)))
+
+def _andnot(chunk, other):
+    if isinstance(chunk, int):
+        return chunk & ~_to_int(other)
+    if isinstance(other, int):
+        bits = other.to_bytes(_CHUNK_BYTES, 'little')
+        return array('H', [low for low in chunk
+                           if not bits[low >> 3] >> (low & 7) & 1])
+    return array('H', sorted(set(chunk).difference(other)))
+
+def _docids(chunks):
+    # the docids in ``chunks``, in ascending order
+    highs = sorted(chunks)
+    if numpy is None:
+        docids = []
+        for high in highs:
+            base = high << 16
+            docids.extend([base + low for low in _lows(chunks[high])])
+        return docids
+    parts = []
+    for high in highs:
+        chunk = chunks[high]
+        if isinstance(chunk, int):
+            bits = numpy.frombuffer(
+                chunk.to_bytes(_CHUNK_BYTES, 'little'), numpy.uint8)
+            lows = numpy.flatnonzero(
+                numpy.unpackbits(bits, bitorder='little'))
+        else:
+            lows = numpy.frombuffer(chunk, numpy.uint16)
+        parts.append(lows.astype(numpy.int64) + (high << 16))
+    return numpy.concatenate(parts).tolist()
@@ -0,0 +1,203 @@
+import unittest
+
+class TestBitmap(unittest.TestCase):
+
+    def _getTargetClass(self):
+        from . import Bitmap
+        return Bitmap
+
+    def _makeOne(self, docids=()):
+        return self._getTargetClass()(docids)
+
+    def _docids(self):
+        # a sparse chunk, a dense chunk and a chunk of negative docids
+        return ([-3, -1] + list(range(0, 20000, 3)) +
+                [70000, 70005, 2**40 + 1])
+
+    def test_ctor_empty(self):
+        bitmap = self._makeOne()
+        self.assertEqual(len(bitmap), 0)
+        self.assertFalse(bitmap)
+        self.assertEqual(list(bitmap), [])
+
+    def test_ctor(self):
+        docids = self._docids()
+        bitmap = self._makeOne(reversed(docids))
+        self.assertEqual(len(bitmap), len(docids))
+        self.assertTrue(bitmap)
+        self.assertEqual(list(bitmap), docids)
+        self.assertEqual(type(bitmap._chunks[0]), int)
+        self.assertEqual(list(bitmap._chunks[1]), [70000 - 65536,
+                                                   70005 - 65536])
+
+    def test_contains(self):
+        bitmap = self._makeOne(self._docids())
+        for docid in (-3, 0, 19998, 70005, 2**40 + 1):
+            self.assertTrue(docid in bitmap)
+        for docid in (-2, 1, 20001, 70001, 2**40, 200000):
+            self.assertFalse(docid in bitmap)
+
+    def test_repr(self):
+        self.assertEqual(repr(self._makeOne([1, 2])), '<Bitmap of 2 docids>')
+
+    def test_insert_and_remove(self):
+        from . import ARRAY_MAX
+        bitmap = self._makeOne()
+        for docid in range(ARRAY_MAX + 1):
+            self.assertTrue(bitmap.insert(docid))
+        self.assertFalse(bitmap.insert(5))
+        self.assertEqual(type(bitmap._chunks[0]), int)
+        self.assertRaises(KeyError, bitmap.remove, ARRAY_MAX + 1)
+        self.assertTrue(bitmap.insert(ARRAY_MAX + 1))
+        bitmap.remove(ARRAY_MAX + 1)
+        bitmap.remove(5)
+        self.assertEqual(len(bitmap), ARRAY_MAX)
+        self.assertEqual(type(bitmap._chunks[0]).__name__, 'array')
+        self.assertRaises(KeyError, bitmap.remove, 5)
+        self.assertRaises(KeyError, bitmap.remove, 70000)
+        bitmap.add(70000)
+        self.assertFalse(bitmap.add(70000))
+        self.assertRaises(KeyError, bitmap.remove, 70001)
+        bitmap.remove(70000)
+        self.assertFalse(1 in bitmap._chunks)
+        self.assertEqual(list(bitmap)[:6], [0, 1, 2, 3, 4, 6])
+
+    def test_update(self):
+        bitmap = self._makeOne([1, 2])
+        self.assertEqual(bitmap.update([2, 3, 70000]), 2)
+        self.assertEqual(bitmap.update(self._makeOne([4])), 1)
+        self.assertEqual(list(bitmap), [1, 2, 3, 4, 70000])
+
+    def test_set_operations(self):
+        left = set(self._docids())
+        right = set(range(0, 30000, 5)) | set([-1, 2**40 + 1, 70001])
+        bitmap = self._makeOne(left)
+        other = self._makeOne(right)
+        self.assertEqual(list(bitmap.union(other)), sorted(left | right))
+        self.assertEqual(list(bitmap.intersection(other)),
+                         sorted(left & right))
+        self.assertEqual(list(other.intersection(bitmap)),
+                         sorted(left & right))
+        self.assertEqual(list(bitmap.difference(other)),
+                         sorted(left - right))
+        self.assertEqual(list(other.difference(bitmap)),
+                         sorted(right - left))
+
+    def test_set_operations_mixed_chunks(self):
+        # dense and sparse chunks, and dense chunks with nothing in common
+        dense = set(range(0, 20000, 3))
+        sparse = set(range(0, 3000, 2))
+        odd = set(range(1, 20000, 3))
+        for left, right in ((dense, sparse), (sparse, dense), (dense, odd)):
+            bitmap = self._makeOne(left)
+            other = self._makeOne(right)
+            self.assertEqual(list(bitmap.intersection(other)),
+                             sorted(left & right))
+            self.assertEqual(list(bitmap.difference(other)),
+                             sorted(left - right))
+
+    def test_to_set(self):
+        from BTrees import family32
+        docids = self._docids()[:-1]
+        result = self._makeOne(docids).to_set(family32)
+        self.assertEqual(type(result), family32.IF.Set)
+        self.assertEqual(list(result), docids)
+        self.assertEqual(list(self._makeOne().to_set()), [])
+
+    def test_to_set_wo_numpy(self):
+        from . import numpy
+        import hypatia.bitmap
+        docids = self._docids()
+        bitmap = self._makeOne(docids)
+        try:
+            hypatia.bitmap.numpy = None
+            self.assertEqual(list(bitmap.to_set()), docids)
+        finally:
+            hypatia.bitmap.numpy = numpy
+
+    def test_getstate_and_setstate(self):
+        docids = self._docids()
+        bitmap = self._makeOne(docids)
+        other = self._makeOne()
+        state = bitmap.__getstate__()
+        self.assertEqual(type(state), bytes)
+        other.__setstate__(state)
+        self.assertEqual(list(other), docids)
+
+    def test_setstate_unknown_version(self):
+        state = self._makeOne([1, 2]).__getstate__()
+        other = self._makeOne()
+        self.assertRaises(ValueError, other.__setstate__, b'\x02' + state[1:])
+
+    def test_persistence(self):
+        import transaction
+        from ZODB import DB
+        from ZODB.MappingStorage import MappingStorage
+        db = DB(MappingStorage())
+        try:
+            conn = db.open()
+            conn.root()['bitmap'] = bitmap = self._makeOne([1, 70000])
+            transaction.commit()
+            bitmap.insert(2)
+            transaction.commit()
+            conn2 = db.open()
+            self.assertEqual(list(conn2.root()['bitmap']), [1, 2, 70000])
+            transaction.abort()
+        finally:
+            db.close()
+
+class Test_multiunion(unittest.TestCase):
+
+    def _callFUT(self, bitmaps):
+        from . import multiunion
+        return multiunion(bitmaps)
+
+    def test_it(self):
+        from . import Bitmap
+        bitmaps = [Bitmap(range(start, 20000, 7)) for start in range(3)]
+        bitmaps.append(Bitmap([1, 70000]))
+        bitmaps.append(Bitmap([3, 70000, 70001]))
+        expected = set()
+        for bitmap in bitmaps:
+            expected.update(bitmap)
+        self.assertEqual(list(self._callFUT(bitmaps)), sorted(expected))
+        self.assertEqual(list(self._callFUT([])), [])
+
+class Test_union_postings(unittest.TestCase):
+
+    def _callFUT(self, sets, family=None):
+        from . import union_postings
+        return union_postings(sets, family)
+
+    def test_it(self):
+        from BTrees import family64
+        from . import Bitmap
+        IF = family64.IF
+        result = self._callFUT(
+            [IF.TreeSet([1, 5]), Bitmap([2, 5]), Bitmap([9]), IF.Set([3])])
+        self.assertEqual(list(result), [1, 2, 3, 5, 9])
+        self.assertEqual(list(self._callFUT([IF.Set([3])])), [3])
+        self.assertEqual(list(self._callFUT([])), [])
+
+class Test_intersect_postings(unittest.TestCase):
+
+    def _callFUT(self, sets, family=None):
+        from . import intersect_postings
+        return intersect_postings(sets, family)
+
+    def test_it(self):
+        from BTrees import family64
+        from . import Bitmap
+        IF = family64.IF
+        result = self._callFUT(
+            [Bitmap(range(10)), IF.TreeSet([1, 5, 12]), Bitmap([1, 5, 9])])
+        self.assertEqual(list(result), [1, 5])
+        result = self._callFUT([Bitmap(range(10)), Bitmap([1, 12])])
+        self.assertEqual(list(result), [1])
+        result = self._callFUT([IF.Set([1, 2]), IF.Set([2, 3])])
+        self.assertEqual(list(result), [2])
+        result = self._callFUT([IF.Set([1]), IF.Set([2]), Bitmap([1])])
+        self.assertEqual(list(result), [])
+        result = self._callFUT([Bitmap([1]), Bitmap([2]), Bitmap([1, 2])])
+        self.assertEqual(list(result), [])
+        self.assertEqual(list(self._callFUT([])), [])
@@ -1,11 +1,17 @@
+import collections
+import functools
 import operator
+import threading
 
 import BTrees
+from BTrees.Length import Length
+from persistent import Persistent
 from persistent.mapping import PersistentMapping
 from zope.interface import implementer
 
 from ..interfaces import ICatalog
 from ..interfaces import ICatalogQuery
+from ..query import clear_query_cache
 from ..query import parse_query
 
 @implementer(ICatalog)
@@ -13,20 +19,69 @@ class Catalog(PersistentMapping):
 
     family = BTrees.family64
 
+    # a DocidMapper translating the document ids passed to the catalog
+    # into the ids its indexes use, or None (see enable_docid_mapping)
+    docid_mapper = None
+
     def __init__(self, family=None):
         PersistentMapping.__init__(self)
         if family is not None:
             self.family = family
 
+    def enable_docid_mapping(self):
+        """Index documents under dense internal ids.
+
+        The document ids passed to ``index_doc``, ``index_docs``,
+        ``reindex_doc`` and ``unindex_doc`` are then translated by the
+        catalog's ``docid_mapper`` (a :class:`DocidMapper`) into ids
+        numbered from 0, which indexes may use to address arrays and
+        bitmaps.  The results of :class:`CatalogQuery` are translated back,
+        as are those of queries executed by the catalog's indexes, which
+        get the mapper as their ``docid_mapper``, and
+        ``FacetIndex.counts`` translates the document ids it is passed.
+        Other methods of the indexes (``apply``, ``sort``, ``docids``,
+        ``document_repr``...) take and return internal ids.  Documents
+        already indexed (or recorded as not indexed) would be lost, so the
+        indexes of the catalog must be empty.
+        """
+        if self.docid_mapper is not None:
+            return
+        for index in self.values():
+            docids_count = getattr(index, 'docids_count', None)
+            if docids_count is not None and docids_count():
+                raise ValueError(
+                    'Document ids can only be mapped in an empty catalog')
+        self._set_docid_mapper(DocidMapper(self.family))
+
+    def _set_docid_mapper(self, mapper):
+        self.docid_mapper = mapper
+        for index in self.values():
+            index.docid_mapper = mapper
+
     def __setitem__(self, name, index):
         index.__name__ = name
+        if self.docid_mapper is not None:
+            index.docid_mapper = self.docid_mapper
+        clear_query_cache(self)
         return PersistentMapping.__setitem__(self, name, index)
 
+    def __delitem__(self, name):
+        index = self[name]
+        if getattr(index, 'docid_mapper', None) is not None:
+            index.docid_mapper = None
+        clear_query_cache(self)
+        return PersistentMapping.__delitem__(self, name)
+
     def reset(self):
         """Clear all indexes in this catalog.
+
+        If the catalog maps document ids, its mapper is replaced by an
+        empty one.
         """
         for index in self.values():
             index.reset()
+        if self.docid_mapper is not None:
+            self._set_docid_mapper(DocidMapper(self.family))
 
     def index_doc(self, docid, obj):
         """Register a document  in indexes of this catalog.
@@ -35,15 +90,91 @@ class Catalog(PersistentMapping):
         using the document id ``docid``.
         """
         assertint(docid)
+        if self.docid_mapper is not None:
+            docid = self.docid_mapper.add(docid)
         for index in self.values():
             index.index_doc(docid, obj)
 
+    def index_docs(self, docs, executor=None, chunksize=100, prefetch=8):
+        """Register several documents in indexes of this catalog.
+
+        ``docs`` is an iterable of ``(docid, obj)`` pairs; if a docid isn't
+        an integer, ValueError is raised before any document is indexed.
+        Indexes which provide an ``index_docs`` method index the documents
+        in bulk, which is much faster than calling ``index_doc`` for each
+        of them when loading many documents; other indexes index them one
+        by one.
+
+        If ``executor`` (a :class:`concurrent.futures.Executor`) is passed,
+        the documents are indexed in chunks of ``chunksize``: the values
+        indexes extract from the documents of a chunk (via their
+        ``extractor`` method, which runs the discriminator and, for text
+        indexes, the lexicon pipeline) are computed by the executor, while
+        the indexes are only changed by the calling thread.  Up to
+        ``prefetch`` chunks are extracted ahead of the indexing.  The
+        documents and discriminators must be safe to use from the
+        executor's workers; with a process pool, they, and the lexicon
+        pipeline elements, must be picklable.  Don't pass persistent
+        documents: their connection can't be used by other threads.
+        """
+        docs = list(docs)
+        for docid, obj in docs:
+            assertint(docid)
+        if executor is not None:
+            return self._index_docs_concurrently(
+                docs, executor, chunksize, prefetch)
+        docs = self._map_docs(docs)
+        for index in self.values():
+            _index_docs(index, docs)
+
+    def _index_docs_concurrently(self, docs, executor, chunksize, prefetch):
+        indexes = list(self.values())
+        # indexes without an extractor get the documents themselves
+        extracting = [getattr(index, 'extractor', None) is not None
+                      for index in indexes]
+        extract = functools.partial(
+            _extract,
+            [index.extractor() for index, extracts in
+             zip(indexes, extracting) if extracts])
+
+        def index_chunk(chunk, future):
+            extracted = iter(future.result())
+            docids = [docid for docid, obj in chunk]
+            for index, extracts in zip(indexes, extracting):
+                if extracts:
+                    _index_docs(index, list(zip(docids, next(extracted))))
+                else:
+                    _index_docs(index, chunk)
+
+        pending = collections.deque()
+        for start in range(0, len(docs), chunksize):
+            chunk = self._map_docs(docs[start:start + chunksize])
+            future = executor.submit(extract, [obj for docid, obj in chunk])
+            pending.append((chunk, future))
+            if len(pending) > prefetch:
+                index_chunk(*pending.popleft())
+        while pending:
+            index_chunk(*pending.popleft())
+
+    def _map_docs(self, docs):
+        mapper = self.docid_mapper
+        if mapper is None:
+            return docs
+        return [(mapper.add(docid), obj) for docid, obj in docs]
+
     def unindex_doc(self, docid):
         """Unregister the document id from indexes of this catalog.
         """
         assertint(docid)
+        mapper = self.docid_mapper
+        if mapper is not None:
+            external, docid = docid, mapper.internal(docid)
+            if docid is None:
+                return
         for index in self.values():
             index.unindex_doc(docid)
+        if mapper is not None:
+            mapper.remove(external)
 
     def reindex_doc(self, docid, obj):
         """ Reindex the document referenced by docid.
@@ -55,9 +186,89 @@ class Catalog(PersistentMapping):
         can override the method that this API calls to do less work.
         """
         assertint(docid)
+        if self.docid_mapper is not None:
+            docid = self.docid_mapper.add(docid)
         for index in self.values():
             index.reindex_doc(docid, obj)
 
+def _index_docs(index, docs):
+    index_docs = getattr(index, 'index_docs', None)
+    if index_docs is None:
+        for docid, obj in docs:
+            index.index_doc(docid, obj)
+    else:
+        index_docs(docs)
+
+def _extract(extractors, objs):
+    # runs in an executor: return, for each extractor, the values it
+    # extracts from ``objs``
+    return [[extractor(obj) for obj in objs] for extractor in extractors]
+
+
+class DocidMapper(Persistent):
+    """ Map document ids to dense internal ids.
+
+    Internal ids are allocated from 0 up; the ids of removed documents are
+    reused, smallest first, so that they stay below ``size()``.
+    """
+
+    def __init__(self, family=None):
+        if family is None:
+            family = BTrees.family64
+        self.family = family
+        self._internal = family.II.BTree() # docid -> internal id
+        self._external = family.II.BTree() # internal id -> docid
+        self._free = family.II.TreeSet()   # internal ids of removed docs
+        self._size = Length(0)
+
+    def __len__(self):
+        return len(self._internal)
+
+    def size(self):
+        """ Return one more than the largest internal id allocated. """
+        return self._size()
+
+    def add(self, docid):
+        """ Return the internal id of ``docid``, allocating one if needed.
+        """
+        internal = self._internal.get(docid)
+        if internal is None:
+            if self._free:
+                internal = self._free.minKey()
+                self._free.remove(internal)
+            else:
+                internal = self._size()
+                self._size.change(1)
+            self._internal[docid] = internal
+            self._external[internal] = docid
+        return internal
+
+    def remove(self, docid):
+        """ Free the internal id of ``docid``, if it has one. """
+        internal = self._internal.pop(docid, None)
+        if internal is not None:
+            del self._external[internal]
+            self._free.add(internal)
+
+    def internal(self, docid, default=None):
+        """ Return the internal id of ``docid``, or ``default``. """
+        return self._internal.get(docid, default)
+
+    def external(self, internal):
+        """ Return the document id whose internal id is ``internal``. """
+        return self._external[internal]
+
+    def to_internal(self, docids):
+        """ Return a list of the internal ids of the mapped ``docids``. """
+        get = self._internal.get
+        internals = [get(docid) for docid in docids]
+        return [internal for internal in internals if internal is not None]
+
+    def to_external(self, internals):
+        """ Return a list of the document ids of ``internals``. """
+        external = self._external
+        return [external[internal] for internal in internals]
+
 def assertint(docid):
     if not isinstance(docid, int):
         raise ValueError('%r is not an integer value; document ids must be '
@@ -74,15 +285,33 @@ class CatalogQuery(object):
 
     family = BTrees.family64
     
-    def __init__(self, catalog, family=None):
+    def __init__(self, catalog, family=None, cache=None):
         self.catalog = catalog
         if family is not None:
             self.family = family
+        # an optional ResultCache
+        self.cache = cache
 
     def sort(self, docidset, sort_index, limit=None, sort_type=None,
              reverse=False):
         """Return ``(num, sorted-resultseq)`` for the concrete docidset.
         """
+        mapper = getattr(self.catalog, 'docid_mapper', None)
+        if mapper is not None:
+            docidset = self.family.IF.TreeSet(mapper.to_internal(docidset))
+        return self._external(
+            *self._sort(docidset, sort_index, limit, sort_type, reverse))
+
+    def _external(self, numdocs, result):
+        # translate internal ids back to the catalog's document ids (when
+        # the catalog maps them, the result is then a list)
+        mapper = getattr(self.catalog, 'docid_mapper', None)
+        if mapper is None:
+            return numdocs, result
+        return numdocs, mapper.to_external(result)
+
+    def _sort(self, docidset, sort_index, limit=None, sort_type=None,
+              reverse=False):
         result = docidset
         numdocs = len(docidset)
 
@@ -168,7 +397,8 @@ class CatalogQuery(object):
                     # empty results
                     return 0, result
 
-        return self.sort(result, sort_index, limit, sort_type, reverse)
+        return self._external(
+            *self._sort(result, sort_index, limit, sort_type, reverse))
 
     def query(self, queryobject, sort_index=None, limit=None, sort_type=None,
               reverse=False, names=None):
@@ -178,8 +408,101 @@ class CatalogQuery(object):
         """
         if isinstance(queryobject, str):
             queryobject = parse_query(queryobject, self.catalog)
-        results = queryobject._apply(names)
-        return self.sort(results, sort_index, limit, sort_type, reverse)
+        if self.cache is None:
+            results = queryobject._apply(names)
+        else:
+            results = self.cache.apply(queryobject, names)
+        return self._external(
+            *self._sort(results, sort_index, limit, sort_type, reverse))
 
     __call__ = query
 
+
+class ResultCache(object):
+    """ Least recently used cache of the docids matched by queries.
+
+    Pass an instance as the ``cache`` argument of :class:`CatalogQuery` to
+    have it reuse the results of queries it has already applied.  Entries
+    are keyed on the query tree (the order of the subqueries of ``And`` and
+    ``Or`` doesn't matter) with its names bound, and are valid as long as
+    the ``generation()`` of each index the query uses stays the same, so
+    changing an index only invalidates the results of the queries which use
+    it.  Queries using values which aren't hashable, or indexes which have
+    no ``generation`` method or whose ``generation()`` is ``None`` (such as
+    indexes with uncommitted changes, or which don't count their changes),
+    aren't cached.
+
+    At most ``maxsize`` entries are kept, whose docids take about
+    ``maxbytes`` bytes at most.  Cached results are shared, so they must
+    not be mutated.
+    """
+
+    entry_overhead = 100 # approximate size of an entry, less its docids
+    docid_size = 8
+
+    def __init__(self, maxsize=128, maxbytes=16 * 1024 * 1024):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def apply(self, query, names=None):
+        """ Return ``query._apply(names)``, from the cache if possible. """
+        key = query._cache_key(names)
+        if key is None:
+            return query._apply(names)
+        generations = _generations(query)
+        if generations is not None:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] == generations:
+                    self._entries.move_to_end(key)
+                    return entry[1]
+        result = query._apply(names)
+        if generations is not None:
+            self._set(key, generations, result)
+        return result
+
+    def _set(self, key, generations, result):
+        size = self.entry_overhead + len(result) * self.docid_size
+        if size > self.maxbytes or not self.maxsize:
+            return
+        with self._lock:
+            entries = self._entries
+            old = entries.pop(key, None)
+            if old is not None:
+                self.size -= old[2]
+            entries[key] = (generations, result, size)
+            self.size += size
+            while len(entries) > self.maxsize or self.size > self.maxbytes:
+                _, (_, _, evicted) = entries.popitem(last=False)
+                self.size -= evicted
+
+    def clear(self):
+        """ Drop all the entries of the cache. """
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+def _generations(query):
+    # Return the generations of the indexes used by ``query``, or None if
+    # one of them has none.
+    generations = []
+    queries = [query]
+    while queries:
+        query = queries.pop()
+        index = getattr(query, 'index', None)
+        if index is not None:
+            generation = getattr(index, 'generation', None)
+            if generation is None:
+                return None
+            generation = generation()
+            if generation is None:
+                return None
+            generations.append(generation)
+        queries.extend(query.iter_children())
+    return tuple(generations)
@@ -50,6 +50,104 @@ class TestCatalog(unittest.TestCase):
         self.assertEqual(idx.docid, 1)
         self.assertEqual(idx.value, 'value')
 
+    def test_index_docs(self):
+        from ..field import FieldIndex
+        catalog = self._makeOne()
+        idx = DummyIndex()
+        catalog['name'] = idx
+        catalog['field'] = FieldIndex(lambda obj, default: obj)
+        catalog.index_docs((docid, 'value%s' % docid) for docid in (1, 2))
+        self.assertEqual(idx.docid, 2)
+        self.assertEqual(idx.value, 'value2')
+        self.assertEqual(list(catalog['field'].applyEq('value1')), [1])
+        self.assertEqual(list(catalog['field'].docids()), [1, 2])
+
+    def _makeConcurrentCatalog(self):
+        from ..field import FieldIndex
+        from ..text import TextIndex
+        def discriminator(obj, default):
+            if obj is None:
+                return default
+            return obj
+        catalog = self._makeOne()
+        catalog['field'] = FieldIndex(discriminator)
+        catalog['text'] = TextIndex(discriminator)
+        catalog['name'] = DummyIndex()
+        return catalog
+
+    def test_index_docs_executor(self):
+        from concurrent.futures import ThreadPoolExecutor
+        docs = [(docid, 'doc%s text' % (docid % 3)) for docid in range(20)]
+        docs.append((2, None))
+        docs.append((5, 'other'))
+        catalog = self._makeConcurrentCatalog()
+        catalog.index_doc(5, 'doc0')
+        expected = self._makeConcurrentCatalog()
+        expected.index_doc(5, 'doc0')
+        expected.index_docs(docs)
+        with ThreadPoolExecutor(2) as executor:
+            catalog.index_docs(iter(docs), executor=executor, chunksize=3,
+                               prefetch=2)
+        for name in ('field', 'text'):
+            index = catalog[name]
+            other = expected[name]
+            self.assertEqual(list(index.docids()), list(other.docids()))
+            self.assertEqual(list(index.not_indexed()),
+                             list(other.not_indexed()))
+        for value in ('doc0 text', 'doc1 text', 'other'):
+            self.assertEqual(list(catalog['field'].applyEq(value)),
+                             list(expected['field'].applyEq(value)))
+        for word in ('doc0', 'doc1', 'text', 'other'):
+            self.assertEqual(list(catalog['text'].applyContains(word)),
+                             list(expected['text'].applyContains(word)))
+        self.assertEqual(catalog['name'].docid, 5)
+        self.assertEqual(catalog['name'].value, 'other')
+
+    def test_index_docs_executor_indexes_in_calling_thread(self):
+        import threading
+        docs = [(docid, 'doc%s' % docid) for docid in range(10)]
+        catalog = self._makeConcurrentCatalog()
+        threads = set()
+        index_docs = catalog['field'].index_docs
+        def record(docs):
+            threads.add(threading.current_thread())
+            index_docs(docs)
+        catalog['field'].index_docs = record
+        executor = DummyExecutor()
+        catalog.index_docs(docs, executor=executor, chunksize=4, prefetch=1)
+        self.assertEqual(executor.submitted, 3)
+        self.assertEqual(threads, set([threading.current_thread()]))
+        self.assertEqual(list(catalog['field'].docids()), list(range(10)))
+
+    def test_index_docs_executor_nonint_docid(self):
+        catalog = self._makeConcurrentCatalog()
+        executor = DummyExecutor()
+        self.assertRaises(
+            ValueError, catalog.index_docs, [(1, 'value'), ('abc', 'value')],
+            executor=executor)
+        self.assertEqual(executor.submitted, 0)
+
+    def test_index_docs_executor_nonint_docid_in_later_chunk(self):
+        catalog = self._makeConcurrentCatalog()
+        catalog.enable_docid_mapping()
+        executor = DummyExecutor()
+        docs = [(1, 'value'), (2, 'value'), ('abc', 'value')]
+        self.assertRaises(
+            ValueError, catalog.index_docs, iter(docs), executor=executor,
+            chunksize=1, prefetch=0)
+        # the catalog is left untouched
+        self.assertEqual(executor.submitted, 0)
+        self.assertEqual(list(catalog['field'].docids()), [])
+        self.assertEqual(len(catalog.docid_mapper), 0)
+
+    def test_index_docs_nonint_docid(self):
+        catalog = self._makeOne()
+        idx = DummyIndex()
+        catalog['name'] = idx
+        self.assertRaises(
+            ValueError, catalog.index_docs, [(1, 'value'), ('abc', 'value')])
+        self.assertEqual(idx.docid, None)
+
     def test_index_doc_nonint_docid(self):
         catalog = self._makeOne()
         idx = DummyIndex()
@@ -71,6 +169,104 @@ class TestCatalog(unittest.TestCase):
         catalog.unindex_doc(1)
         self.assertEqual(idx.unindexed, 1)
 
+    def test_setitem_clears_query_cache(self):
+        from ..query import parse_query
+        catalog = self._makeOne()
+        catalog['name'] = DummyIndex()
+        query = parse_query('name == 1', catalog, cache=True)
+        self.assertTrue(
+            parse_query('name == 1', catalog, cache=True) is query)
+        catalog['name'] = idx = DummyIndex()
+        query = parse_query('name == 1', catalog, cache=True)
+        self.assertTrue(query.index is idx)
+
+    def test_delitem_clears_query_cache(self):
+        from ..query import parse_query
+        catalog = self._makeOne()
+        catalog['name'] = DummyIndex()
+        parse_query('name == 1', catalog, cache=True)
+        del catalog['name']
+        self.assertRaises(KeyError, parse_query, 'name == 1', catalog,
+                          cache=True)
+
+    def _makeMappedCatalog(self):
+        from ..field import FieldIndex
+        catalog = self._makeOne()
+        catalog['field'] = FieldIndex(lambda obj, default: obj)
+        catalog.enable_docid_mapping()
+        return catalog
+
+    def test_enable_docid_mapping(self):
+        catalog = self._makeMappedCatalog()
+        mapper = catalog.docid_mapper
+        catalog.enable_docid_mapping()
+        self.assertTrue(catalog.docid_mapper is mapper)
+        catalog.index_doc(1000, 'a')
+        catalog.index_docs([(5000, 'b'), (3000, 'a')])
+        catalog.reindex_doc(2000, 'b')
+        self.assertEqual(sorted(catalog['field'].docids()), [0, 1, 2, 3])
+        self.assertEqual(list(catalog['field'].applyEq('a')), [0, 2])
+        catalog.unindex_doc(5000)
+        catalog.unindex_doc(4000)
+        self.assertEqual(list(catalog['field'].applyEq('b')), [3])
+        self.assertEqual(len(mapper), 3)
+        catalog.index_doc(4000, 'c')
+        self.assertEqual(list(catalog['field'].applyEq('c')), [1])
+
+    def test_enable_docid_mapping_sets_indexes_mapper(self):
+        from ..field import FieldIndex
+        catalog = self._makeMappedCatalog()
+        mapper = catalog.docid_mapper
+        self.assertTrue(catalog['field'].docid_mapper is mapper)
+        catalog['other'] = index = FieldIndex(lambda obj, default: obj)
+        self.assertTrue(index.docid_mapper is mapper)
+        del catalog['other']
+        self.assertEqual(index.docid_mapper, None)
+
+    def test_enable_docid_mapping_execute(self):
+        catalog = self._makeMappedCatalog()
+        catalog.index_docs([(5000, 'b'), (3000, 'a'), (4000, 'a')])
+        index = catalog['field']
+        self.assertEqual(list(index.eq('a').execute().ids), [1, 2])
+        self.assertEqual(list(index.eq('a').execute()), [3000, 4000])
+        query = index.eq('a') | index.eq('b')
+        self.assertEqual(sorted(query.execute()), [3000, 4000, 5000])
+        self.assertEqual(list(index.noteq('a').execute()), [5000])
+
+    def test_reset_w_docid_mapping(self):
+        catalog = self._makeMappedCatalog()
+        mapper = catalog.docid_mapper
+        catalog.index_docs([(5000, 'b'), (3000, 'a')])
+        catalog.reset()
+        self.assertFalse(catalog.docid_mapper is mapper)
+        self.assertTrue(catalog['field'].docid_mapper is catalog.docid_mapper)
+        self.assertEqual(len(catalog.docid_mapper), 0)
+        catalog.index_doc(4000, 'a')
+        self.assertEqual(list(catalog['field'].applyEq('a')), [0])
+        self.assertEqual(list(catalog['field'].eq('a').execute()), [4000])
+
+    def test_enable_docid_mapping_executor(self):
+        catalog = self._makeMappedCatalog()
+        catalog.index_docs([(5000, 'b'), (3000, 'a')],
+                           executor=DummyExecutor())
+        self.assertEqual(list(catalog['field'].applyEq('a')), [1])
+
+    def test_enable_docid_mapping_not_empty(self):
+        from ..field import FieldIndex
+        catalog = self._makeOne()
+        catalog['field'] = FieldIndex(lambda obj, default: obj)
+        catalog['name'] = DummyIndex()
+        catalog.index_doc(1, 'a')
+        self.assertRaises(ValueError, catalog.enable_docid_mapping)
+
+    def test_enable_docid_mapping_not_indexed(self):
+        from ..field import FieldIndex
+        catalog = self._makeOne()
+        catalog['field'] = FieldIndex(lambda obj, default: default)
+        catalog.index_doc(1, 'a')
+        self.assertEqual(catalog['field'].indexed_count(), 0)
+        self.assertRaises(ValueError, catalog.enable_docid_mapping)
+
 class TestCatalogQuery(unittest.TestCase):
     def _makeOne(self, catalog, family=None):
         from . import CatalogQuery
@@ -300,6 +496,252 @@ class TestCatalogQuery(unittest.TestCase):
             index_query_order=['field', 'keyword', 'text']
         )
 
+    def test_docid_mapping(self):
+        from ..field import FieldIndex
+        from ..query import Eq
+        catalog = self._makeCatalog()
+        catalog['field'] = FieldIndex(lambda obj, default: obj)
+        catalog.enable_docid_mapping()
+        for docid, value in [(30, 'a'), (10, 'b'), (20, 'a'), (40, 'c')]:
+            catalog.index_doc(docid, value)
+        q = self._makeOne(catalog)
+        numdocs, result = q('field == "a"')
+        self.assertEqual((numdocs, result), (2, [30, 20]))
+        numdocs, result = q('field in any(["a", "c"])', sort_index='field',
+                            reverse=True)
+        self.assertEqual((numdocs, result), (3, [40, 30, 20]))
+        numdocs, result = q.search(field='b')
+        self.assertEqual((numdocs, result), (1, [10]))
+        numdocs, result = q.sort([10, 20, 30, 50], 'field')
+        self.assertEqual((numdocs, result), (3, [30, 20, 10]))
+        rs = Eq(catalog['field'], 'a').execute(
+            docid_mapper=catalog.docid_mapper)
+        self.assertEqual(list(rs.all(resolve=False)), [30, 20])
+
+class TestResultCache(unittest.TestCase):
+    def _makeOne(self, **kw):
+        from . import ResultCache
+        return ResultCache(**kw)
+
+    def _makeIndexes(self):
+        from ..field import FieldIndex
+        def discriminator(obj, default):
+            return obj
+        index1 = FieldIndex(discriminator)
+        index2 = FieldIndex(discriminator)
+        for docid in range(10):
+            index1.index_doc(docid, docid % 2)
+            index2.index_doc(docid, docid % 3)
+        return index1, index2
+
+    def test_apply_cached(self):
+        from ..query import Eq
+        index1, index2 = self._makeIndexes()
+        cache = self._makeOne()
+        result = cache.apply(Eq(index1, 0) & Eq(index2, 0))
+        self.assertEqual(list(result), [0, 6])
+        index1._apply = lambda *arg: self.fail('applied')
+        self.assertTrue(cache.apply(Eq(index2, 0) & Eq(index1, 0)) is result)
+        self.assertEqual(len(cache), 1)
+
+    def test_apply_names_bound(self):
+        from ..query import Eq
+        from ..query import Name
+        index1, index2 = self._makeIndexes()
+        cache = self._makeOne()
+        query = Eq(index1, Name('value'))
+        self.assertEqual(list(cache.apply(query, {'value': 0})),
+                         [0, 2, 4, 6, 8])
+        self.assertEqual(list(cache.apply(query, {'value': 1})),
+                         [1, 3, 5, 7, 9])
+        self.assertEqual(len(cache), 2)
+
+    def test_apply_invalidated_by_used_index(self):
+        from ..query import Eq
+        index1, index2 = self._makeIndexes()
+        cache = self._makeOne()
+        query1 = Eq(index1, 0)
+        query2 = Eq(index2, 0)
+        result1 = cache.apply(query1)
+        result2 = cache.apply(query2)
+        index2.index_doc(10, 0)
+        self.assertTrue(cache.apply(query1) is result1)
+        result = cache.apply(query2)
+        self.assertFalse(result is result2)
+        self.assertEqual(list(result), [0, 3, 6, 9, 10])
+
+    def test_apply_uncacheable(self):
+        from ..query import Eq
+        index1, index2 = self._makeIndexes()
+        index1.applyEq = lambda value: [1]
+        index3 = DummyIndex()
+        index3.applyEq = lambda value: [1]
+        cache = self._makeOne()
+        self.assertEqual(cache.apply(Eq(index1, {})), [1])
+        self.assertEqual(cache.apply(Eq(index3, 0)), [1])
+        self.assertEqual(len(cache), 0)
+
+    def test_apply_uncommitted_changes(self):
+        from ..query import Eq
+        index1, index2 = self._makeIndexes()
+        index1.generation = lambda: None
+        cache = self._makeOne()
+        self.assertEqual(list(cache.apply(Eq(index1, 0))), [0, 2, 4, 6, 8])
+        self.assertEqual(len(cache), 0)
+
+    def test_apply_maxsize(self):
+        from ..query import Eq
+        index1, index2 = self._makeIndexes()
+        cache = self._makeOne(maxsize=2)
+        query = Eq(index1, 0)
+        cache.apply(query)
+        cache.apply(Eq(index1, 1))
+        cache.apply(query)
+        cache.apply(Eq(index2, 0))
+        self.assertEqual(len(cache), 2)
+        index1._apply = lambda *arg: self.fail('applied')
+        cache.apply(query)
+
+    def test_apply_maxbytes(self):
+        from ..query import Eq
+        from ..query import InRange
+        index1, index2 = self._makeIndexes()
+        cache = self._makeOne(maxbytes=150)
+        cache.apply(Eq(index1, 0))
+        self.assertEqual(cache.size, 140)
+        cache.apply(InRange(index2, 0, 2))
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.size, 140)
+        cache.apply(Eq(index2, 1))
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.size, 124)
+
+    def test_clear(self):
+        from ..query import Eq
+        index1, index2 = self._makeIndexes()
+        cache = self._makeOne()
+        cache.apply(Eq(index1, 0))
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
+
+    def test_catalog_query(self):
+        from . import Catalog
+        from . import CatalogQuery
+        catalog = Catalog()
+        catalog['index1'], catalog['index2'] = self._makeIndexes()
+        cache = self._makeOne()
+        q = CatalogQuery(catalog, cache=cache)
+        numdocs, result = q('index1 == 0 and index2 == 0')
+        self.assertEqual(list(result), [0, 6])
+        self.assertEqual(len(cache), 1)
+        catalog.index_doc(12, 0)
+        numdocs, result = q('index1 == 0 and index2 == 0')
+        self.assertEqual(list(result), [0, 6, 12])
+
+    def test_catalog_query_index_wo_generations(self):
+        from ..util import BaseIndexMixin
+        from . import Catalog
+        from . import CatalogQuery
+        class CustomIndex(BaseIndexMixin):
+            # doesn't call _bump_generation when it changes
+            def __init__(self):
+                self.values = {}
+            def index_doc(self, docid, obj):
+                self.values[docid] = obj
+            def unindex_doc(self, docid):
+                self.values.pop(docid, None)
+            def applyEq(self, value):
+                return self.family.IF.Set(
+                    [docid for docid, v in self.values.items() if v == value])
+        catalog = Catalog()
+        catalog['index1'], catalog['index2'] = self._makeIndexes()
+        catalog['custom'] = custom = CustomIndex()
+        self.assertEqual(custom.generation(), None)
+        cache = self._makeOne()
+        q = CatalogQuery(catalog, cache=cache)
+        numdocs, result = q('custom == 0')
+        self.assertEqual(list(result), [])
+        catalog.index_doc(12, 0)
+        numdocs, result = q('custom == 0 and index1 == 0')
+        self.assertEqual(list(result), [12])
+        self.assertEqual(len(cache), 0)
+        catalog.unindex_doc(12)
+        numdocs, result = q('custom == 0 and index1 == 0')
+        self.assertEqual(list(result), [])
+
+class TestDocidMapper(unittest.TestCase):
+    def _makeOne(self, family=None):
+        from . import DocidMapper
+        return DocidMapper(family)
+
+    def test_ctor_defaults(self):
+        from BTrees import family64
+        mapper = self._makeOne()
+        self.assertTrue(mapper.family is family64)
+        self.assertEqual(len(mapper), 0)
+        self.assertEqual(mapper.size(), 0)
+
+    def test_add(self):
+        mapper = self._makeOne()
+        self.assertEqual(mapper.add(2**40), 0)
+        self.assertEqual(mapper.add(7), 1)
+        self.assertEqual(mapper.add(2**40), 0)
+        self.assertEqual(mapper.internal(7), 1)
+        self.assertEqual(mapper.internal(8), None)
+        self.assertEqual(mapper.external(0), 2**40)
+        self.assertEqual(len(mapper), 2)
+        self.assertEqual(mapper.size(), 2)
+
+    def test_add_doesnt_change_mapper(self):
+        # the size is a Length, so that adding documents concurrently
+        # doesn't conflict on the mapper itself
+        import transaction
+        from ZODB import DB
+        from ZODB.MappingStorage import MappingStorage
+        db = DB(MappingStorage())
+        try:
+            conn = db.open()
+            conn.root()['mapper'] = mapper = self._makeOne()
+            transaction.commit()
+            mapper.add(7)
+            self.assertFalse(mapper._p_changed)
+            self.assertEqual(mapper.size(), 1)
+            transaction.commit()
+        finally:
+            db.close()
+
+    def test_remove_reuses_internal_ids(self):
+        mapper = self._makeOne()
+        for docid in (10, 20, 30, 40):
+            mapper.add(docid)
+        mapper.remove(40)
+        mapper.remove(20)
+        mapper.remove(50)
+        self.assertEqual(len(mapper), 2)
+        self.assertRaises(KeyError, mapper.external, 1)
+        self.assertEqual(mapper.add(50), 1)
+        self.assertEqual(mapper.add(60), 3)
+        self.assertEqual(mapper.add(70), 4)
+        self.assertEqual(mapper.size(), 5)
+
+    def test_to_internal_and_to_external(self):
+        mapper = self._makeOne()
+        for docid in (10, 20, 30):
+            mapper.add(docid)
+        self.assertEqual(mapper.to_internal([30, 40, 10]), [2, 0])
+        self.assertEqual(mapper.to_external([2, 0]), [30, 10])
+
+class DummyExecutor(object):
+    submitted = 0
+
+    def submit(self, fn, *args):
+        from concurrent.futures import Future
+        self.submitted += 1
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
 from ..interfaces import IIndex
 from zope.interface import implementer
 
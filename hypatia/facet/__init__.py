@@ -3,6 +3,7 @@ from zope.interface import implementer
 
 from ..keyword import KeywordIndex
 from ..interfaces import IIndex
+from ..util import ResultSet
 
 _marker = ()
 
@@ -47,6 +48,11 @@ class FacetIndex(KeywordIndex):
             return repr(result)
         return default
 
+    def index_docs(self, docs):
+        # facet specifiers are expanded document by document
+        for docid, obj in docs:
+            self.index_doc(docid, obj)
+
     def index_doc(self, docid, obj):
         """ Pass in an integer document id and an object supporting a
         sequence of facet specifiers ala ['style:gucci:handbag'] via
@@ -57,6 +63,8 @@ class FacetIndex(KeywordIndex):
             # unindex the previous value
             self.unindex_doc(docid)
             self._not_indexed.add(docid)
+            self._add_docid(docid)
+            self._bump_generation()
             return None
 
         if docid in self._not_indexed:
@@ -90,6 +98,11 @@ class FacetIndex(KeywordIndex):
 
         if changed:
             self._num_docs.change(1)
+            self._add_docid(docid)
+        else:
+            # it may have been removed from the unindexed docids
+            self._remove_docid(docid)
+        self._bump_generation()
 
         return value
 
@@ -97,7 +110,17 @@ class FacetIndex(KeywordIndex):
         """ Given a set of docids (usually returned from query),
         provide count information for further facet narrowing.
         Optionally omit count information for facets and their
-        ancestors that are in 'omit_facets' (a sequence of facets)"""
+        ancestors that are in 'omit_facets' (a sequence of facets)
+
+        If the index's catalog maps document ids (see
+        ``Catalog.enable_docid_mapping``), ``docids`` are document ids,
+        such as those returned by ``CatalogQuery``, unless they are a
+        result set. """
+
+        if isinstance(docids, ResultSet):
+            docids = docids.ids
+        elif self.docid_mapper is not None:
+            docids = self.docid_mapper.to_internal(docids)
 
         effective_omits = self.family.OO.Set()
 
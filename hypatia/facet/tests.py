@@ -232,6 +232,26 @@ class TestCatalogFacetIndex(unittest.TestCase):
         counts = index.counts(result, search)
         self.assertEqual(counts, {'size:large':1})
 
+    def test_counts_w_docid_mapping(self):
+        from ..catalog import Catalog
+        from ..catalog import CatalogQuery
+        catalog = Catalog()
+        catalog['facets'] = index = self._makeOne()
+        catalog.enable_docid_mapping()
+        catalog.index_doc(5000, ['size:large'])
+        catalog.index_doc(3000, ['color:red', 'style:gucci'])
+        catalog.index_doc(4000, ['color:blue', 'style:gucci:dress'])
+        numdocs, result = CatalogQuery(catalog)(
+            'facets == "style:gucci"')
+        self.assertEqual(sorted(result), [3000, 4000])
+        expected = {'style': 2, 'style:gucci': 2, 'style:gucci:dress': 1,
+                    'color': 2, 'color:red': 1, 'color:blue': 1}
+        self.assertEqual(index.counts(result), expected)
+        # unknown document ids are ignored
+        self.assertEqual(index.counts([3000, 4000, 1, 2]), expected)
+        resultset = index.eq('style:gucci').execute()
+        self.assertEqual(index.counts(resultset), expected)
+
     def test_indexed(self):
         index = self._makeOne()
         self._populateIndex(index)
@@ -250,6 +270,36 @@ class TestCatalogFacetIndex(unittest.TestCase):
         self.assertEqual(index.index_doc(20, 'foo'), 'foo')
         self.assertFalse(20 in index._not_indexed)
 
+    def test_index_docs(self):
+        index = self._makeOne()
+        index.index_docs([(1, ['price:0-100', 'color:blue']), (2, ['size'])])
+        self.assertEqual(list(index.search(['color:blue'])), [1])
+        self.assertEqual(list(index.search(['size'])), [2])
+        self.assertEqual(index.docids_count(), 2)
+
+    def test_generation(self):
+        index = self._makeOne()
+        generation = index.generation()
+        index.index_doc(1, ['price:0-100'])
+        self.assertTrue(index.generation() > generation)
+        generation = index.generation()
+        index.unindex_doc(1)
+        self.assertTrue(index.generation() > generation)
+
+    def test_docids_count(self):
+        def discriminator(obj, default):
+            if obj is _marker:
+                return default
+            return obj
+        index = self._makeOne(discriminator)
+        self._populateIndex(index)
+        index.index_doc(5, _marker)
+        self.assertEqual(index.docids_count(), 5)
+        index.index_doc(5, ['unknown'])
+        index.index_doc(4, ['unknown'])
+        self.assertEqual(index.docids_count(), 3)
+        self.assertEqual(list(index.docids()), [1, 2, 3])
+
 
 @pytest.mark.parametrize(
     "value, expected", [
@@ -14,6 +14,7 @@
 """Field index
 """
 import bisect
+import datetime
 from functools import total_ordering
 import heapq
 from itertools import islice
@@ -26,8 +27,16 @@ from .. import interfaces
 from .. import RangeValue
 from .. import query
 
+from ..bitmap import Bitmap
+from ..bitmap import union_postings
 from ..exc import Unsortable
 from ..util import BaseIndexMixin
+from ..util import _MISSING_KEY
+
+try:
+    import numpy
+except ImportError: #pragma NO COVERAGE
+    numpy = None
 
 _marker = []
 
@@ -65,6 +74,32 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
     - NotInRange
     """
 
+    # A reverse index probe costs about this many times more than each
+    # docid materialized by a forward index lookup (see
+    # benchmark/intersection.py).  Intersections probe the reverse index
+    # when the forward lookup would materialize more than this many docids
+    # per docid to intersect with.
+    probe_factor = 20
+
+    # If a value is referenced by at least bitmap_threshold docids, use a
+    # compressed Bitmap for that value instead of a TreeSet (None: never).
+    # Postings are converted by index_docs and optimize.
+    bitmap_threshold = None
+
+    # If true, and NumPy is available, sorts which don't ask for a
+    # particular algorithm use an array of the values of the documents,
+    # addressed by docid (see _sort_column).  The values must be numbers,
+    # dates or datetimes, and the docids dense (e.g. mapped by a
+    # hypatia.catalog.DocidMapper).
+    sort_column = False
+
+    # If true as well, the sort column holds the ranks of the values in the
+    # forward index's order rather than the values themselves, which lets
+    # it sort values of any type (strings, tuples...) by comparing numbers.
+    # New values are ranked between their neighbours; the ranks are spaced
+    # so that this rarely requires ranking all of them again.
+    sort_ranks = False
+
     def __init__(self, discriminator, family=None):
         if family is not None:
             self.family = family
@@ -83,6 +118,9 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
         self._rev_index = self.family.IO.BTree()
         self._num_docs = Length(0)
         self._not_indexed = self.family.IF.TreeSet()
+        self._reset_docids()
+        self._bump_generation()
+        self._v_column = None
 
     def unique_values(self):
         """ Return the unique values in the index for all docids as an iterable
@@ -121,6 +159,8 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
                 self.unindex_doc(docid)
                 # Store docid in set of unindexed docids
                 self._not_indexed.add(docid)
+                self._add_docid(docid)
+                self._bump_generation()
             return None
 
         if docid in self._not_indexed:
@@ -135,10 +175,13 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
             # unindex doc if present
             self.unindex_doc(docid)
 
+        self._bump_generation()
+
         # Insert into forward index.
         set = self._fwd_index.get(value)
         if set is None:
             set = self.family.IF.TreeSet()
+            self._rank_new(value)
             self._fwd_index[value] = set
             
         set.insert(docid)
@@ -148,6 +191,64 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
 
         # Insert into reverse index.
         rev_index[docid] = value
+        self._add_docid(docid)
+        self._column_set([(docid, value)])
+
+    def index_docs(self, docs):
+        """Index several documents.
+
+        ``docs`` is an iterable of ``(docid, obj)`` pairs.  The documents
+        new to the index are grouped by value, so that each forward index
+        set is built or updated once, and counters are updated once per
+        call.
+        """
+        new, known = self._split_new_docs(docs)
+        for docid, obj in known:
+            self.index_doc(docid, obj)
+
+        # value -> docids; an OOBTree compares values as the forward index
+        groups = self.family.OO.BTree()
+        rev_items = []
+        not_indexed = []
+        for docid, obj in new.items():
+            value = self.discriminate(obj, _marker)
+            if value is _marker:
+                not_indexed.append(docid)
+                continue
+            docids = groups.get(value)
+            if docids is None:
+                groups[value] = docids = []
+            docids.append(docid)
+            rev_items.append((docid, value))
+
+        if not new:
+            return
+
+        fwd_index = self._fwd_index
+        TreeSet = self.family.IF.TreeSet
+        threshold = self.bitmap_threshold
+        for value, docids in groups.items():
+            docids.sort()
+            set = fwd_index.get(value)
+            if set is None:
+                self._rank_new(value)
+                if threshold is not None and len(docids) >= threshold:
+                    fwd_index[value] = Bitmap(docids)
+                else:
+                    fwd_index[value] = TreeSet(docids)
+                continue
+            set.update(docids)
+            if (threshold is not None and not isinstance(set, Bitmap) and
+                    len(set) >= threshold):
+                fwd_index[value] = Bitmap(set)
+
+        rev_items.sort()
+        self._rev_index.update(rev_items)
+        self._column_set(rev_items)
+        self._num_docs.change(len(rev_items))
+        self._not_indexed.update(not_indexed)
+        self._add_docids(sorted(new))
+        self._bump_generation()
 
     def unindex_doc(self, docid):
         """See interface IIndexInjection.
@@ -155,6 +256,8 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
         _not_indexed = self._not_indexed
         if docid in _not_indexed:
             _not_indexed.remove(docid)
+            self._remove_docid(docid)
+            self._bump_generation()
 
         rev_index = self._rev_index
         value = rev_index.get(docid, _marker)
@@ -162,6 +265,7 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
             return # not in index
 
         del rev_index[docid]
+        self._column_set([(docid, _marker)])
 
         try:
             set = self._fwd_index[value]
@@ -174,14 +278,164 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
 
         if not set:
             del self._fwd_index[value]
+            self._rank_del(value)
 
         self._num_docs.change(-1)
+        self._remove_docid(docid)
+        self._bump_generation()
 
     def reindex_doc(self, docid, value):
         """ See interface IIndexInjection """
         # the base index's index_doc method special-cases a reindex
         return self.index_doc(docid, value)
 
+    def optimize(self):
+        """Optimize the index. Call this after changing bitmap_threshold.
+
+        This converts the forward index's postings between TreeSets and
+        Bitmaps based on bitmap_threshold.
+        """
+        fwd_index = self._fwd_index
+        TreeSet = self.family.IF.TreeSet
+        threshold = self.bitmap_threshold
+        for value, set in list(fwd_index.items()):
+            if threshold is not None and len(set) >= threshold:
+                if not isinstance(set, Bitmap):
+                    fwd_index[value] = Bitmap(set)
+            elif isinstance(set, Bitmap):
+                fwd_index[value] = TreeSet(set)
+
+    def _bump_generation(self):
+        # The sort column, if any, reflects the index at a given value of
+        # the generation counter; keep it in step with the changes made
+        # through this object (which update it), and drop it if it
+        # missed other ones.
+        column = getattr(self, '_v_column', None)
+        current = column is not None and column[0] == self._counter()
+        BaseIndexMixin._bump_generation(self)
+        if current:
+            column[0] = self._counter()
+        else:
+            self._v_column = None
+
+    def _counter(self):
+        # The generation counter, including uncommitted changes, and the
+        # serial of its last commit: after an abort, or changes committed
+        # by other connections, they differ from their values when the
+        # sort column was last updated.
+        generation = self._generation
+        if generation is None:
+            return None
+        return generation(), generation._p_serial
+
+    def _sort_column(self):
+        """ Return a NumPy array of the sort keys of the indexed documents,
+        NaN for other docids, addressed by docid, or ``None`` if there is
+        no such array.
+
+        The array is volatile (it is built from the reverse index when
+        needed, and not stored), and it is updated as documents are
+        indexed.  The keys are the values, or their ranks if
+        ``sort_ranks`` is true.  It is ``None`` if a value isn't a number,
+        date or datetime (and ``sort_ranks`` is false), or if the docids are
+        too sparse.
+        """
+        if numpy is None or not self.sort_column:
+            return None
+        column = getattr(self, '_v_column', None)
+        counter = self._counter()
+        if column is None or column[0] != counter:
+            ranks = None
+            if self.sort_ranks:
+                ranks = dict(
+                    (value, (i + 1) * RANK_GAP)
+                    for i, value in enumerate(self._fwd_index.keys()))
+            # counter, array, value -> rank (or None), class of the dates
+            # or datetimes in the array (or None)
+            column = self._v_column = [counter, None, ranks, None]
+            try:
+                column[1] = _update_column(
+                    _EMPTY_COLUMN, self._rev_index.items(),
+                    self._num_docs(), self._column_keyfunc())
+            except (TypeError, ValueError):
+                pass
+        return column[1]
+
+    def _column_keyfunc(self):
+        if self._v_column[2] is None:
+            return self._column_key
+        return self._rank
+
+    def _column_key(self, value):
+        # Dates and datetimes have keys in different units: raise
+        # TypeError rather than put both in the sort column.
+        if isinstance(value, datetime.date):
+            column = self._v_column
+            if isinstance(value, datetime.datetime):
+                kind = datetime.datetime
+            else:
+                kind = datetime.date
+            if column[3] is None:
+                column[3] = kind
+            elif column[3] is not kind:
+                raise TypeError(value)
+        return _column_key(value)
+
+    def _column_set(self, items):
+        # Update the sort column, if any, with ``(docid, value)`` pairs; a
+        # value of ``_marker`` unindexes the docid.
+        column = getattr(self, '_v_column', None)
+        if column is None or column[1] is None:
+            return
+        try:
+            column[1] = _update_column(
+                column[1], items, self._num_docs(), self._column_keyfunc())
+        except (TypeError, ValueError, KeyError):
+            # build the column again when it is next needed (e.g. rank all
+            # the values again, or key the values of the index which
+            # replaced others of a different kind)
+            self._v_column = None
+
+    def _rank(self, value):
+        # Return the rank of ``value`` in the sort column; raise KeyError if
+        # it has none.
+        return self._v_column[2][value]
+
+    def _rank_new(self, value):
+        # Rank ``value``, which is about to be added to the forward index,
+        # between its neighbours there, if the sort column holds ranks;
+        # drop the column if there is no room left between them.
+        column = getattr(self, '_v_column', None)
+        if column is None or column[2] is None:
+            return
+        ranks = column[2]
+        fwd_index = self._fwd_index
+        try:
+            try:
+                low = ranks[fwd_index.maxKey(value)]
+            except ValueError: # no lower value
+                low = 0
+            try:
+                high = ranks[fwd_index.minKey(value)]
+            except ValueError: # no higher value
+                high = low + 2 * RANK_GAP
+        except KeyError:
+            # a neighbour has no rank:  rank all the values again
+            self._v_column = None
+            return
+        rank = (low + high) // 2
+        if rank == low:
+            self._v_column = None
+        else:
+            ranks[value] = rank
+
+    def _rank_del(self, value):
+        # Forget the rank of a value no longer in the forward index, which
+        # a new value may fall on either side of.
+        column = getattr(self, '_v_column', None)
+        if column is not None and column[2] is not None:
+            column[2].pop(value, None)
+
     def sort(
         self,
         docids,
@@ -204,6 +458,12 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
                 raise Unsortable(docids)
             return []
 
+        if sort_type in (None, interfaces.STABLE, interfaces.OPTIMAL):
+            column = self._sort_column()
+            if column is not None:
+                return self.column_sort(
+                    docids, column, reverse, limit, raise_unsortable)
+
         if sort_type == interfaces.STABLE:
             sort_type = interfaces.TIMSORT
 
@@ -275,12 +535,8 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
         raise_unsortable=True,
         ):
         if sort_type is None:
-            rlen = len(docids)
-            if limit:
-                if (limit < 300) or (limit/float(rlen) > 0.09):
-                    sort_type = interfaces.NBEST
-                else:
-                    sort_type = interfaces.TIMSORT
+            if nbest_descending_wins(limit, len(docids), numdocs):
+                sort_type = interfaces.NBEST
             else:
                 sort_type = interfaces.TIMSORT
 
@@ -293,6 +549,77 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
         else:
             raise ValueError('Unknown sort type %s' % sort_type)
 
+    def sort_query(self, query, names=None, reverse=False, limit=None,
+                   raise_unsortable=True):
+        """ Return the first ``limit`` docids matching ``query`` in this
+        index's order, or ``None`` if they can't be found cheaply.
+
+        Rather than applying ``query`` and sorting its result, the index's
+        values are walked in order and the docids met are tested against
+        ``query`` in growing batches, until ``limit`` matches are found.
+        This pays off when the query matches many documents and its
+        ``intersect`` is cheap for few docids.  ``None`` is also returned
+        when walking the whole index found less than ``limit`` matches, as
+        some may not be sortable.
+
+        Docids having the same value come in ascending order, as with
+        ``timsort_ascending`` and ``timsort_descending``.  Docids matching
+        ``query`` which aren't in the index are never among the first
+        ``limit`` ones, so when ``limit`` docids are found, sorting the
+        query's result wouldn't raise ``Unsortable`` either, whatever
+        ``raise_unsortable``; otherwise ``None`` is returned, and the
+        caller's sort decides.
+        """
+        if limit is None:
+            return None
+        limit = int(limit)
+        if limit < 1:
+            raise ValueError('limit must be 1 or greater')
+        numdocs = self._num_docs()
+        if not numdocs or not query._intersects_cheaply():
+            return None
+        estimate = query._estimate(names)
+        if not estimate:
+            return None
+        # Walking finds about ``estimate / numdocs`` matches per docid,
+        # each test costing about ``probe_factor`` times what applying the
+        # query costs per matching docid.
+        if limit * numdocs * self.probe_factor >= estimate * estimate:
+            return None
+
+        IF = self.family.IF
+        batch_size = max(2 * limit * numdocs // estimate, limit)
+        result = []
+        batch = []
+        for docid in self._walk_docids(reverse):
+            batch.append(docid)
+            if len(batch) < batch_size:
+                continue
+            matched = query.intersect(IF.Set(batch), names)
+            result.extend(docid for docid in batch if docid in matched)
+            if len(result) >= limit:
+                return result[:limit]
+            batch = []
+            batch_size *= 2
+        if batch:
+            matched = query.intersect(IF.Set(batch), names)
+            result.extend(docid for docid in batch if docid in matched)
+            if len(result) >= limit:
+                return result[:limit]
+        return None
+
+    def _walk_docids(self, reverse=False):
+        # Yield the indexed docids in value order (descending if
+        # ``reverse``), docids having the same value being in ascending
+        # order.
+        if reverse:
+            sets = _reversed_values(self._fwd_index)
+        else:
+            sets = self._fwd_index.values()
+        for set in sets:
+            for docid in set:
+                yield docid
+
     def scan_forward(self, docids, limit=None, raise_unsortable=True):
         fwd_index = self._fwd_index
 
@@ -402,6 +729,54 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
         if raise_unsortable and missing_docids:
             raise Unsortable(missing_docids)
 
+    def sort_keys(self, docids):
+        """ Return a list of the values of ``docids`` (a sequence), or of
+        keys in the same order as the values, with ``_MISSING_KEY`` for
+        docids which aren't in the index.  Used by ``ResultSet.sort_by``.
+        """
+        column = self._sort_column()
+        if column is not None:
+            ids = numpy.fromiter(docids, numpy.int64, len(docids))
+            keys = _gather(column, ids).tolist()
+            return [_MISSING_KEY if key != key else key # NaN
+                    for key in keys]
+        get = self._rev_index.get
+        return [get(docid, _MISSING_KEY) for docid in docids]
+
+    def column_sort(self, docids, column, reverse=False, limit=None,
+                    raise_unsortable=True):
+        """ Sort ``docids`` by their keys in ``column`` (see
+        ``_sort_column``), keeping the order of docids having the same
+        value, like ``timsort_ascending`` and ``timsort_descending``. """
+        if hasattr(docids, '__len__'):
+            ids = numpy.fromiter(docids, numpy.int64, len(docids))
+        else:
+            ids = numpy.fromiter(docids, numpy.int64)
+        keys = _gather(column, ids)
+        missing = numpy.isnan(keys)
+        missing_docids = ids[missing].tolist()
+        if missing_docids:
+            ids = ids[~missing]
+            keys = keys[~missing]
+        if reverse:
+            keys = -keys
+        if limit and limit < len(keys):
+            # only the keys up to the limit-th smallest need sorting
+            kth = numpy.partition(keys, limit - 1)[limit - 1]
+            selected = numpy.flatnonzero(keys <= kth)
+            ids = ids[selected]
+            keys = keys[selected]
+        order = numpy.argsort(keys, kind='stable')
+        if limit:
+            order = order[:limit]
+        result = ids[order].tolist()
+        yield from result
+
+        if limit and len(result) >= limit:
+            return
+        if raise_unsortable and missing_docids:
+            raise Unsortable(missing_docids)
+
     def search(self, queries, operator='or'):
         sets = []
         for q in queries:
@@ -409,7 +784,7 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
                 q = q.as_tuple()
             else:
                 q = (q, q)
-            set = self.family.IF.multiunion(self._fwd_index.values(*q))
+            set = union_postings(self._fwd_index.values(*q), self.family)
             sets.append(set)
 
         result = None
@@ -417,14 +792,16 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
         if len(sets) == 1:
             result = sets[0]
         elif operator == 'and':
-            for _, set in sorted([(len(x), x) for x in sets]):
+            for set in sorted(sets, key=len):
                 result = self.family.IF.intersection(set, result)
         else:
             result = self.family.IF.multiunion(sets)
 
         return result
 
-    def apply(self, q):
+    def _parse_query(self, q):
+        # Return the (values, operator) pair ``search`` is called with for
+        # the query ``q``
         if isinstance(q, dict):
             val = q['query']
             if isinstance(val, RangeValue):
@@ -432,7 +809,7 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
             elif not isinstance(val, (list, tuple)):
                 val = [val]
             operator = q.get('operator', 'or')
-            result = self.search(val, operator)
+            return val, operator
         else:
             if isinstance(q, tuple) and len(q) == 2:
                 # b/w compat stupidity; this needs to die
@@ -440,43 +817,174 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
                 q = [q]
             elif not isinstance(q, (list, tuple)):
                 q = [q]
-            result = self.search(q, 'or')
+            return q, 'or'
 
+    def apply(self, q):
+        values, operator = self._parse_query(q)
+        return self.search(values, operator)
+
+    def apply_intersect(self, q, docids):
+        """ Return the intersection of ``apply(q)`` with ``docids``.
+
+        If ``docids`` is small compared to the number of docids ``apply(q)``
+        would produce, the reverse index is probed for each docid instead
+        of materializing the forward index lookup. """
+        if docids is None:
+            return self.apply(q)
+        values, operator = self._parse_query(q)
+        return self._intersect(
+            docids, [_value_range(v) for v in values], operator, False,
+            self.search, values, operator)
+
+    def _intersect(self, docids, ranges, operator, negate, apply_func, *args):
+        IF = self.family.IF
+        if not len(docids):
+            return IF.Set()
+
+        # ``apply_func`` is the positive query; when ``negate`` is true its
+        # result is removed from ``docids`` instead.
+        threshold = len(docids) * self.probe_factor
+        probe = self._ranges_exceed(ranges, operator, threshold)
+
+        if not probe:
+            if negate:
+                return self._negate_intersect(docids, apply_func, *args)
+            result = apply_func(*args)
+            if not len(result):
+                return IF.Set()
+            _, result = IF.weightedIntersection(docids, result)
+            return result
+
+        if operator == 'and':
+            test = all
+        else:
+            test = any
+        rev_index = self._rev_index
+        not_indexed = self._not_indexed
+        matched = []
+        for docid in docids:
+            value = rev_index.get(docid, _marker)
+            if value is _marker:
+                if negate and docid in not_indexed:
+                    matched.append(docid)
+                continue
+            hit = bool(ranges) and test(
+                _in_range(value, *range) for range in ranges)
+            if hit != negate:
+                matched.append(docid)
+
+        if not matched:
+            return IF.Set()
+        _, result = IF.weightedIntersection(docids, IF.Set(matched))
         return result
 
+    def _ranges_exceed(self, ranges, operator, limit):
+        # Return True if the forward index lookup for ``ranges`` would
+        # materialize more than ``limit`` docids.
+        if operator == 'and':
+            # an intersection is no larger than its smallest part
+            return bool(ranges) and all(
+                self._range_size(range, limit) > limit for range in ranges)
+        total = 0
+        for range in ranges:
+            total += self._range_size(range, limit - total)
+            if total > limit:
+                return True
+        return False
+
+    def _range_size(self, range, limit):
+        # Count the docids in ``range``, giving up once there are more than
+        # ``limit`` of them.
+        start, end, excludemin, excludemax = range
+        n = 0
+        for set in self._fwd_index.values(
+                start, end, excludemin=excludemin, excludemax=excludemax):
+            n += len(set)
+            if n > limit:
+                break
+        return n
+
     def applyEq(self, value):
         return self.apply(value)
 
+    def intersectEq(self, docids, value):
+        values, operator = self._parse_query(value)
+        return self._intersect(
+            docids, [_value_range(v) for v in values], operator, False,
+            self.applyEq, value)
+
+    def estimateEq(self, value):
+        """ Return the number of docids ``applyEq`` would return, or ``None``
+        if ``value`` is not a plain value. """
+        if isinstance(value, (dict, list, tuple, RangeValue)):
+            return None
+        return len(self._fwd_index.get(value, ()))
+
     def eq(self, value):
         return query.Eq(self, value)
 
     def applyNotEq(self, *args, **kw):
         return self._negate(self.applyEq, *args, **kw)
 
+    def estimateNotEq(self, *args, **kw):
+        return self._estimate_negated(self.estimateEq, *args, **kw)
+
+    def intersectNotEq(self, docids, value):
+        values, operator = self._parse_query(value)
+        return self._intersect(
+            docids, [_value_range(v) for v in values], operator, True,
+            self.applyEq, value)
+
     def noteq(self, value):
         return query.NotEq(self, value)
 
     def applyGe(self, min_value):
         return self.applyInRange(min_value, None)
 
+    def estimateGe(self, min_value, limit=None):
+        return self.estimateInRange(min_value, None, limit=limit)
+
+    def intersectGe(self, docids, min_value):
+        return self.intersectInRange(docids, min_value, None)
+
     def ge(self, value):
         return query.Ge(self, value)
 
     def applyLe(self, max_value):
         return self.applyInRange(None, max_value)
 
+    def estimateLe(self, max_value, limit=None):
+        return self.estimateInRange(None, max_value, limit=limit)
+
+    def intersectLe(self, docids, max_value):
+        return self.intersectInRange(docids, None, max_value)
+
     def le(self, value):
         return query.Le(self, value)
 
     def applyGt(self, min_value):
         return self.applyInRange(min_value, None, excludemin=True)
 
+    def estimateGt(self, min_value, limit=None):
+        return self.estimateInRange(
+            min_value, None, excludemin=True, limit=limit)
+
+    def intersectGt(self, docids, min_value):
+        return self.intersectInRange(docids, min_value, None, excludemin=True)
+
     def gt(self, value):
         return query.Gt(self, value)
 
     def applyLt(self, max_value):
         return self.applyInRange(None, max_value, excludemax=True)
 
+    def estimateLt(self, max_value, limit=None):
+        return self.estimateInRange(
+            None, max_value, excludemax=True, limit=limit)
+
+    def intersectLt(self, docids, max_value):
+        return self.intersectInRange(docids, None, max_value, excludemax=True)
+
     def lt(self, value):
         return query.Lt(self, value)
 
@@ -484,21 +992,60 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
         queries = list(values)
         return self.search(queries, operator='or')
 
+    def intersectAny(self, docids, values):
+        values = list(values)
+        return self._intersect(
+            docids, [_value_range(v) for v in values], 'or', False,
+            self.applyAny, values)
+
+    def estimateAny(self, values):
+        total = 0
+        for value in values:
+            estimate = self.estimateEq(value)
+            if estimate is None:
+                return None
+            total += estimate
+        return total
+
     def any(self, value):
         return query.Any(self, value)
 
     def applyNotAny(self, *args, **kw):
         return self._negate(self.applyAny, *args, **kw)
 
+    def estimateNotAny(self, *args, **kw):
+        return self._estimate_negated(self.estimateAny, *args, **kw)
+
+    def intersectNotAny(self, docids, values):
+        values = list(values)
+        return self._intersect(
+            docids, [_value_range(v) for v in values], 'or', True,
+            self.applyAny, values)
+
     def notany(self, value):
         return query.NotAny(self, value)
 
     def applyInRange(self, start, end, excludemin=False, excludemax=False):
-        return self.family.IF.multiunion(
+        return union_postings(
             self._fwd_index.values(
-                start, end, excludemin=excludemin, excludemax=excludemax)
-        )
-
+                start, end, excludemin=excludemin, excludemax=excludemax),
+            self.family)
+
+    def estimateInRange(self, start, end, excludemin=False, excludemax=False,
+                        limit=None):
+        """ Return the number of docids ``applyInRange`` would return without
+        materializing their union.  If ``limit`` is given, counting stops
+        once the number exceeds it. """
+        range = (start, end, excludemin, excludemax)
+        if limit is None:
+            limit = self.indexed_count()
+        return self._range_size(range, limit)
+
+    def intersectInRange(self, docids, start, end, excludemin=False,
+                         excludemax=False):
+        return self._intersect(
+            docids, [(start, end, excludemin, excludemax)], 'or', False,
+            self.applyInRange, start, end, excludemin, excludemax)
 
     def inrange(self, start, end, excludemin=False, excludemax=False):
         return query.InRange(self, start, end, excludemin, excludemax)
@@ -506,9 +1053,97 @@ class FieldIndex(BaseIndexMixin, persistent.Persistent):
     def applyNotInRange(self, *args, **kw):
         return self._negate(self.applyInRange, *args, **kw)
 
+    def estimateNotInRange(self, *args, **kw):
+        return self._estimate_negated(self.estimateInRange, *args, **kw)
+
+    def intersectNotInRange(self, docids, start, end, excludemin=False,
+                            excludemax=False):
+        return self._intersect(
+            docids, [(start, end, excludemin, excludemax)], 'or', True,
+            self.applyInRange, start, end, excludemin, excludemax)
+
     def notinrange(self, start, end, excludemin=False, excludemax=False):
         return query.NotInRange(self, start, end, excludemin, excludemax)
 
+def _value_range(value):
+    # Return the (start, end, excludemin, excludemax) range ``search`` looks
+    # up for ``value``
+    if isinstance(value, RangeValue):
+        start, end = value.as_tuple()
+    else:
+        start = end = value
+    return (start, end, False, False)
+
+def _in_range(value, start, end, excludemin, excludemax):
+    # Mirrors BTree.values(start, end, excludemin, excludemax); a bound of
+    # None is open
+    if start is not None:
+        if value < start or (excludemin and value == start):
+            return False
+    if end is not None:
+        if value > end or (excludemax and value == end):
+            return False
+    return True
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_EMPTY_COLUMN = () if numpy is None else numpy.full(0, numpy.nan)
+
+# the spacing of the ranks of values in sort columns
+RANK_GAP = 2**20
+
+def _column_key(value):
+    # Return the float the sort column holds for ``value``, in the same
+    # order as the values; raise TypeError if there is none.
+    if isinstance(value, float):
+        return value
+    if isinstance(value, int):
+        if abs(value) > 2**53:
+            # floats can't tell all such ints apart
+            raise TypeError(value)
+        return float(value)
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            return (value - _EPOCH).total_seconds()
+        return value.timestamp()
+    if isinstance(value, datetime.date):
+        return float(value.toordinal())
+    raise TypeError(value)
+
+def _column_size(numdocs):
+    # the largest sort column for an index of ``numdocs`` documents
+    return max(4 * numdocs, 65536)
+
+def _gather(column, ids):
+    # the keys of the docids ``ids`` (an array) in the sort column
+    keys = numpy.full(len(ids), numpy.nan)
+    inside = (ids >= 0) & (ids < len(column))
+    keys[inside] = column[ids[inside]]
+    return keys
+
+def _update_column(column, items, numdocs, key):
+    # Set the keys of the ``(docid, value)`` pairs in the sort column,
+    # growing it if needed, and return it; raise ValueError if the docids
+    # are too sparse
+    docids = []
+    keys = []
+    for docid, value in items:
+        docids.append(docid)
+        keys.append(numpy.nan if value is _marker else key(value))
+    if not docids:
+        return column
+    docids = numpy.array(docids, numpy.int64)
+    if docids.min() < 0:
+        raise ValueError('negative docid')
+    size = int(docids.max()) + 1
+    if size > len(column):
+        if size > _column_size(numdocs):
+            raise ValueError('docids too sparse')
+        grown = numpy.full(max(size, 2 * len(column)), numpy.nan)
+        grown[:len(column)] = column
+        column = grown
+    column[docids] = keys
+    return column
+
 def nsort(docids, rev_index, missing):
     for docid in docids:
         try:
@@ -536,6 +1171,22 @@ class _MissingValue(object):
 ASC = _MissingValue(True)
 DESC = _MissingValue(False)
 
+def _reversed_values(tree):
+    # BTrees can only be iterated forwards, and seeking backwards in their
+    # values() is linear; walk the tree structure (as exposed by its pickle
+    # state) from the end instead.
+    state = tree.__getstate__()
+    if state is None or len(state) == 1:
+        # empty, or a single bucket stored inline
+        yield from reversed(list(tree.values()))
+        return
+    children = state[0][::2]
+    for child in reversed(children):
+        if isinstance(child, type(tree)):
+            yield from _reversed_values(child)
+        else:
+            yield from reversed(list(child.values()))
+
 def fwscan_wins(limit, rlen, numdocs):
     """
     Primitive curve-fitting to see if forward scan will beat both
@@ -615,4 +1266,17 @@ def nbest_ascending_wins(limit, rlen, numdocs):
 
     return False
 
+def nbest_descending_wins(limit, rlen, numdocs):
+    """
+    See if nbest descending will beat timsort for a particular
+    limit/rlen/numdocs tuple.  In benchmark/sortbench.py runs with
+    'numdocs' sizes of 1024 to 65536, nbest won when the limit was at
+    most a sixteenth of the rlen, whatever the size of the index, and
+    timsort won otherwise.
+    """
+    if not limit:
+        # n-best can't be used without a limit
+        return False
+    return limit <= rlen / 16.0
+
 
@@ -463,6 +463,107 @@ class FieldIndexTests(unittest.TestCase):
         self.assertRaises(ValueError,
                           index.sort, c1, reverse=True, sort_type=FWSCAN)
 
+    def _populateForSortQuery(self):
+        # docid 0 has no value; the others' values descend as docids grow
+        # and pair up, so that docids 2n and 2n + 1 have the same value.
+        index = self._makeOne()
+        for docid in range(1, 200):
+            index.index_doc(docid, (200 - docid) // 2)
+        index.index_doc(0, _marker)
+        index.probe_factor = 1
+        return index
+
+    def test_sort_query(self):
+        index = self._populateForSortQuery()
+        query = index.gt(10)
+        result = index.sort_query(query, limit=5)
+        self.assertEqual(result, [177, 178, 175, 176, 173])
+        self.assertEqual(
+            result,
+            list(index.sort(query._apply(None), limit=5)))
+
+    def test_sort_query_reverse(self):
+        index = self._populateForSortQuery()
+        query = index.gt(10)
+        result = index.sort_query(query, reverse=True, limit=5)
+        self.assertEqual(result, [1, 2, 3, 4, 5])
+        self.assertEqual(
+            result,
+            list(index.timsort_descending(query._apply(None), limit=5)))
+
+    def test_sort_query_bad_limit(self):
+        index = self._populateForSortQuery()
+        self.assertRaises(ValueError, index.sort_query, index.gt(10),
+                          limit=-1)
+        self.assertRaises(ValueError, index.sort_query, index.gt(10),
+                          limit=0)
+
+    def test_sort_query_w_unsortable_docids(self):
+        index = self._populateForSortQuery()
+        query = index.gt(10)
+        # the docids of the query's result, and some the index doesn't sort
+        docids = index.family.IF.union(
+            query._apply(None), index.family.IF.Set([0, 500]))
+        for raise_unsortable in (True, False):
+            result = index.sort_query(
+                query, limit=5, raise_unsortable=raise_unsortable)
+            self.assertEqual(result, [177, 178, 175, 176, 173])
+            self.assertEqual(result, list(index.sort(
+                docids, limit=5, raise_unsortable=raise_unsortable)))
+
+    def test_sort_query_nothing_matches(self):
+        index = self._populateForSortQuery()
+        self.assertEqual(index.sort_query(index.gt(1000), limit=5), None)
+
+    def test_sort_query_matches_in_last_batch(self):
+        index = self._populateForSortQuery()
+        index.estimateGt = lambda value, limit=None: 150
+        result = index.sort_query(index.gt(97), limit=2)
+        self.assertEqual(result, [3, 4])
+
+    def test_sort_query_w_names(self):
+        from ..query import Name
+        index = self._populateForSortQuery()
+        query = index.noteq(Name('value'))
+        result = index.sort_query(query, {'value': 0}, limit=3)
+        self.assertEqual(result, [197, 198, 195])
+
+    def test_sort_query_without_limit(self):
+        index = self._populateForSortQuery()
+        self.assertEqual(index.sort_query(index.gt(10)), None)
+
+    def test_sort_query_empty_index(self):
+        index = self._makeOne()
+        self.assertEqual(index.sort_query(index.gt(10), limit=5), None)
+
+    def test_sort_query_selective_query(self):
+        index = self._populateForSortQuery()
+        index.probe_factor = 20
+        self.assertEqual(index.sort_query(index.eq(10), limit=5), None)
+
+    def test_sort_query_intersect_not_cheap(self):
+        from ..query import Eq
+        index = self._populateForSortQuery()
+        query = index.gt(10) & Eq(object(), None)
+        self.assertEqual(index.sort_query(query, limit=5), None)
+
+    def test_sort_query_too_few_matches(self):
+        index = self._populateForSortQuery()
+        index.estimateGt = lambda value, limit=None: 1000
+        self.assertEqual(index.sort_query(index.gt(97), limit=5), None)
+
+    def test__reversed_values(self):
+        from . import _reversed_values
+        tree = self._makeOne()._fwd_index
+        self.assertEqual(list(_reversed_values(tree)), [])
+        for i in range(10):
+            tree[i] = i
+        self.assertEqual(list(_reversed_values(tree)), list(range(9, -1, -1)))
+        for i in range(10000):
+            tree[i] = i
+        self.assertEqual(
+            list(_reversed_values(tree)), list(range(9999, -1, -1)))
+
     def test_sort_bad_sort_type_reverse(self):
         from BTrees.IFBTree import IFSet
         index = self._makeOne()
@@ -1050,6 +1151,74 @@ class FieldIndexTests(unittest.TestCase):
         result = sorted(list(result))
         self.assertEqual(result, [2, 5, 6, 7, 10, 11])
 
+    def test_estimateEq(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        index.index_doc(50, 1)
+        self.assertEqual(index.estimateEq(1), 2)
+        self.assertEqual(index.estimateEq(60), 0)
+
+    def test_estimateEq_not_a_plain_value(self):
+        from .. import RangeValue
+        index = self._makeOne()
+        self._populateIndex(index)
+        self.assertEqual(index.estimateEq([1, 2]), None)
+        self.assertEqual(index.estimateEq(RangeValue(1, 2)), None)
+
+    def test_estimateNotEq(self):
+        def discriminator(obj, default):
+            if isinstance(obj, int):
+                return obj
+            return default
+
+        index = self._makeOne(discriminator=discriminator)
+        self._populateIndex(index)
+        index.index_doc(50, 1)
+        index.index_doc(51, '1')
+        self.assertEqual(index.estimateNotEq(1), 11)
+        self.assertEqual(index.estimateNotEq([1]), None)
+
+    def test_estimateAny(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        index.index_doc(50, 1)
+        self.assertEqual(index.estimateAny([1, 2, 60]), 3)
+        self.assertEqual(index.estimateAny([1, [2]]), None)
+
+    def test_estimateNotAny(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        index.index_doc(50, 1)
+        self.assertEqual(index.estimateNotAny([1, 2, 60]), 9)
+
+    def test_estimateInRange(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        self.assertEqual(index.estimateInRange(3, 7), 5)
+        self.assertEqual(
+            index.estimateInRange(3, 7, excludemin=True, excludemax=True), 3)
+
+    def test_estimateInRange_limit(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        self.assertEqual(index.estimateInRange(None, None), 11)
+        self.assertEqual(index.estimateInRange(None, None, limit=2), 3)
+        self.assertEqual(index.estimateGe(3, limit=0), 1)
+
+    def test_estimateNotInRange(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        self.assertEqual(index.estimateNotInRange(3, 7), 6)
+
+    def test_estimateGe_Gt_Le_Lt(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        index.index_doc(50, 1)
+        self.assertEqual(index.estimateGe(10), 2)
+        self.assertEqual(index.estimateGt(10), 1)
+        self.assertEqual(index.estimateLe(2), 3)
+        self.assertEqual(index.estimateLt(2), 2)
+
     def test_docids(self):
         index = self._makeOne()
         self._populateIndex(index)
@@ -1113,6 +1282,532 @@ class FieldIndexTests(unittest.TestCase):
         index.index_doc(2, _marker)
         self.assertEqual(index.not_indexed_count(), 1)
 
+    def test_docids_count(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        index.index_doc(20, _marker)
+        self.assertEqual(index.docids_count(), 12)
+        index.index_doc(20, 1)
+        index.index_doc(1, _marker)
+        index.index_doc(2, 42)
+        self.assertEqual(index.docids_count(), 12)
+        index.unindex_doc(1)
+        index.unindex_doc(2)
+        index.unindex_doc(99)
+        self.assertEqual(index.docids_count(), 10)
+        self.assertEqual(
+            set(index.docids()), set((3, 4, 5, 6, 7, 8, 9, 10, 11, 20)))
+
+    def test_docids_upgrades_index_without_docids(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        index.index_doc(20, _marker)
+        del index._all_docids
+        del index._all_docids_count
+        self.assertEqual(index.docids_count(), 12)
+        index.unindex_doc(1)
+        self.assertEqual(index.docids_count(), 11)
+        self.assertEqual(
+            set(index.docids()),
+            set((2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 20)))
+
+    def _assertSameIndex(self, index, other):
+        self.assertEqual(
+            [(value, list(docids)) for value, docids in index._fwd_index.items()],
+            [(value, list(docids)) for value, docids in other._fwd_index.items()])
+        self.assertEqual(list(index._rev_index.items()),
+                         list(other._rev_index.items()))
+        self.assertEqual(list(index._not_indexed), list(other._not_indexed))
+        self.assertEqual(list(index.docids()), list(other.docids()))
+        self.assertEqual(index.indexed_count(), other.indexed_count())
+        self.assertEqual(index.docids_count(), other.docids_count())
+
+    def test_index_docs(self):
+        docs = [(5, 1), (2, 2), (1, 3), (3, 1), (4, _marker), (6, 2),
+                (7, 1), (1, 4), (3, _marker)]
+        index = self._makeOne()
+        index.index_doc(3, 2)
+        index.index_doc(8, 1)
+        other = self._makeOne()
+        other.index_doc(3, 2)
+        other.index_doc(8, 1)
+        for docid, value in docs:
+            other.index_doc(docid, value)
+        generation = index.generation()
+        index.index_docs(iter(docs))
+        self._assertSameIndex(index, other)
+        self.assertTrue(index.generation() > generation)
+
+    def test_index_docs_w_bitmaps(self):
+        from ..bitmap import Bitmap
+        docs = [(docid, docid % 3) for docid in range(1, 31)]
+        index = self._makeOne()
+        index.bitmap_threshold = 10
+        index.index_doc(100, 0)
+        index.index_doc(101, 1)
+        index.index_doc(102, 5)
+        index.index_docs(docs)
+        other = self._makeOne()
+        for docid, value in docs + [(100, 0), (101, 1), (102, 5)]:
+            other.index_doc(docid, value)
+        self.assertEqual(type(index._fwd_index[0]), Bitmap)
+        self.assertEqual(type(index._fwd_index[1]), Bitmap)
+        self.assertEqual(type(index._fwd_index[5]),
+                         type(other._fwd_index[5]))
+        self.assertEqual(
+            [(value, list(docids))
+             for value, docids in index._fwd_index.items()],
+            [(value, list(docids))
+             for value, docids in other._fwd_index.items()])
+
+    def test_queries_w_bitmaps(self):
+        index = self._makeOne()
+        index.bitmap_threshold = 3
+        index.index_docs([(docid, docid % 4) for docid in range(1, 21)])
+        index.index_doc(21, 7)
+        index.index_doc(22, _marker)
+        index.index_doc(4, 5)
+        index.unindex_doc(8)
+        self.assertEqual(list(index.applyEq(0)), [12, 16, 20])
+        self.assertEqual(list(index.applyAny([0, 7])), [12, 16, 20, 21])
+        self.assertEqual(list(index.applyInRange(2, 5)),
+                         [2, 3, 4, 6, 7, 10, 11, 14, 15, 18, 19])
+        self.assertEqual(list(index.applyNotEq(1)),
+                         [2, 3, 4, 6, 7, 10, 11, 12, 14, 15, 16, 18, 19, 20,
+                          21, 22])
+        self.assertEqual(list(index.sort([5, 4, 12], limit=2)), [12, 5])
+        docids = self._makeTreeSet()
+        docids.update([1, 2, 5])
+        self.assertEqual(list(index.apply_intersect(1, docids)), [1, 5])
+        index.probe_factor = 0
+        self.assertEqual(list(index.apply_intersect(1, docids)), [1, 5])
+
+    def test_optimize_converts_to_bitmap_and_back(self):
+        from ..bitmap import Bitmap
+        index = self._makeOne()
+        index.index_docs([(docid, docid % 2) for docid in range(1, 11)])
+        index.index_doc(11, 2)
+        index.bitmap_threshold = 5
+        index.optimize()
+        self.assertEqual(type(index._fwd_index[0]), Bitmap)
+        self.assertEqual(type(index._fwd_index[2]), type(self._makeTreeSet()))
+        self.assertEqual(list(index._fwd_index[0]), [2, 4, 6, 8, 10])
+        index.bitmap_threshold = None
+        index.optimize()
+        self.assertEqual(type(index._fwd_index[0]), type(self._makeTreeSet()))
+        self.assertEqual(list(index._fwd_index[0]), [2, 4, 6, 8, 10])
+
+    def _makeTreeSet(self):
+        import BTrees
+        return BTrees.family64.IF.TreeSet()
+
+    def _makeColumnIndex(self):
+        index = self._makeOne()
+        index.sort_column = True
+        index.index_docs([(docid, docid % 7) for docid in range(1, 101)])
+        return index
+
+    def test_sort_column_same_as_timsort(self):
+        from ..interfaces import TIMSORT
+        index = self._makeColumnIndex()
+        docids = list(range(100, 0, -3))
+        for reverse in (False, True):
+            for limit in (None, 1, 5, 20, 100):
+                self.assertEqual(
+                    list(index.sort(docids, reverse=reverse, limit=limit)),
+                    list(index.sort(docids, reverse=reverse, limit=limit,
+                                    sort_type=TIMSORT)))
+        self.assertTrue(index._sort_column() is not None)
+
+    def test_sort_column_not_used_for_other_sort_types(self):
+        from ..interfaces import NBEST
+        index = self._makeColumnIndex()
+        index.column_sort = None
+        self.assertEqual(list(index.sort([7, 1, 2], limit=2,
+                                         sort_type=NBEST)), [7, 1])
+
+    def test_sort_column_maintained(self):
+        index = self._makeColumnIndex()
+        self.assertEqual(list(index.sort([1, 2, 3])), [1, 2, 3])
+        column = index._sort_column()
+        index.index_doc(1, 10)
+        index.index_doc(200, -1)
+        index.unindex_doc(3)
+        index.index_docs([(300, -2)])
+        self.assertTrue(index._sort_column() is column or
+                        len(index._sort_column()) > len(column))
+        self.assertEqual(list(index.sort([1, 2, 200, 300], reverse=True)),
+                         [1, 2, 200, 300])
+        self.assertEqual(list(index.sort([1, 2, 3, 200],
+                                         raise_unsortable=False)),
+                         [200, 2, 1])
+
+    def test_sort_column_rebuilt_after_other_changes(self):
+        index = self._makeColumnIndex()
+        column = index._sort_column()
+        index._generation.change(1)
+        self.assertFalse(index._sort_column() is column)
+
+    def test_sort_column_dates(self):
+        import datetime
+        utc = datetime.timezone.utc
+        for values in (
+                [datetime.date(2020, 1, 2), datetime.date(2019, 12, 31)],
+                [datetime.datetime(2020, 1, 1, 12),
+                 datetime.datetime(2020, 1, 1, 11)],
+                [datetime.datetime(2020, 1, 1, 12, tzinfo=utc),
+                 datetime.datetime(2020, 1, 1, 11, tzinfo=utc)],
+                ):
+            index = self._makeOne()
+            index.sort_column = True
+            index.index_docs([(1, values[0]), (2, values[1])])
+            self.assertTrue(index._sort_column() is not None)
+            self.assertEqual(list(index.sort([1, 2])), [2, 1])
+            self.assertEqual(list(index.sort([2, 1], reverse=True)), [1, 2])
+
+    def test_sort_column_dates_and_datetimes(self):
+        import datetime
+        index = self._makeOne()
+        index.sort_column = True
+        index.index_docs([(1, datetime.date(2020, 1, 2)),
+                          (2, datetime.date(2019, 12, 31))])
+        self.assertTrue(index._sort_column() is not None)
+        keyfunc = index._column_keyfunc()
+        self.assertRaises(TypeError, keyfunc,
+                          datetime.datetime(2020, 1, 1, 12))
+        self.assertEqual(keyfunc(datetime.date(2020, 1, 1)),
+                         float(datetime.date(2020, 1, 1).toordinal()))
+        # the field index can't hold both, but may switch from one to the
+        # other: the column is then built again
+        index.unindex_doc(1)
+        index.unindex_doc(2)
+        index.index_docs([(1, datetime.datetime(2020, 1, 1, 12)),
+                          (2, datetime.datetime(2020, 1, 1, 11))])
+        self.assertEqual(index._v_column, None)
+        self.assertTrue(index._sort_column() is not None)
+        self.assertEqual(list(index.sort([1, 2])), [2, 1])
+
+    def test_sort_column_floats(self):
+        index = self._makeOne()
+        index.sort_column = True
+        index.index_docs([(1, 1.5), (2, -0.5), (3, 1)])
+        self.assertEqual(index._sort_column().tolist()[1:], [1.5, -0.5, 1.0])
+        self.assertEqual(list(index.sort([1, 2, 3])), [2, 3, 1])
+
+    def test_sort_column_empty(self):
+        index = self._makeOne()
+        index.sort_column = True
+        # as pickled before indexes had a generation counter
+        del index._generation
+        self.assertEqual(index._counter(), None)
+        self.assertEqual(len(index._sort_column()), 0)
+        column = index._v_column
+        index.index_doc(1, 3)
+        self.assertTrue(index._v_column is column)
+        self.assertEqual(index._sort_column()[1], 3.0)
+
+    def test_column_sort_iterator(self):
+        index = self._makeColumnIndex()
+        column = index._sort_column()
+        self.assertEqual(list(index.column_sort(iter([3, 1, 7]), column)),
+                         [7, 1, 3])
+
+    def test_sort_column_unusable(self):
+        index = self._makeOne()
+        index.sort_column = True
+        index.index_doc(1, 'abc')
+        self.assertEqual(index._sort_column(), None)
+        self.assertEqual(list(index.sort([1])), [1])
+        index = self._makeColumnIndex()
+        self.assertTrue(index._sort_column() is not None)
+        index.index_doc(1, 2**60)
+        self.assertEqual(index._sort_column(), None)
+        self.assertEqual(list(index.sort([1, 2, 3])), [2, 3, 1])
+        index = self._makeColumnIndex()
+        self.assertTrue(index._sort_column() is not None)
+        index.index_doc(10**7, 1)
+        self.assertEqual(index._sort_column(), None)
+        self.assertEqual(list(index.sort([10**7, 2])), [10**7, 2])
+        index = self._makeColumnIndex()
+        self.assertTrue(index._sort_column() is not None)
+        index.index_doc(-1, 1)
+        self.assertEqual(index._sort_column(), None)
+        self.assertEqual(list(index.sort([-1, 2])), [-1, 2])
+
+    def _makeRanksIndex(self):
+        index = self._makeOne()
+        index.sort_column = index.sort_ranks = True
+        index.index_docs([(docid, ('abc'[docid % 3], docid % 5))
+                          for docid in range(1, 101)])
+        return index
+
+    def test_sort_ranks_same_as_timsort(self):
+        from ..interfaces import TIMSORT
+        index = self._makeRanksIndex()
+        docids = list(range(100, 0, -3))
+        for reverse in (False, True):
+            for limit in (None, 1, 5, 20, 100):
+                self.assertEqual(
+                    list(index.sort(docids, reverse=reverse, limit=limit)),
+                    list(index.sort(docids, reverse=reverse, limit=limit,
+                                    sort_type=TIMSORT)))
+        self.assertTrue(index._sort_column() is not None)
+
+    def test_sort_ranks_new_values(self):
+        from . import RANK_GAP
+        index = self._makeRanksIndex()
+        index._sort_column()
+        ranks = index._v_column[2]
+        self.assertEqual(len(ranks), 15)
+        self.assertEqual(ranks[('a', 0)], RANK_GAP)
+        index.index_doc(200, ('a', 0.5))
+        index.index_doc(201, ('d', 0))
+        index.index_doc(202, ('', 0))
+        self.assertTrue(index._v_column is not None)
+        self.assertEqual(ranks[('a', 0.5)], RANK_GAP * 3 // 2)
+        self.assertEqual(ranks[('d', 0)], RANK_GAP * 16)
+        self.assertEqual(ranks[('', 0)], RANK_GAP // 2)
+        self.assertEqual(list(index.sort([201, 200, 202, 15, 1])),
+                         [202, 15, 200, 1, 201])
+        index.unindex_doc(200)
+        self.assertFalse(('a', 0.5) in ranks)
+
+    def test_sort_ranks_no_room_left(self):
+        index = self._makeOne()
+        index.sort_column = index.sort_ranks = True
+        index.index_docs([(1, 0.0), (2, 1.0)])
+        index._sort_column()
+        value = 1.0
+        for docid in range(3, 30):
+            value = value / 2
+            index.index_doc(docid, value)
+            if index._v_column is None:
+                break
+        self.assertTrue(docid < 29)
+        self.assertTrue(index._sort_column() is not None)
+        self.assertEqual(list(index.sort([2, docid, 1, 3])),
+                         [1, docid, 3, 2])
+
+    def test_sort_ranks_index_docs_new_neighbours(self):
+        from . import RANK_GAP
+        index = self._makeRanksIndex()
+        index._sort_column()
+        ranks = index._v_column[2]
+        index.index_docs([(200, ('b', 10)), (201, ('b', 11))])
+        # the new values are ranked one after the other
+        self.assertTrue(index._v_column[2] is ranks)
+        self.assertEqual(ranks[('b', 10)], RANK_GAP * 10 + RANK_GAP // 2)
+        self.assertEqual(ranks[('b', 11)], RANK_GAP * 10 + RANK_GAP * 3 // 4)
+        self.assertEqual(list(index.sort([201, 200, 3])), [3, 200, 201])
+
+    def test_sort_ranks_neighbour_wo_rank(self):
+        index = self._makeRanksIndex()
+        index._sort_column()
+        del index._v_column[2][('c', 4)]
+        index.index_doc(200, ('c', 5))
+        self.assertEqual(index._v_column, None)
+        self.assertEqual(list(index.sort([200, 3, 14])), [3, 14, 200])
+
+    def test_sort_keys(self):
+        from ..util import _MISSING_KEY
+        index = self._makeOne()
+        self._populateIndex(index)
+        self.assertEqual(index.sort_keys([5, 50, 1]), [1, _MISSING_KEY, 3])
+        index.sort_column = True
+        self.assertEqual(index.sort_keys([5, 50, 1, -1]),
+                         [1.0, _MISSING_KEY, 3.0, _MISSING_KEY])
+
+    def test_sort_keys_w_none_value(self):
+        from ..util import _MISSING_KEY
+        index = self._makeOne()
+        index.index_docs([(1, 3), (2, None), (3, 1)])
+        self.assertEqual(index.sort_keys([1, 2, 3, 4]),
+                         [3, None, 1, _MISSING_KEY])
+        self.assertEqual(list(index.sort([1, 2, 3])), [2, 3, 1])
+        # None has no key in a column of values...
+        index.sort_column = True
+        self.assertEqual(index._sort_column(), None)
+        self.assertEqual(index.sort_keys([1, 2, 3, 4]),
+                         [3, None, 1, _MISSING_KEY])
+        self.assertEqual(list(index.sort([1, 2, 3])), [2, 3, 1])
+        # ...but is ranked like other values
+        index = self._makeOne()
+        index.sort_column = index.sort_ranks = True
+        index.index_docs([(1, 3), (2, None), (3, 1)])
+        keys = index.sort_keys([1, 2, 3, 4])
+        self.assertTrue(keys[1] < keys[2] < keys[0])
+        self.assertTrue(keys[3] is _MISSING_KEY)
+        self.assertEqual(list(index.sort([1, 2, 3])), [2, 3, 1])
+        index.unindex_doc(2)
+        self.assertTrue(index._v_column is not None)
+        self.assertTrue(index.sort_keys([2])[0] is _MISSING_KEY)
+
+    def test_sort_column_missing_docids(self):
+        from hypatia.exc import Unsortable
+        index = self._makeColumnIndex()
+        result = index.sort([-1, 1, 500, 2])
+        self.assertRaises(Unsortable, list, result)
+        try:
+            list(index.sort([-1, 1, 500, 2]))
+        except Unsortable as e:
+            self.assertEqual(sorted(e.docids), [-1, 500])
+        self.assertEqual(list(index.sort([-1, 1, 500, 2], limit=2)), [1, 2])
+        self.assertEqual(
+            list(index.sort([-1, 1, 500, 2], raise_unsortable=False)),
+            [1, 2])
+
+    def test_index_docs_empty(self):
+        index = self._makeOne()
+        generation = index.generation()
+        index.index_docs([])
+        self.assertEqual(index.generation(), generation)
+
+    def test_generation(self):
+        index = self._makeOne()
+        generation = index.generation()
+        index.index_doc(1, 1)
+        self.assertTrue(index.generation() > generation)
+        generation = index.generation()
+        index.reindex_doc(1, 1)
+        self.assertEqual(index.generation(), generation)
+        index.index_doc(1, 2)
+        self.assertTrue(index.generation() > generation)
+        generation = index.generation()
+        index.index_doc(1, _marker)
+        self.assertTrue(index.generation() > generation)
+        generation = index.generation()
+        index.unindex_doc(1)
+        self.assertTrue(index.generation() > generation)
+        generation = index.generation()
+        index.unindex_doc(1)
+        self.assertEqual(index.generation(), generation)
+        index.reset()
+        self.assertTrue(index.generation() > generation)
+
+    def test_reset_clears_docids(self):
+        index = self._makeOne()
+        self._populateIndex(index)
+        index.reset()
+        self.assertEqual(list(index.docids()), [])
+        self.assertEqual(index.docids_count(), 0)
+
+    def _populateForIntersect(self):
+        def discriminator(obj, default):
+            if isinstance(obj, int):
+                return obj
+            return default
+        index = self._makeOne(discriminator=discriminator)
+        self._populateIndex(index)
+        index.index_doc(50, 1)
+        index.index_doc(51, '1')
+        return index
+
+    def _assertIntersects(self, index, name, *args):
+        # The reverse index probe and the forward lookup must agree; neither
+        # may negate by complementing the positive result.
+        docids = index.family.IF.Set([1, 2, 5, 9, 11, 50, 51, 99])
+        expected = index.family.IF.intersection(
+            getattr(index, 'apply' + name)(*args), docids)
+        # building the complement of the positive result would fail
+        index._negate = None
+        index.probe_factor = 1000000
+        forward = index.family.IF.Set(
+            getattr(index, 'intersect' + name)(docids, *args))
+        self.assertEqual(list(forward), list(expected))
+        index.probe_factor = 0
+        # so would the forward lookup
+        setattr(index, 'apply' + name, None)
+        probed = getattr(index, 'intersect' + name)(docids, *args)
+        self.assertEqual(list(probed), list(expected))
+        return list(probed)
+
+    def test_intersectEq(self):
+        index = self._populateForIntersect()
+        result = self._assertIntersects(index, 'Eq', 1)
+        self.assertEqual(result, [5, 50])
+
+    def test_intersectEq_range_value(self):
+        from .. import RangeValue
+        index = self._populateForIntersect()
+        result = self._assertIntersects(index, 'Eq', RangeValue(2, 4))
+        self.assertEqual(result, [1, 2])
+
+    def test_intersectNotEq(self):
+        index = self._populateForIntersect()
+        result = self._assertIntersects(index, 'NotEq', 1)
+        self.assertEqual(result, [1, 2, 9, 11, 51])
+
+    def test_intersectAny(self):
+        index = self._populateForIntersect()
+        result = self._assertIntersects(index, 'Any', [1, 2, 60])
+        self.assertEqual(result, [2, 5, 50])
+
+    def test_intersectNotAny(self):
+        index = self._populateForIntersect()
+        result = self._assertIntersects(index, 'NotAny', [1, 2, 60])
+        self.assertEqual(result, [1, 9, 11, 51])
+
+    def test_intersectInRange(self):
+        index = self._populateForIntersect()
+        result = self._assertIntersects(index, 'InRange', 3, 7, True, False)
+        self.assertEqual(result, [9])
+
+    def test_intersectNotInRange(self):
+        index = self._populateForIntersect()
+        result = self._assertIntersects(
+            index, 'NotInRange', 3, 7, False, True)
+        self.assertEqual(result, [2, 5, 9, 11, 50, 51])
+
+    def test_intersectGe_Gt_Le_Lt(self):
+        index = self._populateForIntersect()
+        self.assertEqual(self._assertIntersects(index, 'Ge', 10), [11])
+        self.assertEqual(self._assertIntersects(index, 'Gt', 9), [11])
+        self.assertEqual(self._assertIntersects(index, 'Le', 2), [2, 5, 50])
+        self.assertEqual(self._assertIntersects(index, 'Lt', 2), [5, 50])
+
+    def test_intersect_empty_docids(self):
+        index = self._populateForIntersect()
+        result = index.intersectEq(index.family.IF.Set(), 1)
+        self.assertEqual(list(result), [])
+
+    def test_intersect_no_matches(self):
+        index = self._populateForIntersect()
+        docids = index.family.IF.Set([1, 2])
+        index.probe_factor = 0
+        self.assertEqual(list(index.intersectEq(docids, 1)), [])
+        index.probe_factor = 1000000
+        self.assertEqual(list(index.intersectEq(docids, 1)), [])
+
+    def test_intersect_keeps_weights(self):
+        index = self._populateForIntersect()
+        docids = index.family.IF.Bucket({1: 2.0, 5: 3.0, 50: 4.0})
+        index.probe_factor = 0
+        probed = index.intersectEq(docids, 1)
+        index.probe_factor = 1000000
+        forward = index.intersectEq(docids, 1)
+        self.assertEqual(list(probed.items()), [(5, 4.0), (50, 5.0)])
+        self.assertEqual(list(forward.items()), list(probed.items()))
+
+    def test_apply_intersect_docids_None(self):
+        index = self._populateForIntersect()
+        self.assertEqual(list(index.apply_intersect(1, None)), [5, 50])
+
+    def test_apply_intersect(self):
+        from .. import RangeValue
+        index = self._populateForIntersect()
+        docids = index.family.IF.Set([1, 2, 5, 9, 11, 50, 51, 99])
+        for q in (1, [1, 2], (3, 7), {'query': RangeValue(3, 7)},
+                  {'query': [RangeValue(1, 4), RangeValue(3, 7)],
+                   'operator': 'and'},
+                  {'query': [RangeValue(1, 4), RangeValue(8, 9)],
+                   'operator': 'and'}):
+            expected = list(index.family.IF.intersection(
+                index.apply(q), docids))
+            for probe_factor in (0, 1000000):
+                index.probe_factor = probe_factor
+                self.assertEqual(
+                    list(index.apply_intersect(q, docids)), expected)
+
     def test_eq(self):
         from .. import query
         index = self._makeOne()
@@ -1337,6 +2032,27 @@ class Test_nbest_ascending_wins(unittest.TestCase):
         self.assertTrue(self._callFUT(2048, 32767, 65536))
         self.assertFalse(self._callFUT(2049, 32767, 65536))
 
+class Test_nbest_descending_wins(unittest.TestCase):
+
+    def _callFUT(self, limit, rlen, numdocs):
+        from . import nbest_descending_wins
+        return nbest_descending_wins(limit, rlen, numdocs)
+
+    def test_wo_limit(self):
+        self.assertFalse(self._callFUT(None, 1, 1000))
+        self.assertFalse(self._callFUT(None, 999, 1000))
+        self.assertFalse(self._callFUT(0, 999, 1000))
+
+    def test_w_limit_le_rlen_over_16(self):
+        self.assertTrue(self._callFUT(1, 16, 1000))
+        self.assertTrue(self._callFUT(64, 1024, 65536))
+        self.assertTrue(self._callFUT(4096, 65536, 65536))
+
+    def test_w_limit_gt_rlen_over_16(self):
+        self.assertFalse(self._callFUT(1, 15, 1000))
+        self.assertFalse(self._callFUT(65, 1024, 65536))
+        self.assertFalse(self._callFUT(65536, 65536, 65536))
+
 class Test_MissingValue(unittest.TestCase):
     def _makeOne(self, val):
         from hypatia.field import _MissingValue
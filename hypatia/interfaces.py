@@ -131,6 +131,19 @@ class IResultSet(Interface):
         'unresolved.'
         )
 
+    batch_resolver = Attribute(
+        'A callable which accepts a sequence of document ids and which returns '
+        'a sequence of the corresponding documents, in the same order.  May be '
+        '``None``.  If not ``None``, ``all()`` and iteration use it, rather than '
+        '``resolver``, to resolve document ids in chunks.'
+        )
+
+    docid_mapper = Attribute(
+        'The ``hypatia.catalog.DocidMapper`` translating ``ids``, which are '
+        'then internal ids, into document ids before they are resolved or '
+        'returned.  May be ``None``.'
+        )
+
     def __len__():
         """ Return the length of the result set"""
 
@@ -157,6 +170,25 @@ class IResultSet(Interface):
         over the sorted docids.
         """
 
+    def sort_by(keys, limit=None, raise_unsortable=True):
+        """Return another IResultSet sorted by the values of several
+        indexes: by the first, then, among docids having the same value in
+        the first, by the second, and so on.
+
+        ``keys`` is a sequence of ``(index, reverse)`` pairs (or of indexes,
+        sorted in ascending order).  The sort is stable, and docids which
+        are missing from any of the indexes are handled like ``sort``
+        handles those missing from its index.
+
+        Indexes which have a ``sort_keys(docids)`` method, returning the
+        values of ``docids`` (or keys in the same order) with
+        ``hypatia.util._MISSING_KEY`` for missing docids (``None`` is a
+        value like any other), are asked for all of them at once; with a
+        ``limit``, an n-best selection on the first index's values then
+        discards the docids which can't be among the first ``limit``.
+        Otherwise the docids are sorted by each index's ``sort`` in turn.
+        """
+
     def first(resolve=True):
         """ Return the first element in the sequence.  If ``resolve`` is True,
         and the result set has a valid resolver, return the resolved
@@ -179,6 +211,12 @@ class IResultSet(Interface):
 
     def __iter__():
         """ Return an iterator over the results of ``self.all()``"""
+
+    def __getitem__(item):
+        """ If ``item`` is a slice, return another IResultSet containing the
+        document ids in the slice; a sort which hasn't been performed yet is
+        limited to the end of the slice.  Otherwise, return the element at
+        index ``item``, resolved if the result set has a valid resolver."""
         
 FWSCAN = 'fwscan'
 NBEST = 'nbest'
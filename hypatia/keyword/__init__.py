@@ -12,6 +12,9 @@ from BTrees.Length import Length
 
 from .interfaces import IKeywordQuerying
 from .. import query
+from ..bitmap import Bitmap
+from ..bitmap import intersect_postings
+from ..bitmap import union_postings
 
 _marker = object()
 
@@ -48,6 +51,17 @@ class KeywordIndex(BaseIndexMixin, Persistent):
     # use a TreeSet for that word instead of a Set.
     tree_threshold = 64
 
+    # If a word is referenced by at least bitmap_threshold docids, use a
+    # compressed Bitmap for that word instead of a TreeSet (None: never).
+    # Postings are converted by index_docs and optimize.
+    bitmap_threshold = None
+
+    # A reverse index probe costs about this many times more than each
+    # docid materialized by a forward index lookup.  Intersections probe
+    # the reverse index when the forward lookup would materialize more than
+    # this many docids per docid to intersect with.
+    probe_factor = 20
+
     def __init__(self, discriminator, family=None):
         if family is not None:
             self.family = family
@@ -70,6 +84,8 @@ class KeywordIndex(BaseIndexMixin, Persistent):
         self._rev_index = self.family.IO.BTree()
         self._num_docs = Length(0)
         self._not_indexed = self.family.IF.TreeSet()
+        self._reset_docids()
+        self._bump_generation()
 
     def unique_values(self):
         """ Return the unique values in the index for all docids as an iterable
@@ -86,6 +102,9 @@ class KeywordIndex(BaseIndexMixin, Persistent):
     def indexed(self):
         return self._rev_index.keys()
 
+    def indexed_count(self):
+        return self._num_docs()
+
     def not_indexed(self):
         return self._not_indexed
 
@@ -96,39 +115,96 @@ class KeywordIndex(BaseIndexMixin, Persistent):
     def applyAny(self, values):
         return self.apply({'query': values, 'operator': 'or'})
 
+    def estimateAny(self, values):
+        """ Return an upper bound on the number of docids ``applyAny`` would
+        return. """
+        return min(sum(self._posting_sizes(values)), self.indexed_count())
+
+    def intersectAny(self, docids, values):
+        return self._intersect(
+            docids, values, 'or', False, self.applyAny, values)
+
     def any(self, value):
         return query.Any(self, value)
 
     def applyNotAny(self, *args, **kw):
         return self._negate(self.applyAny, *args, **kw)
 
+    def estimateNotAny(self, *args, **kw):
+        return self._estimate_negated(self.estimateAny, *args, **kw)
+
+    def intersectNotAny(self, docids, values):
+        return self._intersect(
+            docids, values, 'or', True, self.applyAny, values)
+
     def notany(self, value):
         return query.NotAny(self, value)
 
     def applyAll(self, values):
         return self.apply({'query': values, 'operator': 'and'})
 
+    def estimateAll(self, values):
+        """ Return an upper bound on the number of docids ``applyAll`` would
+        return. """
+        sizes = self._posting_sizes(values)
+        if not sizes:
+            return 0
+        return min(sizes)
+
+    def intersectAll(self, docids, values):
+        return self._intersect(
+            docids, values, 'and', False, self.applyAll, values)
+
     def all(self, value):
         return query.All(self, value)
 
     def applyNotAll(self, *args, **kw):
         return self._negate(self.applyAll, *args, **kw)
 
+    def estimateNotAll(self, *args, **kw):
+        return self._estimate_negated(self.estimateAll, *args, **kw)
+
+    def intersectNotAll(self, docids, values):
+        return self._intersect(
+            docids, values, 'and', True, self.applyAll, values)
+
     def notall(self, value):
         return query.NotAll(self, value)
 
     def applyEq(self, value):
         return self.apply([value])
 
+    def estimateEq(self, value):
+        return self.estimateAll([value])
+
+    def intersectEq(self, docids, value):
+        return self._intersect(
+            docids, [value], 'and', False, self.applyEq, value)
+
     def eq(self, value):
         return query.Eq(self, value)
 
     def applyNotEq(self, *args, **kw):
         return self._negate(self.applyEq, *args, **kw)
 
+    def estimateNotEq(self, *args, **kw):
+        return self._estimate_negated(self.estimateEq, *args, **kw)
+
+    def intersectNotEq(self, docids, value):
+        return self._intersect(
+            docids, [value], 'and', True, self.applyEq, value)
+
     def noteq(self, value):
         return query.NotEq(self, value)
 
+    def _posting_sizes(self, values):
+        """ Return the sizes of the forward index entries of the (normalized)
+        keywords in ``values``. """
+        if isinstance(values, str):
+            values = [values]
+        get = self._fwd_index.get
+        return [len(get(word, ())) for word in self.normalize(values)]
+
     def normalize(self, seq):
         """Perform normalization on sequence of keywords.
 
@@ -153,19 +229,25 @@ class KeywordIndex(BaseIndexMixin, Persistent):
                 self.unindex_doc(docid)
                 # Store docid in set of unindexed docids
                 self._not_indexed.add(docid)
+                self._add_docid(docid)
+                self._bump_generation()
             return None
 
+        if isinstance(seq, str):
+            raise TypeError('seq argument must be a list/tuple of strings')
+
         if docid in self._not_indexed:
             # Remove from set of unindexed docs if it was in there.
             self._not_indexed.remove(docid)
 
-        if isinstance(seq, str):
-            raise TypeError('seq argument must be a list/tuple of strings')
-
         old_kw = self._rev_index.get(docid, None)
         if not seq:
             if old_kw:
                 self.unindex_doc(docid)
+            else:
+                # it may have been removed from the unindexed docids
+                self._remove_docid(docid)
+                self._bump_generation()
             return
 
         seq = self.normalize(seq)
@@ -176,6 +258,8 @@ class KeywordIndex(BaseIndexMixin, Persistent):
             self._insert_forward(docid, new_kw)
             self._insert_reverse(docid, new_kw)
             self._num_docs.change(1)
+            self._add_docid(docid)
+            self._bump_generation()
         else:
             # determine added and removed keywords
             kw_added = self.family.OO.difference(new_kw, old_kw)
@@ -184,6 +268,8 @@ class KeywordIndex(BaseIndexMixin, Persistent):
             if not (kw_added or kw_removed):
                 return
 
+            self._bump_generation()
+
             # removed keywords are removed from the forward index
             for word in kw_removed:
                 fwd = self._fwd_index[word]
@@ -195,11 +281,60 @@ class KeywordIndex(BaseIndexMixin, Persistent):
             self._insert_forward(docid, kw_added)
             self._insert_reverse(docid, new_kw)
 
+    def index_docs(self, docs):
+        """Index several documents.
+
+        ``docs`` is an iterable of ``(docid, obj)`` pairs.  The documents
+        new to the index are grouped by keyword, so that each forward index
+        set is built or updated once, and counters are updated once per
+        call.
+        """
+        new, known = self._split_new_docs(docs)
+        for docid, obj in known:
+            self.index_doc(docid, obj)
+
+        OOSet = self.family.OO.Set
+        groups = self.family.OO.BTree() # keyword -> docids
+        rev_items = []
+        not_indexed = []
+        for docid, obj in new.items():
+            seq = self.discriminate(obj, _marker)
+            if seq is _marker:
+                not_indexed.append(docid)
+                continue
+            if isinstance(seq, str):
+                raise TypeError('seq argument must be a list/tuple of strings')
+            if not seq:
+                continue
+            words = OOSet(self.normalize(seq))
+            for word in words:
+                docids = groups.get(word)
+                if docids is None:
+                    groups[word] = docids = []
+                docids.append(docid)
+            rev_items.append((docid, words))
+
+        if not new:
+            return
+
+        for docids in groups.values():
+            docids.sort()
+        self._insert_forward_many(groups)
+        rev_items.sort()
+        self._rev_index.update(rev_items)
+        self._num_docs.change(len(rev_items))
+        self._not_indexed.update(not_indexed)
+        self._add_docids(
+            sorted([docid for docid, words in rev_items] + not_indexed))
+        self._bump_generation()
+
     def unindex_doc(self, docid):
         _not_indexed = self._not_indexed
         if docid in _not_indexed:
             _not_indexed.remove(docid)
-        
+            self._remove_docid(docid)
+            self._bump_generation()
+
         idx  = self._fwd_index
 
         try:
@@ -217,6 +352,8 @@ class KeywordIndex(BaseIndexMixin, Persistent):
             msg = 'WAAA!  Inconsistent'
 
         self._num_docs.change(-1)
+        self._remove_docid(docid)
+        self._bump_generation()
 
     def _insert_forward(self, docid, words):
         """insert a sequence of words into the forward index """
@@ -231,11 +368,45 @@ class KeywordIndex(BaseIndexMixin, Persistent):
             if word_idx is None:
                 idx[word] = word_idx = Set()
             word_idx.insert(docid)
-            if (not isinstance(word_idx, TreeSet) and
+            if (not isinstance(word_idx, (TreeSet, Bitmap)) and
                     len(word_idx) >= self.tree_threshold):
                 # Convert to a TreeSet.
                 idx[word] = TreeSet(word_idx)
 
+    def _insert_forward_many(self, groups):
+        """insert docids into the forward index, given a mapping of words to
+        sorted sequences of docids"""
+
+        idx = self._fwd_index
+        get_word_idx = idx.get
+        IF = self.family.IF
+        Set = IF.Set
+        TreeSet = IF.TreeSet
+        tree_threshold = self.tree_threshold
+        bitmap_threshold = self.bitmap_threshold
+        for word, docids in groups.items():
+            word_idx = get_word_idx(word)
+            if word_idx is None:
+                if (bitmap_threshold is not None and
+                        len(docids) >= bitmap_threshold):
+                    idx[word] = Bitmap(docids)
+                elif len(docids) >= tree_threshold:
+                    idx[word] = TreeSet(docids)
+                else:
+                    idx[word] = Set(docids)
+                continue
+            word_idx.update(docids)
+            if isinstance(word_idx, Bitmap):
+                continue
+            if (bitmap_threshold is not None and
+                    len(word_idx) >= bitmap_threshold):
+                # Convert to a Bitmap.
+                idx[word] = Bitmap(word_idx)
+            elif (not isinstance(word_idx, TreeSet) and
+                    len(word_idx) >= tree_threshold):
+                # Convert to a TreeSet.
+                idx[word] = TreeSet(word_idx)
+
     def _insert_reverse(self, docid, words):
         """ add words to forward index """
 
@@ -255,16 +426,12 @@ class KeywordIndex(BaseIndexMixin, Persistent):
             sets.append(docids)
 
         if operator == 'or':
-            rs = self.family.IF.multiunion(sets)
+            rs = union_postings(sets, self.family)
         elif operator == 'and':
-            # sort smallest to largest set so we intersect the smallest
-            # number of document identifiers possible
-            sets.sort(key=len)
-            rs = None
-            for set in sets:
-                rs = self.family.IF.intersection(rs, set)
-                if not rs:
-                    break
+            # sets are intersected from smallest to largest, so that we
+            # intersect the smallest number of document identifiers
+            # possible
+            rs = intersect_postings(sets, self.family)
         else:
             raise TypeError('Keyword index only supports `and` and `or` '
                             'operators, not `%s`.' % operator)
@@ -274,32 +441,108 @@ class KeywordIndex(BaseIndexMixin, Persistent):
         else:
             return self.family.IF.Set()
 
-    def apply(self, query):
+    def _parse_query(self, query):
+        # Return the (query, operator) pair ``search`` is called with
         operator = 'and'
         if isinstance(query, dict):
             if 'operator' in query:
                 operator = query['operator']
             query = query['query']
+        return query, operator
+
+    def apply(self, query):
+        query, operator = self._parse_query(query)
         return self.search(query, operator=operator)
 
+    def apply_intersect(self, query, docids):
+        """ Return the intersection of ``apply(query)`` with ``docids``.
+
+        If ``docids`` is small compared to the number of docids
+        ``apply(query)`` would produce, the reverse index is probed for each
+        docid instead of materializing the forward index lookup. """
+        if docids is None:
+            return self.apply(query)
+        words, operator = self._parse_query(query)
+        return self._intersect(
+            docids, words, operator, False, self.apply, query)
+
+    def _intersect(self, docids, words, operator, negate, apply_func, *args):
+        IF = self.family.IF
+        if not len(docids):
+            return IF.Set()
+
+        if isinstance(words, str):
+            words = [words]
+        words = self.normalize(words)
+
+        # ``apply_func`` is the positive query; when ``negate`` is true its
+        # result is removed from ``docids`` instead.
+        threshold = len(docids) * self.probe_factor
+        if operator == 'or':
+            probe = sum(self._posting_sizes(words)) > threshold
+        elif operator == 'and':
+            probe = min(self._posting_sizes(words) or [0]) > threshold
+        else:
+            # let search complain about the operator
+            probe = False
+
+        if not probe:
+            if negate:
+                return self._negate_intersect(docids, apply_func, *args)
+            result = apply_func(*args)
+            if not len(result):
+                return IF.Set()
+            _, result = IF.weightedIntersection(docids, result)
+            return result
+
+        if operator == 'and':
+            test = all
+        else:
+            test = any
+        rev_index = self._rev_index
+        not_indexed = self._not_indexed
+        matched = []
+        for docid in docids:
+            kw = rev_index.get(docid)
+            if kw is None:
+                if negate and docid in not_indexed:
+                    matched.append(docid)
+                continue
+            hit = bool(words) and test(word in kw for word in words)
+            if hit != negate:
+                matched.append(docid)
+
+        if not matched:
+            return IF.Set()
+        _, result = IF.weightedIntersection(docids, IF.Set(matched))
+        return result
+
     def optimize(self):
-        """Optimize the index. Call this after changing tree_threshold.
+        """Optimize the index. Call this after changing tree_threshold or
+        bitmap_threshold.
 
         This converts internal data structures between
-        Sets and TreeSets based on tree_threshold.
+        Sets, TreeSets and Bitmaps based on tree_threshold and
+        bitmap_threshold.
         """
         idx = self._fwd_index
         IF = self.family.IF
         Set = IF.Set
         TreeSet = IF.TreeSet
+        bitmap_threshold = self.bitmap_threshold
         items = list(self._fwd_index.items())
         for word, word_idx in items:
-            if len(word_idx) >= self.tree_threshold:
+            if (bitmap_threshold is not None and
+                    len(word_idx) >= bitmap_threshold):
+                if not isinstance(word_idx, Bitmap):
+                    # Convert to a Bitmap.
+                    idx[word] = Bitmap(word_idx)
+            elif len(word_idx) >= self.tree_threshold:
                 if not isinstance(word_idx, TreeSet):
                     # Convert to a TreeSet.
                     idx[word] = TreeSet(word_idx)
             else:
-                if isinstance(word_idx, TreeSet):
+                if not isinstance(word_idx, Set):
                     # Convert to a Set.
                     idx[word] = Set(word_idx)
 
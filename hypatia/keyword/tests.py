@@ -200,6 +200,72 @@ class _KeywordIndexTestsBase:
         result = index.applyNotEq(5)
         self.assertEqual(list(result), [1, 2, 3, 4, 5, 6])
 
+    def test_estimateEq(self):
+        index = self._makeOne()
+        index.index_doc(1, [1, 2, 3])
+        index.index_doc(2, [3, 4, 5])
+        index.index_doc(3, [5, 6, 7])
+        self.assertEqual(index.estimateEq(5), 2)
+        self.assertEqual(index.estimateEq(8), 0)
+
+    def test_estimateNotEq(self):
+        def discriminator(obj, default):
+            if isinstance(obj, list):
+                return obj
+            return default
+
+        index = self._makeOne(discriminator)
+        index.index_doc(1, [1, 2, 3])
+        index.index_doc(2, [3, 4, 5])
+        index.index_doc(3, [5, 6, 7])
+        index.index_doc(4, (5, 6))
+        self.assertEqual(index.estimateNotEq(5), 2)
+
+    def test_estimateAny(self):
+        index = self._makeOne()
+        index.index_doc(1, [1, 2, 3])
+        index.index_doc(2, [3, 4, 5])
+        index.index_doc(3, [5, 6, 7])
+        self.assertEqual(index.estimateAny([1, 5]), 3)
+        self.assertEqual(index.estimateAny([3, 5]), 3)
+        self.assertEqual(index.estimateAny([]), 0)
+
+    def test_estimateNotAny(self):
+        index = self._makeOne()
+        index.index_doc(1, [1, 2, 3])
+        index.index_doc(2, [3, 4, 5])
+        index.index_doc(3, [5, 6, 7])
+        self.assertEqual(index.estimateNotAny([1]), 2)
+
+    def test_estimateAll(self):
+        index = self._makeOne()
+        index.index_doc(1, [1, 2, 3])
+        index.index_doc(2, [3, 4, 5])
+        index.index_doc(3, [3, 5, 6, 7])
+        self.assertEqual(index.estimateAll([3, 5]), 2)
+        self.assertEqual(index.estimateAll([3, 8]), 0)
+        self.assertEqual(index.estimateAll([]), 0)
+
+    def test_estimateNotAll(self):
+        index = self._makeOne()
+        index.index_doc(1, [1, 2, 3])
+        index.index_doc(2, [3, 4, 5])
+        index.index_doc(3, [3, 5, 6, 7])
+        self.assertEqual(index.estimateNotAll([3, 5]), 1)
+
+    def test_estimate_normalizes(self):
+        index = self._makeOne()
+        index.normalize = lambda seq: [x.lower() for x in seq]
+        index.index_doc(1, ['a', 'b'])
+        index.index_doc(2, ['a'])
+        self.assertEqual(index.estimateEq('A'), 2)
+        self.assertEqual(index.estimateAny('B'), 1)
+
+    def test_indexed_count(self):
+        index = self._makeOne()
+        self._populate(index)
+        self.assertEqual(index.indexed_count(), self._populated_doc_count)
+
 
     def test_optimize_converts_to_tree_set(self):
         index = self._makeOne()
@@ -222,12 +288,228 @@ class _KeywordIndexTestsBase:
         self.assertEqual(set(index.docids()),
                          set((1, 2, 3, 4, 5, 6)))
 
+    def _assertSameIndex(self, index, other):
+        self.assertEqual(
+            [(word, type(docids), list(docids))
+             for word, docids in index._fwd_index.items()],
+            [(word, type(docids), list(docids))
+             for word, docids in other._fwd_index.items()])
+        self.assertEqual(
+            [(docid, list(words)) for docid, words in index._rev_index.items()],
+            [(docid, list(words)) for docid, words in other._rev_index.items()])
+        self.assertEqual(list(index._not_indexed), list(other._not_indexed))
+        self.assertEqual(list(index.docids()), list(other.docids()))
+        self.assertEqual(index.indexed_count(), other.indexed_count())
+        self.assertEqual(index.docids_count(), other.docids_count())
+
+    def test_index_docs(self):
+        docs = [(1, ('zope', 'CMF', 'Zope3')), (2, ('the', 'quick')),
+                (3, ('Zope',)), (4, ()), (5, _marker), (6, ['cmf', 'the']),
+                (2, ('quick', 'brown')), (7, ['zope'])]
+        docs.extend((docid, ['zope', 'many']) for docid in range(10, 20))
+        index = self._makeOne()
+        index.tree_threshold = 5
+        index.index_doc(7, ['the'])
+        index.index_doc(8, ['cmf'])
+        other = self._makeOne()
+        other.tree_threshold = 5
+        other.index_doc(7, ['the'])
+        other.index_doc(8, ['cmf'])
+        for docid, seq in docs:
+            other.index_doc(docid, seq)
+        generation = index.generation()
+        index.index_docs(docs)
+        self._assertSameIndex(index, other)
+        self.assertTrue(index.generation() > generation)
+
+    def test_index_docs_all_known(self):
+        index = self._makeOne()
+        index.index_doc(1, ['zope'])
+        index.index_doc(2, _marker)
+        index.index_docs([(1, ['cmf']), (2, ['zope'])])
+        self.assertEqual(list(index.applyEq('zope')), [2])
+        self.assertEqual(list(index.applyEq('cmf')), [1])
+        self.assertEqual(list(index.not_indexed()), [])
+        self.assertEqual(index.indexed_count(), 2)
+
+    def test_index_docs_w_bitmaps(self):
+        from ..bitmap import Bitmap
+        docs = [(docid, ['many', 'even' if docid % 2 else 'odd'])
+                for docid in range(1, 21)]
+        index = self._makeOne()
+        index.bitmap_threshold = 15
+        index.index_doc(30, ['many'])
+        index.index_docs(docs)
+        self.assertEqual(type(index._fwd_index['many']), Bitmap)
+        self.assertEqual(type(index._fwd_index['odd']), type(self.IFSet()))
+        self.assertEqual(list(index._fwd_index['many']),
+                         list(range(1, 21)) + [30])
+        index.index_doc(31, ['many'])
+        index.index_doc(5, ['odd'])
+        self.assertEqual(type(index._fwd_index['many']), Bitmap)
+        self._search(index, 'many', self.IFSet(
+            [docid for docid in range(1, 21) if docid != 5] + [30, 31]))
+        self._search(index, ['many', 'odd'],
+                     self.IFSet([2, 4, 6, 8, 10, 12, 14, 16, 18, 20]))
+        self._search(index, ['even', 'odd'], self.IFSet(range(1, 21)), 'or')
+
+    def test_index_docs_new_and_updated_bitmaps(self):
+        from ..bitmap import Bitmap
+        index = self._makeOne()
+        index.bitmap_threshold = 3
+        index.index_docs([(docid, ['many']) for docid in range(1, 4)])
+        self.assertEqual(type(index._fwd_index['many']), Bitmap)
+        index.index_docs([(docid, ['many']) for docid in range(4, 6)])
+        self.assertEqual(type(index._fwd_index['many']), Bitmap)
+        self._search(index, 'many', self.IFSet(range(1, 6)))
+
+    def test_optimize_converts_to_bitmap(self):
+        from ..bitmap import Bitmap
+        index = self._makeOne()
+        self._populate(index)
+        index.bitmap_threshold = 1
+        index.optimize()
+        self.assertEqual(type(index._fwd_index['zope']), Bitmap)
+        expected = list(index._fwd_index['zope'])
+        index.bitmap_threshold = None
+        index.optimize()
+        self.assertEqual(type(index._fwd_index['zope']), type(self.IFSet()))
+        self.assertEqual(list(index._fwd_index['zope']), expected)
+
+    def test_index_docs_str(self):
+        index = self._makeOne()
+        self.assertRaises(TypeError, index.index_docs, [(1, ['a']), (2, 'b')])
+        self.assertEqual(list(index.docids()), [])
+
+    def test_generation(self):
+        index = self._makeOne()
+        generation = index.generation()
+        index.index_doc(1, [1, 2])
+        self.assertTrue(index.generation() > generation)
+        generation = index.generation()
+        index.index_doc(1, [2, 1])
+        self.assertEqual(index.generation(), generation)
+        index.index_doc(1, [2])
+        self.assertTrue(index.generation() > generation)
+        generation = index.generation()
+        index.index_doc(1, _marker)
+        self.assertTrue(index.generation() > generation)
+        generation = index.generation()
+        index.unindex_doc(1)
+        self.assertTrue(index.generation() > generation)
+        generation = index.generation()
+        index.reset()
+        self.assertTrue(index.generation() > generation)
+
     def test_docids_with_indexed_and_not_indexed(self):
         index = self._makeOne()
         index.index_doc(1, [1])
         index.index_doc(2, _marker)
         self.assertEqual(set([1, 2]), set(index.docids()))
 
+    def test_docids_count(self):
+        index = self._makeOne()
+        index.index_doc(1, [1])
+        index.index_doc(2, _marker)
+        index.index_doc(3, [3])
+        self.assertEqual(index.docids_count(), 3)
+        index.index_doc(2, [])
+        index.index_doc(3, [])
+        self.assertEqual(index.docids_count(), 1)
+        self.assertEqual(list(index.docids()), [1])
+        index.index_doc(1, [2])
+        self.assertEqual(index.docids_count(), 1)
+        index.unindex_doc(1)
+        self.assertEqual(index.docids_count(), 0)
+
+    def _populateForIntersect(self):
+        def discriminator(obj, default):
+            if isinstance(obj, list):
+                return obj
+            return default
+        index = self._makeOne(discriminator)
+        index.index_doc(1, [1, 2, 3])
+        index.index_doc(2, [3, 4, 5])
+        index.index_doc(3, [5, 6, 7])
+        index.index_doc(4, [7, 8, 9])
+        index.index_doc(5, [9, 10])
+        index.index_doc(6, (5, 6))
+        index.index_doc(7, [])
+        return index
+
+    def _assertIntersects(self, index, name, *args):
+        # The reverse index probe and the forward lookup must agree; neither
+        # may negate by complementing the positive result.
+        docids = self.IFSet([1, 2, 3, 5, 6, 7, 99])
+        expected = index.family.IF.intersection(
+            getattr(index, 'apply' + name)(*args), docids)
+        # building the complement of the positive result would fail
+        index._negate = None
+        index.probe_factor = 1000000
+        forward = getattr(index, 'intersect' + name)(docids, *args)
+        self.assertEqual(list(forward), list(expected))
+        index.probe_factor = 0
+        # so would the forward lookup
+        setattr(index, 'apply' + name, None)
+        probed = getattr(index, 'intersect' + name)(docids, *args)
+        self.assertEqual(list(probed), list(expected))
+        return list(probed)
+
+    def test_intersectEq(self):
+        index = self._populateForIntersect()
+        self.assertEqual(self._assertIntersects(index, 'Eq', 5), [2, 3])
+
+    def test_intersectNotEq(self):
+        index = self._populateForIntersect()
+        self.assertEqual(
+            self._assertIntersects(index, 'NotEq', 5), [1, 5, 6])
+
+    def test_intersectAny(self):
+        index = self._populateForIntersect()
+        self.assertEqual(
+            self._assertIntersects(index, 'Any', [1, 9]), [1, 5])
+
+    def test_intersectNotAny(self):
+        index = self._populateForIntersect()
+        self.assertEqual(
+            self._assertIntersects(index, 'NotAny', [1, 9]), [2, 3, 6])
+
+    def test_intersectAll(self):
+        index = self._populateForIntersect()
+        self.assertEqual(
+            self._assertIntersects(index, 'All', [3, 5]), [2])
+
+    def test_intersectNotAll(self):
+        index = self._populateForIntersect()
+        self.assertEqual(
+            self._assertIntersects(index, 'NotAll', [3, 5]), [1, 3, 5, 6])
+
+    def test_intersect_empty_docids(self):
+        index = self._populateForIntersect()
+        self.assertEqual(list(index.intersectEq(self.IFSet(), 5)), [])
+
+    def test_apply_intersect_docids_None(self):
+        index = self._populateForIntersect()
+        self.assertEqual(list(index.apply_intersect([5], None)), [2, 3])
+
+    def test_apply_intersect(self):
+        index = self._populateForIntersect()
+        docids = self.IFSet([1, 2, 3, 5, 6, 7, 99])
+        for q in ([5], [3, 5], {'query': [1, 5], 'operator': 'or'},
+                  {'query': [1, 9], 'operator': 'and'}):
+            expected = list(index.family.IF.intersection(
+                index.apply(q), docids))
+            for probe_factor in (0, 1000000):
+                index.probe_factor = probe_factor
+                self.assertEqual(
+                    list(index.apply_intersect(q, docids)), expected)
+
+    def test_apply_intersect_bad_operator(self):
+        index = self._populateForIntersect()
+        index.probe_factor = 0
+        self.assertRaises(TypeError, index.apply_intersect,
+                          {'query': [5], 'operator': 'xor'}, self.IFSet([1]))
+
     def test_optimize_converts_to_simple_set(self):
         index = self._makeOne()
         index.tree_threshold = 0
@@ -1,6 +1,9 @@
 import ast
+import collections
 import operator
 import sys
+import threading
+import weakref
 
 import BTrees
 
@@ -47,6 +50,42 @@ class Query(object):
         """
         return self
 
+    def _estimate(self, names, limit=None):
+        """
+        Return an estimate of the number of docids ``_apply`` would return
+        for this subtree, or ``None`` if no cheap estimate is available.
+        If ``limit`` is given, an estimate exceeding it may be truncated.
+        """
+        return None
+
+    def _intersects_cheaply(self):
+        """
+        Return True if ``intersect`` with a few docids costs about as little
+        as checking each of them, rather than evaluating this subtree.
+        """
+        return False
+
+    def _cache_key(self, names):
+        """
+        Return a hashable key identifying the docids ``_apply`` returns for
+        this subtree with ``names`` bound, given the contents of its
+        indexes, or ``None`` if its results can't be cached.
+        """
+        return None
+
+    def _weighted(self):
+        """
+        Return True if ``_apply`` may return a weighted result (a mapping
+        of docids to relevance) for this subtree, rather than a set.
+        """
+        return True
+
+    def _check(self, names):
+        """
+        Raise the error ``_apply`` would raise for this subtree because of
+        its query values, if any, without evaluating it.
+        """
+
     def intersect(self, left, names):
         right = self._apply(names)
         if not len(left) or not len(right):
@@ -98,17 +137,60 @@ class Comparator(Query):
     def flush(self, *arg, **kw):
         self.index.flush(*arg, **kw)
 
-    def execute(self, optimize=True, names=None, resolver=None):
+    def _intersects_cheaply(self):
+        # Indexes providing ``intersect*`` methods can check docids
+        # individually; those methods are named after the comparators.
+        if type(self).intersect is Query.intersect:
+            return False
+        name = 'intersect' + type(self).__name__
+        return getattr(self.index, name, None) is not None
+
+    def _weighted(self):
+        # Indexes which don't say otherwise are assumed to return weights.
+        return getattr(self.index, 'weighted', True)
+
+    def _check(self, names):
+        # Indexes may provide ``validate*`` methods raising the errors
+        # their ``apply*`` counterparts would raise for a value.
+        value = self._get_value(names)
+        validate = getattr(self.index, 'validate' + type(self).__name__, None)
+        if validate is not None:
+            validate(value)
+
+    def _cache_key(self, names):
+        try:
+            value = _hashable(self._get_value(names))
+        except TypeError:
+            return None
+        return (type(self), self.index, value)
+
+    def _intersect_index(self, name, left, names, *args):
+        # Indexes may provide ``intersect*`` methods which intersect ``left``
+        # with the comparator's result without necessarily materializing
+        # the latter; otherwise apply the comparator and intersect.
+        intersect = getattr(self.index, name, None)
+        if intersect is None:
+            return Query.intersect(self, left, names)
+        return intersect(left, *args)
+
+    def _estimate_index(self, name, *args, **kw):
+        # Indexes may provide cheap ``estimate*`` counterparts of their
+        # ``apply*`` methods; those which don't give no estimate.
+        estimate = getattr(self.index, name, None)
+        if estimate is None:
+            return None
+        return estimate(*args, **kw)
+
+    def execute(self, optimize=True, names=None, resolver=None,
+                batch_resolver=None, docid_mapper=None):
         if optimize:
             query = self._optimize()
         else:
             query = self
 
-        return self.index.resultset_from_query(
-            query,
-            names=names,
-            resolver=resolver
-            )
+        return _resultset_from_query(
+            self.index, query, names, resolver, batch_resolver,
+            docid_mapper)
 
 class Contains(Comparator):
     """Contains query.
@@ -119,6 +201,10 @@ class Contains(Comparator):
     def _apply(self, names):
         return self.index.applyContains(self._get_value(names))
 
+    def _estimate(self, names, limit=None):
+        return self._estimate_index(
+            'estimateContains', self._get_value(names))
+
     def __str__(self):
         return '%r in %s' % (self._value, self.index)
 
@@ -133,6 +219,14 @@ class NotContains(Comparator):
     def _apply(self, names):
         return self.index.applyNotContains(self._get_value(names))
 
+    def _estimate(self, names, limit=None):
+        return self._estimate_index(
+            'estimateNotContains', self._get_value(names))
+
+    def intersect(self, left, names):
+        return self._intersect_index(
+            'intersectNotContains', left, names, self._get_value(names))
+
     def __str__(self):
         return '%r not in %s' % (self._value, self.index)
 
@@ -150,6 +244,13 @@ class Eq(Comparator):
     def _apply(self, names):
         return self.index.applyEq(self._get_value(names))
 
+    def _estimate(self, names, limit=None):
+        return self._estimate_index('estimateEq', self._get_value(names))
+
+    def intersect(self, left, names):
+        return self._intersect_index(
+            'intersectEq', left, names, self._get_value(names))
+
     def negate(self):
         return NotEq(self.index, self._value)
 
@@ -164,6 +265,13 @@ class NotEq(Comparator):
     def _apply(self, names):
         return self.index.applyNotEq(self._get_value(names))
 
+    def _estimate(self, names, limit=None):
+        return self._estimate_index('estimateNotEq', self._get_value(names))
+
+    def intersect(self, left, names):
+        return self._intersect_index(
+            'intersectNotEq', left, names, self._get_value(names))
+
     def negate(self):
         return Eq(self.index, self._value)
 
@@ -178,6 +286,14 @@ class Gt(Comparator):
     def _apply(self, names):
         return self.index.applyGt(self._get_value(names))
 
+    def _estimate(self, names, limit=None):
+        return self._estimate_index(
+            'estimateGt', self._get_value(names), limit=limit)
+
+    def intersect(self, left, names):
+        return self._intersect_index(
+            'intersectGt', left, names, self._get_value(names))
+
     def negate(self):
         return Le(self.index, self._value)
 
@@ -192,6 +308,14 @@ class Lt(Comparator):
     def _apply(self, names):
         return self.index.applyLt(self._get_value(names))
 
+    def _estimate(self, names, limit=None):
+        return self._estimate_index(
+            'estimateLt', self._get_value(names), limit=limit)
+
+    def intersect(self, left, names):
+        return self._intersect_index(
+            'intersectLt', left, names, self._get_value(names))
+
     def negate(self):
         return Ge(self.index, self._value)
 
@@ -206,6 +330,14 @@ class Ge(Comparator):
     def _apply(self, names):
         return self.index.applyGe(self._get_value(names))
 
+    def _estimate(self, names, limit=None):
+        return self._estimate_index(
+            'estimateGe', self._get_value(names), limit=limit)
+
+    def intersect(self, left, names):
+        return self._intersect_index(
+            'intersectGe', left, names, self._get_value(names))
+
     def negate(self):
         return Lt(self.index, self._value)
 
@@ -220,6 +352,14 @@ class Le(Comparator):
     def _apply(self, names):
         return self.index.applyLe(self._get_value(names))
 
+    def _estimate(self, names, limit=None):
+        return self._estimate_index(
+            'estimateLe', self._get_value(names), limit=limit)
+
+    def intersect(self, left, names):
+        return self._intersect_index(
+            'intersectLe', left, names, self._get_value(names))
+
     def negate(self):
         return Gt(self.index, self._value)
 
@@ -233,6 +373,13 @@ class Any(Comparator):
     def _apply(self, names):
         return self.index.applyAny(self._get_value(names))
 
+    def _estimate(self, names, limit=None):
+        return self._estimate_index('estimateAny', self._get_value(names))
+
+    def intersect(self, left, names):
+        return self._intersect_index(
+            'intersectAny', left, names, self._get_value(names))
+
     def negate(self):
         return NotAny(self.index, self._value)
 
@@ -250,6 +397,13 @@ class NotAny(Comparator):
     def _apply(self, names):
         return self.index.applyNotAny(self._get_value(names))
 
+    def _estimate(self, names, limit=None):
+        return self._estimate_index('estimateNotAny', self._get_value(names))
+
+    def intersect(self, left, names):
+        return self._intersect_index(
+            'intersectNotAny', left, names, self._get_value(names))
+
     def negate(self):
         return Any(self.index, self._value)
 
@@ -267,6 +421,13 @@ class All(Comparator):
     def _apply(self, names):
         return self.index.applyAll(self._get_value(names))
 
+    def _estimate(self, names, limit=None):
+        return self._estimate_index('estimateAll', self._get_value(names))
+
+    def intersect(self, left, names):
+        return self._intersect_index(
+            'intersectAll', left, names, self._get_value(names))
+
     def negate(self):
         return NotAll(self.index, self._value)
 
@@ -282,7 +443,14 @@ class NotAll(Comparator):
     operator = 'not all'
 
     def _apply(self, names):
-        return self.index.applyAll(self._get_value(names))
+        return self.index.applyNotAll(self._get_value(names))
+
+    def _estimate(self, names, limit=None):
+        return self._estimate_index('estimateNotAll', self._get_value(names))
+
+    def intersect(self, left, names):
+        return self._intersect_index(
+            'intersectNotAll', left, names, self._get_value(names))
 
     def negate(self):
         return All(self.index, self._value)
@@ -360,6 +528,22 @@ class _Range(Comparator, RichComparisonMixin):
                 self.start_exclusive == other.start_exclusive and
                 self.end_exclusive == other.end_exclusive)
 
+    def _cache_key(self, names):
+        try:
+            start = _hashable(self._get_start(names))
+            end = _hashable(self._get_end(names))
+        except TypeError:
+            return None
+        return (type(self), self.index, start, end,
+                self.start_exclusive, self.end_exclusive)
+
+    def _check(self, names):
+        start = self._get_start(names)
+        end = self._get_end(names)
+        validate = getattr(self.index, 'validate' + type(self).__name__, None)
+        if validate is not None:
+            validate(start, end, self.start_exclusive, self.end_exclusive)
+
 class InRange(_Range):
     """ Index value falls within a range.
 
@@ -372,6 +556,18 @@ class InRange(_Range):
             self._get_start(names), self._get_end(names),
             self.start_exclusive, self.end_exclusive)
 
+    def _estimate(self, names, limit=None):
+        return self._estimate_index(
+            'estimateInRange',
+            self._get_start(names), self._get_end(names),
+            self.start_exclusive, self.end_exclusive, limit=limit)
+
+    def intersect(self, left, names):
+        return self._intersect_index(
+            'intersectInRange', left, names,
+            self._get_start(names), self._get_end(names),
+            self.start_exclusive, self.end_exclusive)
+
     def negate(self):
         return NotInRange(self.index, self._start, self._end,
                           self.start_exclusive, self.end_exclusive)
@@ -389,6 +585,18 @@ class NotInRange(_Range):
             self._get_start(names), self._get_end(names),
             self.start_exclusive, self.end_exclusive)
 
+    def _estimate(self, names, limit=None):
+        return self._estimate_index(
+            'estimateNotInRange',
+            self._get_start(names), self._get_end(names),
+            self.start_exclusive, self.end_exclusive)
+
+    def intersect(self, left, names):
+        return self._intersect_index(
+            'intersectNotInRange', left, names,
+            self._get_start(names), self._get_end(names),
+            self.start_exclusive, self.end_exclusive)
+
     def __str__(self):
         return 'not(%s)' % _Range.__str__(self)
 
@@ -422,7 +630,8 @@ class BoolOp(Query):
         for query in self.queries:
             query.flush(*arg, **kw)
 
-    def execute(self, optimize=True, names=None, resolver=None):
+    def execute(self, optimize=True, names=None, resolver=None,
+                batch_resolver=None, docid_mapper=None):
         if not self.queries:
             raise ValueError('No subqueries')
 
@@ -445,16 +654,40 @@ class BoolOp(Query):
         else:
             query = self
 
-        return index.resultset_from_query(
-            query,
-            names=names,
-            resolver=resolver
-            )
+        return _resultset_from_query(
+            index, query, names, resolver, batch_resolver,
+            docid_mapper)
 
     def iter_children(self):
         for query in self.queries:
             yield query
 
+    def _cache_key(self, names):
+        # the order of the subqueries doesn't matter
+        keys = []
+        for query in self.queries:
+            key = query._cache_key(names)
+            if key is None:
+                return None
+            keys.append(key)
+        return (type(self), frozenset(keys))
+
+    def _intersects_cheaply(self):
+        for query in self.queries:
+            if not query._intersects_cheaply():
+                return False
+        return True
+
+    def _weighted(self):
+        for query in self.queries:
+            if query._weighted():
+                return True
+        return False
+
+    def _check(self, names):
+        for query in self.queries:
+            query._check(names)
+
     def _optimize_eq(self):
         # If all queries are Eq operators for the same index, we can replace
         # this And or Or with an All or Any node.
@@ -506,10 +739,46 @@ class Or(BoolOp):
             result = query.union(result, names)
         return result
 
+    def intersect(self, left, names):
+        # Intersect each subquery with the docids of ``left`` and weigh
+        # the union of the matches with ``left`` once, as intersecting
+        # ``_apply``'s result would.  The weights of weighted subqueries
+        # are combined by ``_apply``.
+        if self._weighted():
+            return Query.intersect(self, left, names)
+        IF = self.family.IF
+        if not len(left):
+            self._check(names)
+            return IF.Set()
+        docids = left
+        if hasattr(left, 'items'):
+            docids = IF.Set(left)
+        matched = None
+        for query in self.queries:
+            result = query.intersect(docids, names)
+            if matched is None:
+                matched = result
+            elif len(result):
+                matched = IF.union(matched, result)
+        if not len(matched):
+            return IF.Set()
+        _, result = IF.weightedIntersection(left, matched)
+        return result
+
     def negate(self):
         neg_queries = [query.negate() for query in self.queries]
         return And(*neg_queries)
 
+    def _estimate(self, names, limit=None):
+        # A union is no larger than the sum of its parts.
+        total = 0
+        for query in self.queries:
+            estimate = query._estimate(names, limit)
+            if estimate is None:
+                return None
+            total += estimate
+        return total
+
     def _optimize(self):
         new_me = self._optimize_eq()
         if new_me is not None:
@@ -560,18 +829,74 @@ class And(BoolOp):
 
     def _apply(self, names):
         IF = self.family.IF
-        queries = self.queries
+        queries = [query for _, query in self.plan(names)]
         result = queries[0]._apply(names)
-        for query in queries[1:]:
+        for i, query in enumerate(queries[1:], 1):
             if len(result) == 0:
+                # the subqueries left out still raise their errors
+                _check_all(queries[i:], names)
                 return IF.Set()
             result = query.intersect(result, names)
         return result
 
+    def plan(self, names=None):
+        """
+        Return the order in which the subqueries will be evaluated, as a
+        list of ``(estimate, query)`` tuples.
+
+        Each subquery is asked for a cheap estimate of its result size and
+        the subqueries are ordered from most to least selective, so that
+        the intersection shrinks as early as possible.  Subqueries which
+        can't provide an estimate keep their relative order and are
+        evaluated last.  Estimates larger than the smallest one seen so far
+        may be truncated, as their exact size hardly matters once a smaller
+        subquery has been found.
+
+        The weights of an intersection depend on the order in which weighted
+        results are combined with the others, so subqueries which may return
+        weights keep their position and only the subqueries between them
+        are reordered.
+        """
+        planned = []
+        segment = []
+        limit = None
+        for i, query in enumerate(self.queries):
+            estimate = query._estimate(names, limit)
+            if estimate is not None and (limit is None or estimate < limit):
+                limit = estimate
+            if query._weighted():
+                segment.sort(key=_plan_key)
+                planned.extend(segment)
+                planned.append((estimate, i, query))
+                segment = []
+            else:
+                segment.append((estimate, i, query))
+        segment.sort(key=_plan_key)
+        planned.extend(segment)
+        return [(estimate, query) for estimate, _, query in planned]
+
+    def intersect(self, left, names):
+        IF = self.family.IF
+        queries = [query for _, query in self.plan(names)]
+        for i, query in enumerate(queries):
+            if not len(left):
+                _check_all(queries[i:], names)
+                return IF.Set()
+            left = query.intersect(left, names)
+        return left
+
     def negate(self):
         neg_queries = [query.negate() for query in self.queries]
         return Or(*neg_queries)
 
+    def _estimate(self, names, limit=None):
+        # An intersection is no larger than its smallest part.
+        estimates = [query._estimate(names, limit) for query in self.queries]
+        estimates = [x for x in estimates if x is not None]
+        if not estimates:
+            return None
+        return min(estimates)
+
     def _optimize(self):
         new_me = self._optimize_eq()
         if new_me is not None:
@@ -637,20 +962,79 @@ class Not(Query):
     def _optimize(self):
         return self.query.negate()._optimize()
 
+    def _estimate(self, names, limit=None):
+        return self.query.negate()._estimate(names)
+
+    def intersect(self, left, names):
+        return self.query.negate().intersect(left, names)
+
+    def _intersects_cheaply(self):
+        return self.query.negate()._intersects_cheaply()
+
+    def _weighted(self):
+        return self.query.negate()._weighted()
+
+    def _check(self, names):
+        self.query.negate()._check(names)
+
+    def _cache_key(self, names):
+        key = self.query._cache_key(names)
+        if key is None:
+            return None
+        return (type(self), key)
+
     def flush(self, *arg, **kw):
         self.query.flush(*arg, **kw)
 
-    def execute(self, optimize=True, names=None, resolver=None):
+    def execute(self, optimize=True, names=None, resolver=None,
+                batch_resolver=None, docid_mapper=None):
         if optimize:
             query = self._optimize()
         else:
             query = self
 
-        return self.query.index.resultset_from_query(
-            query,
-            names=names,
-            resolver=resolver
-            )
+        return _resultset_from_query(
+            self.query.index, query, names, resolver, batch_resolver,
+            docid_mapper)
+
+def _resultset_from_query(index, query, names, resolver, batch_resolver,
+                          docid_mapper=None):
+    # indexes may override resultset_from_query without supporting batch
+    # resolvers or docid mappers; the indexes of a catalog mapping document
+    # ids have its mapper
+    kw = {}
+    if batch_resolver is not None:
+        kw['batch_resolver'] = batch_resolver
+    if docid_mapper is None:
+        docid_mapper = getattr(index, 'docid_mapper', None)
+    if docid_mapper is not None:
+        kw['docid_mapper'] = docid_mapper
+    return index.resultset_from_query(
+        query,
+        names=names,
+        resolver=resolver,
+        **kw
+        )
+
+def _hashable(value):
+    # Return a hashable equivalent of a query value; raise TypeError if
+    # there is none.
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_hashable(item) for item in value)
+    hash(value)
+    return value
+
+def _check_all(queries, names):
+    for query in queries:
+        query._check(names)
+
+def _plan_key(item):
+    estimate, i, query = item
+    if estimate is None:
+        return (True, 0, i)
+    return (False, estimate, i)
 
 class Name(object):
     """
@@ -977,17 +1361,150 @@ def optimize(query):
     return query
 
 
-def parse_query(expr, catalog, optimize_query=True):
+class _ParseCache(object):
+    """
+    LRU cache of parsed queries, keyed on expression text and catalog
+    identity.  Catalogs which can't be weakly referenced aren't cached.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, expr, catalog, optimize_query):
+        key = (expr, id(catalog), optimize_query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            ref, query = entry
+            if ref() is not catalog:
+                # the id of a catalog which no longer exists
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return query
+
+    def set(self, expr, catalog, optimize_query, query):
+        if not self.maxsize:
+            return
+        try:
+            ref = weakref.ref(catalog)
+        except TypeError:
+            return
+        key = (expr, id(catalog), optimize_query)
+        with self._lock:
+            entries = self._entries
+            entries[key] = (ref, query)
+            entries.move_to_end(key)
+            while len(entries) > self.maxsize:
+                entries.popitem(last=False)
+
+    def clear(self, catalog=None):
+        with self._lock:
+            if catalog is None:
+                self._entries.clear()
+                return
+            entries = self._entries
+            for key, (ref, query) in list(entries.items()):
+                if ref() is None or ref() is catalog:
+                    del entries[key]
+
+_parse_cache = _ParseCache()
+
+
+def parse_query(expr, catalog, optimize_query=True, cache=False):
     """
     Parses the given expression string and returns a query object.  Requires
     Python >= 2.6.
+
+    If ``cache`` is true, parsed queries are kept in a least recently used
+    cache keyed on ``expr`` and the identity of ``catalog``, and the
+    returned query object may be shared with other callers: it must not be
+    modified.  The cached queries refer to the indexes the catalog held when
+    they were parsed.  The entries of a :class:`hypatia.catalog.Catalog` are
+    dropped when indexes are added to or removed from that catalog object,
+    but not when they are replaced through another object (such as the same
+    catalog loaded by another database connection or process): call
+    :func:`clear_query_cache` then.  By default, a new query object is
+    returned every time.
     """
+    if cache:
+        query = _parse_cache.get(expr, catalog, optimize_query)
+        if query is not None:
+            return query
     query = _AstParser(expr, catalog).parse()
     if optimize_query:
         query = optimize(query)
+    if cache:
+        _parse_cache.set(expr, catalog, optimize_query, query)
     return query
 
 
+def clear_query_cache(catalog=None):
+    """
+    Drop the queries :func:`parse_query` cached for ``catalog``, or for all
+    catalogs if ``catalog`` is ``None``.
+    """
+    _parse_cache.clear(catalog)
+
+
+class PreparedQuery(object):
+    """
+    A query which has been parsed and optimized once, to be executed any
+    number of times with different ``names`` bindings.  See :func:`prepare`.
+
+    The evaluation order of ``And`` subqueries still depends on the values
+    bound to the names and on the contents of the indexes, so it is planned
+    on each execution.
+    """
+
+    def __init__(self, query):
+        self.query = query
+
+    def __str__(self):
+        return str(self.query)
+
+    def execute(self, names=None, resolver=None, batch_resolver=None,
+                docid_mapper=None):
+        """ Execute the query, returning a result set. """
+        return self.query.execute(
+            optimize=False, names=names, resolver=resolver,
+            batch_resolver=batch_resolver, docid_mapper=docid_mapper)
+
+    def _apply(self, names):
+        return self.query._apply(names)
+
+    def _cache_key(self, names):
+        return self.query._cache_key(names)
+
+    def iter_children(self):
+        yield self.query
+
+
+def prepare(query, catalog=None, optimize_query=True):
+    """
+    Return a :class:`PreparedQuery` for ``query``, which is either a query
+    object or an expression string parsed against ``catalog`` (using
+    :func:`parse_query`).  Values which vary between executions should be
+    spelled as :class:`Name` placeholders, and bound via the ``names``
+    argument of :meth:`PreparedQuery.execute`.
+
+    Example::
+
+        find_cats = prepare('color == color and sex == sex', catalog)
+
+        def search_cats(color='tabby', sex='female'):
+            return find_cats.execute(names=dict(color=color, sex=sex))
+    """
+    if isinstance(query, str):
+        query = parse_query(query, catalog, optimize_query)
+    elif optimize_query:
+        query = optimize(query)
+    return PreparedQuery(query)
+
+
 def _print_ast(expr):  # pragma NO COVERAGE
     """
     Useful method for visualizing AST trees while debugging.
@@ -13,6 +13,9 @@ class TestQuery(unittest.TestCase):
         from . import Query as cls
         return cls()
 
+    def test__cache_key(self):
+        self.assertEqual(self._makeOne()._cache_key(None), None)
+
     def test_and(self):
         from . import And
         a = self._makeOne()
@@ -61,6 +64,30 @@ class TestQuery(unittest.TestCase):
         self.assertTrue(isinstance(query.queries[0], And))
         self.assertTrue(isinstance(query.queries[1], Eq))
 
+    def test__estimate(self):
+        a = self._makeOne()
+        self.assertEqual(a._estimate(None), None)
+
+    def test__intersects_cheaply(self):
+        a = self._makeOne()
+        self.assertFalse(a._intersects_cheaply())
+
+    def test__weighted(self):
+        a = self._makeOne()
+        self.assertTrue(a._weighted())
+
+    def test__check(self):
+        a = self._makeOne()
+        self.assertEqual(a._check(None), None)
+
+    def test_intersect_w_empty_result(self):
+        import BTrees
+        IF = BTrees.family64.IF
+        a = self._makeOne()
+        a._apply = lambda names: IF.Set()
+        self.assertEqual(list(a.intersect(IF.Set([1, 2]), None)), [])
+        self.assertEqual(list(a.intersect(IF.Set(), None)), [])
+
     def test_and_type_error(self):
         a = self._makeOne()
         self.assertRaises(TypeError, a.__and__, 2)
@@ -128,6 +155,34 @@ class TestComparator(ComparatorTestBase):
         inst = self._makeOne('index', 'val')
         self.assertEqual(inst, self._makeOne('index', 'val'))
 
+    def test__cache_key(self):
+        from . import Name
+        inst = self._makeOne('index', ['a', [Name('b')], set(['c'])])
+        key = inst._cache_key({'b': 'bval'})
+        self.assertEqual(
+            key,
+            (self._getTargetClass(), 'index',
+             ('a', ('bval',), frozenset(['c']))))
+        self.assertEqual(hash(key), hash(key))
+
+    def test__cache_key_unhashable(self):
+        inst = self._makeOne('index', {'a': 1})
+        self.assertEqual(inst._cache_key(None), None)
+
+    def test__check(self):
+        from . import Name
+        index = DummyIndex()
+        checked = []
+        index.validateComparator = checked.append
+        inst = self._makeOne(index, Name('a'))
+        inst._check({'a': 'aval'})
+        self.assertEqual(checked, ['aval'])
+        self.assertRaises(NameError, inst._check, {})
+
+    def test__check_index_wo_validate(self):
+        inst = self._makeOne(DummyIndex(), 'val')
+        self.assertEqual(inst._check(None), None)
+
     def test_execute(self):
         index = DummyIndex()
         inst = self._makeOne(index, 'val')
@@ -150,6 +205,12 @@ class TestComparator(ComparatorTestBase):
         self.assertEqual(rs['names'], {'a':1})
         self.assertEqual(rs['resolver'], True)
 
+    def test_execute_batch_resolver(self):
+        index = DummyIndex()
+        inst = self._makeOne(index, 'val')
+        rs = inst.execute(batch_resolver='batch')
+        self.assertEqual(rs['batch_resolver'], 'batch')
+
 class TestContains(ComparatorTestBase):
 
     def _getTargetClass(self):
@@ -205,6 +266,12 @@ class TestNotContains(ComparatorTestBase):
         self.assertEqual(result, 'val')
         self.assertEqual(index.not_contains, 'val')
 
+    def test_intersect(self):
+        index = DummyIndex()
+        index.intersectNotContains = lambda *arg: arg
+        inst = self._makeOne(index, 'val')
+        self.assertEqual(inst.intersect('docids', None), ('docids', 'val'))
+
     def test_to_str(self):
         inst = self._makeOne('index', 'val')
         self.assertEqual(str(inst), "'val' not in index")
@@ -238,6 +305,39 @@ class TestEq(ComparatorTestBase):
         inst = self._makeOne('index', 'val')
         self.assertEqual(inst.negate(), NotEq('index', 'val'))
 
+    def test_estimate(self):
+        index = DummyIndex()
+        index.estimateEq = lambda value: len(value)
+        inst = self._makeOne(index, 'val')
+        self.assertEqual(inst._estimate(None), 3)
+
+    def test_estimate_w_names(self):
+        from . import Name
+        index = DummyIndex()
+        index.estimateEq = lambda value: len(value)
+        inst = self._makeOne(index, Name('foo'))
+        self.assertEqual(inst._estimate({'foo': 'abcd'}), 4)
+
+    def test_estimate_index_without_estimator(self):
+        index = DummyIndex()
+        inst = self._makeOne(index, 'val')
+        self.assertEqual(inst._estimate(None), None)
+
+    def test_intersect(self):
+        index = DummyIndex()
+        index.intersectEq = lambda docids, value: (docids, value)
+        inst = self._makeOne(index, 'val')
+        self.assertEqual(inst.intersect('docids', None), ('docids', 'val'))
+
+    def test_intersect_index_without_intersect(self):
+        import BTrees
+        IF = BTrees.family64.IF
+        index = DummyIndex()
+        inst = self._makeOne(index, IF.Set([2, 3]))
+        result = inst.intersect(IF.Set([1, 2]), None)
+        self.assertEqual(list(result), [2])
+        self.assertEqual(list(index.eq), [2, 3])
+
     def test_not_equal_to_another_type(self):
         from . import NotEq
         inst = self._makeOne('index', 'val')
@@ -325,6 +425,18 @@ class TestLt(ComparatorTestBase):
         inst = self._makeOne('index', 'val')
         self.assertEqual(inst.negate(), Ge('index', 'val'))
 
+    def test_estimate(self):
+        index = DummyIndex()
+        index.estimateLt = lambda value, limit=None: (value, limit)
+        inst = self._makeOne(index, 'val')
+        self.assertEqual(inst._estimate(None, 5), ('val', 5))
+
+    def test_intersect(self):
+        index = DummyIndex()
+        index.intersectLt = lambda docids, value: (docids, value)
+        inst = self._makeOne(index, 'val')
+        self.assertEqual(inst.intersect('docids', None), ('docids', 'val'))
+
     def test_not_equal_to_another_type(self):
         from . import Ge
         inst = self._makeOne('index', 'val')
@@ -354,6 +466,18 @@ class TestGe(ComparatorTestBase):
         inst = self._makeOne('index', 'val')
         self.assertEqual(inst.negate(), Lt('index', 'val'))
 
+    def test_estimate(self):
+        index = DummyIndex()
+        index.estimateGe = lambda value, limit=None: (value, limit)
+        inst = self._makeOne(index, 'val')
+        self.assertEqual(inst._estimate(None, 5), ('val', 5))
+
+    def test_intersect(self):
+        index = DummyIndex()
+        index.intersectGe = lambda docids, value: (docids, value)
+        inst = self._makeOne(index, 'val')
+        self.assertEqual(inst.intersect('docids', None), ('docids', 'val'))
+
     def test_not_equal_to_another_type(self):
         from . import Lt
         inst = self._makeOne('index', 'val')
@@ -383,6 +507,18 @@ class TestLe(ComparatorTestBase):
         inst = self._makeOne('index', 'val')
         self.assertEqual(inst.negate(), Gt('index', 'val'))
 
+    def test_estimate(self):
+        index = DummyIndex()
+        index.estimateLe = lambda value, limit=None: (value, limit)
+        inst = self._makeOne(index, 'val')
+        self.assertEqual(inst._estimate(None, 5), ('val', 5))
+
+    def test_intersect(self):
+        index = DummyIndex()
+        index.intersectLe = lambda docids, value: (docids, value)
+        inst = self._makeOne(index, 'val')
+        self.assertEqual(inst.intersect('docids', None), ('docids', 'val'))
+
     def test_not_equal_to_another_type(self):
         from . import Lt
         inst = self._makeOne('index', 'val')
@@ -411,6 +547,12 @@ class TestAll(ComparatorTestBase):
         inst = self._makeOne('index', 'val')
         self.assertEqual(inst.negate(), NotAll('index', 'val'))
 
+    def test_intersect(self):
+        index = DummyIndex()
+        index.intersectAll = lambda docids, value: (docids, value)
+        inst = self._makeOne(index, 'val')
+        self.assertEqual(inst.intersect('docids', None), ('docids', 'val'))
+
     def test_not_equal_to_another_type(self):
         from . import Any
         inst = self._makeOne('index', 'val')
@@ -428,7 +570,13 @@ class TestNotAll(ComparatorTestBase):
         inst = self._makeOne(index, 'val')
         result = inst._apply(None)
         self.assertEqual(result, 'val')
-        self.assertEqual(index.all, 'val')
+        self.assertEqual(index.not_all, 'val')
+
+    def test_intersect(self):
+        index = DummyIndex()
+        index.intersectNotAll = lambda *arg: arg
+        inst = self._makeOne(index, 'val')
+        self.assertEqual(inst.intersect('docids', None), ('docids', 'val'))
 
     def test_to_str(self):
         inst = self._makeOne('index', [1, 2, 3])
@@ -497,6 +645,12 @@ class TestAny(ComparatorTestBase):
         inst = self._makeOne('index', 'val')
         self.assertEqual(inst.negate(), NotAny('index', 'val'))
 
+    def test_intersect(self):
+        index = DummyIndex()
+        index.intersectAny = lambda docids, value: (docids, value)
+        inst = self._makeOne(index, 'val')
+        self.assertEqual(inst.intersect('docids', None), ('docids', 'val'))
+
     def test_not_equal_to_another_type(self):
         from . import NotAny
         inst = self._makeOne('index', 'val')
@@ -525,6 +679,12 @@ class TestNotAny(ComparatorTestBase):
         inst = self._makeOne('index', 'val')
         self.assertEqual(inst.negate(), Any('index', 'val'))
 
+    def test_intersect(self):
+        index = DummyIndex()
+        index.intersectNotAny = lambda docids, value: (docids, value)
+        inst = self._makeOne(index, 'val')
+        self.assertEqual(inst.intersect('docids', None), ('docids', 'val'))
+
     def test_not_equal_to_another_type(self):
         from . import Any
         inst = self._makeOne('index', 'val')
@@ -542,6 +702,27 @@ class TestInRange(ComparatorTestBase):
         return self._getTargetClass()(
             index, begin, end, begin_exclusive, end_exclusive)
 
+    def test__cache_key(self):
+        from . import Name
+        inst = self._makeOne('index', Name('a'), 'end', True)
+        self.assertEqual(
+            inst._cache_key({'a': [1]}),
+            (self._getTargetClass(), 'index', (1,), 'end', True, False))
+        self.assertEqual(inst._cache_key({'a': {}}), None)
+
+    def test__check(self):
+        from . import Name
+        index = DummyIndex()
+        checked = []
+        index.validateInRange = lambda *args: checked.append(args)
+        inst = self._makeOne(index, Name('a'), 'end', True)
+        inst._check({'a': 1})
+        self.assertEqual(checked, [(1, 'end', True, False)])
+        self.assertRaises(NameError, inst._check, {})
+        inst = self._makeOne(DummyIndex(), 'begin', Name('b'))
+        self.assertEqual(inst._check({'b': 2}), None)
+        self.assertRaises(NameError, inst._check, {})
+
     def test_apply(self):
         index = DummyIndex()
         inst = self._makeOne(index, 'begin', 'end')
@@ -559,6 +740,20 @@ class TestInRange(ComparatorTestBase):
         self.assertEqual(
             index.range, ('begin', 'end', False, False))
 
+    def test_estimate(self):
+        index = DummyIndex()
+        index.estimateInRange = lambda *arg, **kw: arg + (kw['limit'],)
+        inst = self._makeOne(index, 'begin', 'end', True)
+        self.assertEqual(inst._estimate(None, 5),
+                         ('begin', 'end', True, False, 5))
+
+    def test_intersect(self):
+        index = DummyIndex()
+        index.intersectInRange = lambda *arg: arg
+        inst = self._makeOne(index, 'begin', 'end', True)
+        self.assertEqual(inst.intersect('docids', None),
+                         ('docids', 'begin', 'end', True, False))
+
     def test_apply_w_names_missing(self):
         from . import Name
         index = DummyIndex()
@@ -654,6 +849,13 @@ class TestNotInRange(ComparatorTestBase):
         inst = self._makeOne('index', 'begin', 'end')
         self.assertEqual(inst.negate(), InRange('index', 'begin', 'end'))
 
+    def test_intersect(self):
+        index = DummyIndex()
+        index.intersectNotInRange = lambda docids, *args: (docids,) + args
+        inst = self._makeOne(index, 'begin', 'end', True)
+        self.assertEqual(inst.intersect('docids', None),
+                         ('docids', 'begin', 'end', True, False))
+
     def test_not_equal_to_another_type(self):
         inst = self._makeOne('index', 'begin', 'end')
         self.assertNotEqual(inst, object())
@@ -683,6 +885,29 @@ class TestBoolOp(BoolOpTestBase):
         o = self._makeOne(left, right)
         self.assertEqual(list(o.iter_children()), [left, right])
 
+    def test__cache_key(self):
+        from . import Eq
+        from . import Or
+        inst = self._makeOne(Eq('index', 1), Eq('index', 2))
+        other = self._makeOne(Eq('index', 2), Eq('index', 1))
+        self.assertEqual(inst._cache_key(None), other._cache_key(None))
+        self.assertNotEqual(
+            inst._cache_key(None),
+            Or(Eq('index', 1), Eq('index', 2))._cache_key(None))
+
+    def test__cache_key_uncacheable_child(self):
+        from . import Eq
+        inst = self._makeOne(Eq('index', 1), DummyQuery([]))
+        self.assertEqual(inst._cache_key(None), None)
+
+    def test__check(self):
+        left = DummyQuery([])
+        right = DummyQuery([])
+        inst = self._makeOne(left, right)
+        inst._check(None)
+        self.assertTrue(left.checked)
+        self.assertTrue(right.checked)
+
     def test_flush(self):
         left = self._makeDummyQuery({'foo': 11})
         right = self._makeDummyQuery({'bar': 12})
@@ -745,6 +970,83 @@ class TestOr(BoolOpTestBase):
         self.assertTrue(left.negated)
         self.assertTrue(right.negated)
 
+    def test_estimate(self):
+        left = DummyQuery(set([1, 2]), estimate=2)
+        right = DummyQuery(set([3, 4, 5]), estimate=3)
+        o = self._makeOne(left, right)
+        self.assertEqual(o._estimate(None), 5)
+
+    def test_estimate_unknown(self):
+        left = DummyQuery(set([1, 2]), estimate=2)
+        right = DummyQuery(set([3, 4, 5]))
+        o = self._makeOne(left, right)
+        self.assertEqual(o._estimate(None), None)
+
+    def test_intersect(self):
+        from BTrees import family64
+        from . import Eq
+        index = DummyIntersectIndex()
+        o = self._makeOne(Eq(index, [1, 2, 9]), Eq(index, [2, 3]))
+        result = o.intersect(family64.IF.Set([2, 3, 4]), None)
+        self.assertEqual(list(result), [2, 3])
+
+    def test_intersect_empty(self):
+        from BTrees import family64
+        from . import Eq
+        index = DummyIntersectIndex()
+        o = self._makeOne(Eq(index, [1]), Eq(index, [2]))
+        result = o.intersect(family64.IF.Set([3, 4]), None)
+        self.assertEqual(list(result), [])
+        result = o.intersect(family64.IF.Set(), None)
+        self.assertEqual(list(result), [])
+
+    def test_intersect_empty_checks(self):
+        from BTrees import family64
+        query = DummyQuery(set([1]))
+        o = self._makeOne(query, DummyQuery(set([2])))
+        self.assertEqual(list(o.intersect(family64.IF.Set(), None)), [])
+        self.assertTrue(query.checked)
+        self.assertFalse(query.applied)
+
+    def test_intersect_weighted_left(self):
+        from BTrees import family64
+        from . import Eq
+        index = DummyIntersectIndex()
+        o = self._makeOne(Eq(index, [1, 2]), Eq(index, [2, 3]))
+        left = family64.IF.Bucket({1: 0.5, 2: 0.25, 4: 1.0})
+        result = o.intersect(left, None)
+        # weighed with ``left`` once, though 2 matches both subqueries
+        self.assertEqual(list(result.items()), [(1, 1.5), (2, 1.25)])
+        self.assertEqual(index.intersected, [[1, 2, 4], [1, 2, 4]])
+
+    def test_intersect_weighted(self):
+        from BTrees import family64
+        from . import Contains, Eq
+        IF = family64.IF
+        index = DummyIntersectIndex()
+        weighted = Contains(DummyIndex(), IF.Bucket({2: 0.5, 3: 0.25}))
+        o = self._makeOne(Eq(index, IF.Set([1, 2])), weighted)
+        result = o.intersect(IF.Bucket({1: 0.5, 2: 0.25, 4: 1.0}), None)
+        self.assertEqual(list(result.items()), [(1, 1.5), (2, 1.75)])
+        self.assertEqual(index.intersected, [])
+
+    def test__weighted(self):
+        from . import Eq
+        o = self._makeOne(Eq(DummyIntersectIndex(), [1]),
+                          Eq(DummyIntersectIndex(), [2]))
+        self.assertFalse(o._weighted())
+        o = self._makeOne(Eq(DummyIntersectIndex(), [1]),
+                          Eq(DummyIndex(), 2))
+        self.assertTrue(o._weighted())
+
+    def test__intersects_cheaply(self):
+        from . import Contains, Eq
+        index = DummyIntersectIndex()
+        o = self._makeOne(Eq(index, [1]), Eq(index, [2]))
+        self.assertTrue(o._intersects_cheaply())
+        o = self._makeOne(Eq(index, [1]), Contains(index, [2]))
+        self.assertFalse(o._intersects_cheaply())
+
 class TestAnd(BoolOpTestBase):
 
     def _getTargetClass(self):
@@ -774,6 +1076,7 @@ class TestAnd(BoolOpTestBase):
         self.assertEqual(o._apply(None), set())
         self.assertTrue(left.applied)
         self.assertFalse(right.applied)
+        self.assertTrue(right.checked)
         self.assertEqual(left.intersected, None)
         self.assertEqual(right.intersected, None)
 
@@ -788,6 +1091,104 @@ class TestAnd(BoolOpTestBase):
         self.assertEqual(left.intersected, None)
         self.assertEqual(right.intersected, None)
 
+    def test_apply_most_selective_first(self):
+        left = DummyQuery(set([1, 2, 3]), estimate=3)
+        right = DummyQuery(set([3]), estimate=1)
+        o = self._makeOne(left, right)
+        o.family = DummyFamily()
+        self.assertEqual(o._apply(None), set([3]))
+        self.assertEqual(right.intersected, None)
+        self.assertEqual(left.intersected, (right.results, left.results))
+
+    def test_apply_most_selective_empty(self):
+        left = DummyQuery(set([1, 2, 3]), estimate=3)
+        right = DummyQuery(set(), estimate=0)
+        o = self._makeOne(left, right)
+        o.family = DummyFamily()
+        self.assertEqual(o._apply(None), set())
+        self.assertTrue(right.applied)
+        self.assertFalse(left.applied)
+        self.assertTrue(left.checked)
+
+    def test_plan(self):
+        first = DummyQuery(set([1, 2, 3]), estimate=3)
+        second = DummyQuery(set([1]))
+        third = DummyQuery(set([3]), estimate=1)
+        fourth = DummyQuery(set([2]))
+        fifth = DummyQuery(set([1, 2]), estimate=1)
+        o = self._getTargetClass()(first, second, third, fourth, fifth)
+        self.assertEqual(
+            o.plan(),
+            [(1, third), (1, fifth), (3, first), (None, second),
+             (None, fourth)])
+
+    def test_plan_keeps_weighted_in_place(self):
+        first = DummyQuery(set([1, 2, 3]), estimate=3)
+        second = DummyQuery(set([1]), estimate=1)
+        weighted = DummyQuery({1: 0.5}, estimate=5)
+        weighted.weighted = True
+        fourth = DummyQuery(set([2]), estimate=2)
+        fifth = DummyQuery(set([1, 2]), estimate=1)
+        o = self._getTargetClass()(first, second, weighted, fourth, fifth)
+        self.assertEqual(
+            o.plan(),
+            [(1, second), (3, first), (5, weighted), (1, fifth),
+             (2, fourth)])
+
+    def test_plan_w_names(self):
+        from . import Eq, Name
+        index = DummyIndex()
+        index.weighted = False
+        index.estimateEq = lambda value: value
+        left = Eq(index, Name('a'))
+        right = Eq(index, Name('b'))
+        o = self._makeOne(left, right)
+        self.assertEqual(o.plan({'a': 10, 'b': 2}), [(2, right), (10, left)])
+
+    def test_intersect(self):
+        from BTrees import family64
+        from . import Eq
+        index = DummyIntersectIndex()
+        o = self._makeOne(Eq(index, [1, 2, 3]), Eq(index, [2, 3, 4]))
+        result = o.intersect(family64.IF.Set([2, 3, 5]), None)
+        self.assertEqual(list(result), [2, 3])
+        self.assertEqual(index.intersected, [[2, 3, 5], [2, 3]])
+
+    def test_intersect_stops_when_empty(self):
+        from BTrees import family64
+        from . import Eq
+        index = DummyIntersectIndex()
+        o = self._makeOne(Eq(index, [1]), Eq(index, [2]))
+        result = o.intersect(family64.IF.Set([2, 3]), None)
+        self.assertEqual(list(result), [])
+        self.assertEqual(index.intersected, [[2, 3]])
+
+    def test_intersect_empty_checks(self):
+        from BTrees import family64
+        left = DummyQuery(set([1]))
+        right = DummyQuery(set([2]))
+        o = self._makeOne(left, right)
+        self.assertEqual(list(o.intersect(family64.IF.Set(), None)), [])
+        self.assertTrue(left.checked)
+        self.assertTrue(right.checked)
+        self.assertFalse(left.applied)
+
+    def test_plan_limits_estimates(self):
+        from . import Gt
+        index = DummyIndex()
+        index.weighted = False
+        limits = []
+        def estimateGt(value, limit=None):
+            limits.append(limit)
+            return value
+        index.estimateGt = estimateGt
+        first = Gt(index, 10)
+        second = Gt(index, 2)
+        third = Gt(index, 5)
+        o = self._getTargetClass()(first, second, third)
+        self.assertEqual(o.plan(), [(2, second), (5, third), (10, first)])
+        self.assertEqual(limits, [None, 10, 2])
+
     def test_negate(self):
         from . import Or
         left = DummyQuery('foo')
@@ -799,6 +1200,19 @@ class TestAnd(BoolOpTestBase):
         self.assertTrue(left.negated)
         self.assertTrue(right.negated)
 
+    def test_estimate(self):
+        left = DummyQuery(set([1, 2]), estimate=2)
+        middle = DummyQuery(set([3, 4, 5]))
+        right = DummyQuery(set([3, 4, 5]), estimate=3)
+        o = self._getTargetClass()(left, middle, right)
+        self.assertEqual(o._estimate(None), 2)
+
+    def test_estimate_unknown(self):
+        left = DummyQuery(set([1, 2]))
+        right = DummyQuery(set([3, 4, 5]))
+        o = self._makeOne(left, right)
+        self.assertEqual(o._estimate(None), None)
+
 class TestBoolOpExecute(unittest.TestCase):
 
     def _makeDummyQuery(self, values):
@@ -891,6 +1305,15 @@ class TestNot(BoolOpTestBase):
         o = self._makeOne(None)
         self.assertEqual(str(o), 'Not')
 
+    def test__cache_key(self):
+        from . import Eq
+        from . import Not
+        o = self._makeOne(Eq('index', 1))
+        key = o._cache_key(None)
+        self.assertEqual(key, (Not, (Eq, 'index', 1)))
+        self.assertNotEqual(key, Eq('index', 1)._cache_key(None))
+        self.assertEqual(self._makeOne(DummyQuery([]))._cache_key(None), None)
+
     def test_apply(self):
         query = DummyQuery('foo')
         o = self._makeOne(query)
@@ -903,6 +1326,41 @@ class TestNot(BoolOpTestBase):
         o = self._makeOne(query)
         self.assertEqual(o.negate(), query)
 
+    def test_estimate(self):
+        query = DummyQuery('foo', estimate=5)
+        o = self._makeOne(query)
+        self.assertEqual(o._estimate(None), 5)
+        self.assertTrue(query.negated)
+
+    def test__intersects_cheaply(self):
+        from . import Eq
+        o = self._makeOne(Eq(DummyIntersectIndex(), [1]))
+        self.assertTrue(o._intersects_cheaply())
+        docids = o.family.IF.Set([1, 2])
+        self.assertEqual(list(o.intersect(docids, None)), [2])
+        o = self._makeOne(Eq(DummyIndex(), 1))
+        self.assertFalse(o._intersects_cheaply())
+
+    def test__weighted(self):
+        from . import Eq
+        self.assertFalse(self._makeOne(
+            Eq(DummyIntersectIndex(), [1]))._weighted())
+        self.assertTrue(self._makeOne(Eq(DummyIndex(), 1))._weighted())
+
+    def test__check(self):
+        query = DummyQuery('foo')
+        o = self._makeOne(query)
+        o._check(None)
+        self.assertTrue(query.negated)
+        self.assertTrue(query.checked)
+
+    def test_intersect(self):
+        query = DummyQuery(set([2, 3]))
+        o = self._makeOne(query)
+        self.assertEqual(o.intersect(set([1, 2]), None), set([2]))
+        self.assertTrue(query.negated)
+        self.assertEqual(query.intersected, (set([1, 2]), set([2, 3])))
+
     def test_iter_children(self):
         query = DummyQuery('foo')
         o = self._makeOne(query)
@@ -1371,6 +1829,171 @@ class Test_parse_query(unittest.TestCase):
         self.assertTrue(isinstance(op.queries[1].queries[1], Lt))
 
 
+class Test_parse_query_cache(unittest.TestCase):
+
+    def setUp(self):
+        from . import clear_query_cache
+        clear_query_cache()
+
+    tearDown = setUp
+
+    def _makeCatalog(self):
+        class Catalog(object):
+            def __getitem__(self, name):
+                return DummyIndex(name)
+        return Catalog()
+
+    def test_not_cached_by_default(self):
+        from . import parse_query
+        catalog = self._makeCatalog()
+        query = parse_query('a == 1', catalog)
+        self.assertFalse(parse_query('a == 1', catalog) is query)
+        self.assertFalse(parse_query('a == 1', catalog, cache=True) is query)
+
+    def test_cached_per_expression_and_catalog(self):
+        from . import parse_query
+        catalog = self._makeCatalog()
+        query = parse_query('a == 1', catalog, cache=True)
+        self.assertTrue(parse_query('a == 1', catalog, cache=True) is query)
+        self.assertFalse(parse_query('a == 2', catalog, cache=True) is query)
+        self.assertFalse(
+            parse_query('a == 1', catalog, False, cache=True) is query)
+        self.assertFalse(
+            parse_query('a == 1', self._makeCatalog(), cache=True) is query)
+
+    def test_clear_query_cache_for_catalog(self):
+        from . import clear_query_cache
+        from . import parse_query
+        catalog = self._makeCatalog()
+        other = self._makeCatalog()
+        query = parse_query('a == 1', catalog, cache=True)
+        other_query = parse_query('a == 1', other, cache=True)
+        clear_query_cache(catalog)
+        self.assertFalse(parse_query('a == 1', catalog, cache=True) is query)
+        self.assertTrue(
+            parse_query('a == 1', other, cache=True) is other_query)
+
+    def test_least_recently_used_evicted(self):
+        from . import _parse_cache
+        from . import parse_query
+        catalog = self._makeCatalog()
+        _parse_cache.maxsize = 2
+        try:
+            first = parse_query('a == 1', catalog, cache=True)
+            second = parse_query('a == 2', catalog, cache=True)
+            self.assertTrue(
+                parse_query('a == 1', catalog, cache=True) is first)
+            parse_query('a == 3', catalog, cache=True)
+            self.assertTrue(
+                parse_query('a == 1', catalog, cache=True) is first)
+            self.assertFalse(
+                parse_query('a == 2', catalog, cache=True) is second)
+        finally:
+            _parse_cache.maxsize = 256
+
+    def test_catalog_not_weakly_referenceable(self):
+        from . import parse_query
+        class Catalog(dict):
+            __slots__ = ()
+            def __missing__(self, name):
+                return DummyIndex(name)
+        catalog = Catalog()
+        query = parse_query('a == 1', catalog, cache=True)
+        self.assertFalse(parse_query('a == 1', catalog, cache=True) is query)
+
+
+    def test_maxsize_0(self):
+        from . import _parse_cache
+        from . import parse_query
+        catalog = self._makeCatalog()
+        _parse_cache.maxsize = 0
+        try:
+            query = parse_query('a == 1', catalog, cache=True)
+            self.assertFalse(parse_query('a == 1', catalog, cache=True)
+                             is query)
+        finally:
+            _parse_cache.maxsize = 256
+
+    def test_dead_catalog_entries_dropped(self):
+        import gc
+        from . import _parse_cache
+        from . import clear_query_cache
+        from . import parse_query
+        catalog = self._makeCatalog()
+        parse_query('a == 1', catalog, cache=True)
+        key = ('a == 1', id(catalog), True)
+        ref, query = _parse_cache._entries[key]
+        # an entry whose catalog is gone, and whose id is reused
+        _parse_cache._entries[key] = (lambda: None, query)
+        self.assertEqual(_parse_cache.get('a == 1', catalog, True), None)
+        self.assertFalse(key in _parse_cache._entries)
+        other = self._makeCatalog()
+        parse_query('a == 1', other, cache=True)
+        del other
+        gc.collect()
+        clear_query_cache(catalog)
+        self.assertEqual(len(_parse_cache._entries), 0)
+
+
+class Test_prepare(unittest.TestCase):
+
+    def _callFUT(self, query, catalog=None, optimize_query=True):
+        from . import prepare
+        return prepare(query, catalog, optimize_query)
+
+    def test_expression(self):
+        from . import Eq, Name, PreparedQuery
+        class Catalog(object):
+            def __getitem__(self, name):
+                return DummyIndex(name)
+        prepared = self._callFUT('a == b', Catalog())
+        self.assertTrue(isinstance(prepared, PreparedQuery))
+        self.assertTrue(isinstance(prepared.query, Eq))
+        self.assertTrue(isinstance(prepared.query._value, Name))
+        self.assertEqual(prepared._apply({'b': 1}), 1)
+        self.assertEqual(prepared._apply({'b': 2}), 2)
+
+    def test_query_object_optimized(self):
+        from . import Any, Eq, Or
+        index = DummyIndex()
+        prepared = self._callFUT(Or(Eq(index, 1), Eq(index, 2)))
+        self.assertEqual(prepared.query, Any(index, [1, 2]))
+
+    def test_query_object_not_optimized(self):
+        from . import Eq, Or
+        index = DummyIndex()
+        query = Or(Eq(index, 1), Eq(index, 2))
+        prepared = self._callFUT(query, optimize_query=False)
+        self.assertTrue(prepared.query is query)
+
+    def test_execute(self):
+        from . import Eq
+        index = DummyIndex()
+        query = Eq(index, 1)
+        query._optimize = lambda: self.fail('optimized again')
+        prepared = self._callFUT(query, optimize_query=False)
+        result = prepared.execute(names={'a': 1}, resolver='resolver')
+        self.assertEqual(
+            result,
+            {'query': query, 'names': {'a': 1}, 'resolver': 'resolver'})
+        self.assertEqual(str(prepared), str(query))
+
+    def test__cache_key(self):
+        from . import Eq
+        query = Eq('index', 1)
+        prepared = self._callFUT(query, optimize_query=False)
+        self.assertEqual(prepared._cache_key(None), query._cache_key(None))
+        self.assertEqual(list(prepared.iter_children()), [query])
+
+    def test_execute_batch_resolver(self):
+        from . import Eq
+        index = DummyIndex()
+        prepared = self._callFUT(Eq(index, 1))
+        result = prepared.execute(batch_resolver='batch')
+        self.assertEqual(result['batch_resolver'], 'batch')
+
+
+
 class DummyIndex(object):
     def __init__(self, name=None):
         self.name = name
@@ -1422,6 +2045,10 @@ class DummyIndex(object):
         self.all = value
         return value
 
+    def applyNotAll(self, value):
+        self.not_all = value
+        return value
+
     def applyInRange(self, start, end, start_exclusive, end_exclusive):
         self.range = (start, end, start_exclusive, end_exclusive)
         return self.range
@@ -1433,8 +2060,28 @@ class DummyIndex(object):
     def qname(self):
         return str(self.name)
 
-    def resultset_from_query(self, query, names=None, resolver=None):
-        return {'query':query, 'names':names, 'resolver':resolver}
+    def resultset_from_query(self, query, names=None, resolver=None, **kw):
+        result = {'query':query, 'names':names, 'resolver':resolver}
+        result.update(kw)
+        return result
+
+class DummyIntersectIndex(DummyIndex):
+    # Eq values are the lists of docids they match.
+
+    weighted = False
+
+    def __init__(self, name=None):
+        DummyIndex.__init__(self, name)
+        self.intersected = []
+
+    def intersectEq(self, docids, value):
+        from BTrees import family64
+        self.intersected.append(list(docids))
+        return family64.IF.intersection(docids, family64.IF.Set(value))
+
+    def intersectNotEq(self, docids, value):
+        from BTrees import family64
+        return family64.IF.difference(docids, family64.IF.Set(value))
 
 class DummyFamily(object):
     @property
@@ -1449,17 +2096,23 @@ class DummyQuery(object):
     applied = False
     negated = False
     flushed = False
+    checked = False
+    weighted = False
     intersected = None
     unioned = None
 
-    def __init__(self, results, index=None):
+    def __init__(self, results, index=None, estimate=None):
         self.results = results
         self.index = index
+        self.estimate = estimate
 
     def _apply(self, names):
         self.applied = True
         return self.results
 
+    def _estimate(self, names, limit=None):
+        return self.estimate
+
     def negate(self):
         self.negated = True
         return self
@@ -1467,6 +2120,15 @@ class DummyQuery(object):
     def _optimize(self):
         return self
 
+    def _cache_key(self, names):
+        return None
+
+    def _weighted(self):
+        return self.weighted
+
+    def _check(self, names):
+        self.checked = True
+
     def flush(self, value):
         self.flushed = value
     
@@ -163,6 +163,102 @@ class TestQueryExecution(unittest.TestCase, _CatalogMaker):
         self.assertEqual(len(resultset), 2)
         self.assertEqual(list(resultset.ids), [4, 5])
 
+    def test_plan(self):
+        self._makeCatalog()
+        noteq = self.title.noteq('title3')
+        any = self.name.any(['name1', 'name2', 'name3', 'name4', 'name5'])
+        all = self.allowed.all(['a', 'b'])
+        contains = self.text.contains('body')
+        query = noteq & any & all & contains
+        self.assertEqual(
+            query.plan(),
+            [(3, all), (5, noteq), (5, any), (None, contains)])
+        resultset = query.execute(optimize=False)
+        self.assertEqual(sorted(resultset.ids), [4, 5])
+
+    def test_sort_with_limit_pushed_down(self):
+        self._makeCatalog()
+        query = self.allowed.any(['a', 'b']) & self.title.noteq('title4')
+        expected = list(query.execute().sort(self.name, limit=2).ids)
+        self.name.probe_factor = 0
+        for reverse in (False, True):
+            resultset = query.execute().sort(
+                self.name, limit=2, reverse=reverse)
+            self.assertEqual(resultset.ids, self.name.sort_query(
+                query, limit=2, reverse=reverse))
+        self.assertEqual(
+            query.execute().sort(self.name, limit=2).ids, expected)
+        self.assertEqual(
+            query.execute().sort(self.name, limit=2, reverse=True).ids,
+            [5, 4])
+
+    def test_negation_inside_and(self):
+        self._makeCatalog()
+        for negated in (
+                self.title.noteq('title3'),
+                self.allowed.notany(['c', 'd']),
+                self.allowed.notall(['a', 'c']),
+                self.name.notinrange('name2', 'name4'),
+                self.text.notcontains('five'),
+                query.Not(self.name.eq('name4')),
+                ):
+            positive = self.allowed.any(['a', 'b', 'c'])
+            expected = set(positive._apply(None)) & set(negated._apply(None))
+            resultset = (positive & negated).execute(optimize=False)
+            self.assertEqual(set(resultset.ids), expected)
+
+    def test_weights_of_or_inside_and(self):
+        from BTrees import family64
+        self._makeCatalog()
+        text = self.text.contains('body')
+        left = text._apply(None)
+        for or_ in (
+                # doc 1 matches both subqueries
+                self.name.eq('name1') | self.allowed.any(['a']),
+                self.text.contains('one') | self.name.eq('name2'),
+                ):
+            _, expected = family64.IF.weightedIntersection(
+                left, or_._apply(None))
+            expected = dict(expected.items())
+            self.assertEqual(dict(or_.intersect(left, None).items()),
+                             expected)
+            self.assertEqual(dict((text & or_)._apply(None).items()),
+                             expected)
+
+    def test_weights_and_errors_of_and_as_in_given_order(self):
+        import itertools
+        from BTrees import family64
+        from ..text.parsetree import ParseError
+        IF = family64.IF
+        self._makeCatalog()
+
+        def combine(queries):
+            # the subqueries of an And combined in the order given
+            result = queries[0]._apply(None)
+            for query in queries[1:]:
+                _, result = IF.weightedIntersection(
+                    result, query._apply(None))
+            return result
+
+        queries = [
+            self.text.contains('body'),
+            self.text.notcontains('three'),
+            self.title.noteq('title3'),
+            self.allowed.all(['a']),
+            ]
+        for ordered in itertools.permutations(queries):
+            self.assertEqual(
+                list(query.And(*ordered)._apply(None).items()),
+                list(combine(ordered).items()))
+
+        queries = [
+            self.name.eq('nomatch'),
+            self.allowed.any(['a']),
+            self.text.contains(','),
+            ]
+        for ordered in itertools.permutations(queries):
+            self.assertRaises(ParseError, query.And(*ordered)._apply, None)
+
 class TestFieldIndexResultSetSortStabilityGuarantee(unittest.TestCase):
     def _makeCatalog(self):
         from ..catalog import Catalog
@@ -13,6 +13,8 @@
 ##############################################################################
 """Text index.
 """
+import heapq
+import operator
 import sys
 
 from persistent import Persistent
@@ -35,6 +37,7 @@ from .queryparser import QueryParser
 from .parsetree import ParseError
 
 from ..util import BaseIndexMixin 
+from ..util import Extractor
 from .. import query
 
 _marker = object()
@@ -45,6 +48,10 @@ _marker = object()
     IIndexStatistics
     )
 class TextIndex(BaseIndexMixin, Persistent):
+
+    # ``apply`` returns the relevance of the docids
+    weighted = True
+
     def __init__(self, discriminator, lexicon=None, index=None,
                  family=None):
         if family is not None:
@@ -66,7 +73,9 @@ class TextIndex(BaseIndexMixin, Persistent):
 
     def reset(self):
         self._not_indexed = self.family.IF.TreeSet()
+        self._reset_docids()
         self.index.reset()
+        self._bump_generation()
 
     def document_repr(self, docid, default=None):
         return self.index.document_repr(docid, default)
@@ -79,19 +88,69 @@ class TextIndex(BaseIndexMixin, Persistent):
             self.unindex_doc(docid)
             # Store docid in set of unindexed docids
             self._not_indexed.add(docid)
+            self._add_docid(docid)
+            self._bump_generation()
             return None
 
         if docid in self._not_indexed:
             # Remove from set of unindexed docs if it was in there.
             self._not_indexed.remove(docid)
 
+        old_words = self._indexed_words(docid)
         self.index.index_doc(docid, text)
+        self._add_docid(docid)
+        if old_words is None or old_words != self._indexed_words(docid):
+            self._bump_generation()
+
+    def _indexed_words(self, docid):
+        # The encoded words the underlying index stores for ``docid``, or
+        # None if they aren't known.
+        docwords = getattr(self.index, '_docwords', None)
+        if docwords is None:
+            return None
+        return docwords.get(docid)
+
+    def extractor(self):
+        # the lexicon pipeline runs along with the discriminator
+        processor = getattr(self.lexicon, 'processor', None)
+        if processor is None:
+            return BaseIndexMixin.extractor(self)
+        return Extractor(self.discriminator, processor())
+
+    def index_docs(self, docs):
+        new, known = self._split_new_docs(docs)
+        for docid, obj in known:
+            self.index_doc(docid, obj)
+
+        texts = []
+        not_indexed = []
+        for docid, obj in new.items():
+            text = self.discriminate(obj, _marker)
+            if text is _marker:
+                not_indexed.append(docid)
+            else:
+                texts.append((docid, text))
+
+        if not new:
+            return
+
+        index_docs = getattr(self.index, 'index_docs', None)
+        if index_docs is None:
+            for docid, text in texts:
+                self.index.index_doc(docid, text)
+        else:
+            index_docs(texts)
+        self._not_indexed.update(not_indexed)
+        self._add_docids(sorted(new))
+        self._bump_generation()
 
     def unindex_doc(self, docid):
         _not_indexed = self._not_indexed
         if docid in _not_indexed:
             _not_indexed.remove(docid)
         self.index.unindex_doc(docid)
+        self._remove_docid(docid)
+        self._bump_generation()
 
     def reindex_doc(self, docid, object):
         # index_doc knows enough about reindexing to do the right thing
@@ -125,8 +184,20 @@ class TextIndex(BaseIndexMixin, Persistent):
             return False
 
     def apply(self, querytext, start=0, count=None):
+        """Return a mapping of the docids matching ``querytext`` to their
+        relevance.
+
+        If ``count`` is not None, only the ``count`` most relevant docids,
+        after the ``start`` most relevant ones, are returned.  The best
+        docids of queries which are a plain "OR" of words are found
+        without scoring all the docids they match, when the underlying
+        index has a ``search_top`` method.
+        """
         tree = self.parse_query(querytext)
-        results = tree.executeQuery(self.index)
+        if count is None:
+            results = tree.executeQuery(self.index)
+        else:
+            results = self._execute_top(tree, start, count)
         if results:
             qw = self.index.query_weight(tree.terms())
             
@@ -146,22 +217,47 @@ class TextIndex(BaseIndexMixin, Persistent):
 
         return results
  
+    def _execute_top(self, tree, start, count):
+        search_top = getattr(self.index, 'search_top', None)
+        if (search_top is not None and tree.nodeType() == 'OR' and
+                all(node.nodeType() == 'ATOM' for node in tree.getValue())):
+            results = search_top(tree.terms(), start + count)
+        else:
+            results = tree.executeQuery(self.index)
+            if results is None:
+                return results
+        best = heapq.nlargest(start + count, results.items(),
+                              key=operator.itemgetter(1))
+        return self.family.IF.BTree(best[start:])
+
     def applyContains(self, value):
         return self.apply(value)
 
+    def validateContains(self, value):
+        """ Raise the ParseError ``applyContains`` would raise for
+        ``value``, if any. """
+        self.parse_query(value)
+
     def contains(self, value):
         return query.Contains(self, value)
 
     def applyNotContains(self, *args, **kw):
         return self._negate(self.applyContains, *args, **kw)
 
+    def intersectNotContains(self, docids, value):
+        return self._negate_intersect(docids, self.applyContains, value)
+
+    validateNotContains = validateContains
+
     def notcontains(self, value):
         return query.NotContains(self, value)
 
     applyEq = applyContains
+    validateEq = validateContains
     eq = contains
 
     applyNotEq = applyNotContains
+    validateNotEq = validateContains
     noteq = notcontains
 
     def sort(self, result, reverse=False, limit=None, sort_type=None,
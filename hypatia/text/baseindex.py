@@ -13,7 +13,11 @@
 ##############################################################################
 """Abstract base class for full text index with relevance ranking.
 """
+from array import array
+import heapq
+from itertools import accumulate
 import math
+import sys
 
 from persistent import Persistent
 from zope.interface import implementer
@@ -46,6 +50,16 @@ class BaseIndex(Persistent):
 
     family = BTrees.family64
 
+    # wid -> {docid -> encoded positions of wid in the doc}, or
+    # None if positions aren't kept (see enable_positions).  Like
+    # _wordinfo, the docid maps are dicts until they reach DICT_CUTOFF
+    # docids.
+    _positions = None
+
+    # The most words a glob pattern is expanded to by search_glob, or None
+    # for no limit.  The words in the most documents are kept.
+    max_glob_words = None
+
     lexicon = property(lambda self: self._lexicon,)
 
     def __init__(self, lexicon, family=None):
@@ -86,6 +100,31 @@ class BaseIndex(Persistent):
         self.word_count = Length.Length()
         self.indexed_count = Length.Length()
 
+        if self._positions is not None:
+            self._positions = IOBTree()
+
+    def enable_positions(self):
+        """Keep the positions of each word in each document.
+
+        Phrases are then matched by comparing the positions of their words
+        rather than by decoding the words of each candidate document.
+        The positions of the documents already indexed are computed from
+        their stored words, so existing indexes can be migrated by calling
+        this method.
+        """
+        if self._positions is not None:
+            return
+        self._positions = IOBTree()
+        wid2docpositions = {}
+        for docid, docwords in self._docwords.items():
+            _add_docpositions(wid2docpositions, docid,
+                              widcode.decode(docwords))
+        self._mass_add_positions(wid2docpositions)
+
+    def disable_positions(self):
+        """Stop keeping the positions of words in documents."""
+        self._positions = None
+
     def word_count(self):
         """Return the number of words in the index."""
         # This must be overridden by subclasses which do not set the
@@ -121,6 +160,8 @@ class BaseIndex(Persistent):
         self._mass_add_wordinfo(wid2weight, docid)
         self._docweight[docid] = docweight
         self._docwords[docid] = widcode.encode(wids)
+        if self._positions is not None:
+            self._add_positions(wids, docid)
         try:
             self.indexed_count.change(1)
         except AttributeError:
@@ -128,16 +169,69 @@ class BaseIndex(Persistent):
             self.indexed_count = Length.Length(len(self._docweight))
         return len(wids)
 
+    def index_docs(self, docs):
+        """ Index the text of each ``(docid, text)`` pair of the iterable
+        ``docs``.  The documents new to the index are indexed in bulk: each
+        word's docid-to-weight map is updated once per call. """
+        new = {}
+        for docid, text in docs:
+            if docid in self._docwords:
+                self.index_doc(docid, text)
+            else:
+                new[docid] = text
+        if new:
+            self._index_new_docs(sorted(new.items()))
+
+    # A subclass may wish to extend or override this.
+    def _index_new_docs(self, docs):
+        # Index a sorted sequence of ``(docid, text)`` pairs for docids not
+        # in the index; return the total number of words.
+        wid2docweights = {} # wid -> [(docid, weight)]
+        wid2docpositions = {} # wid -> [(docid, positions)]
+        positions = self._positions is not None
+        docweights = []
+        docwords = []
+        count = 0
+        for docid, text in docs:
+            wids = self._lexicon.sourceToWordIds(text)
+            wid2weight, docweight = self._get_frequencies(wids)
+            for wid, weight in wid2weight.items():
+                docweight_list = wid2docweights.get(wid)
+                if docweight_list is None:
+                    wid2docweights[wid] = docweight_list = []
+                docweight_list.append((docid, weight))
+            if positions:
+                _add_docpositions(wid2docpositions, docid, wids)
+            docweights.append((docid, docweight))
+            docwords.append((docid, widcode.encode(wids)))
+            count += len(wids)
+        self._mass_add_wordinfos(wid2docweights)
+        if positions:
+            self._mass_add_positions(wid2docpositions)
+        self._docweight.update(docweights)
+        self._docwords.update(docwords)
+        try:
+            self.indexed_count.change(len(docs))
+        except AttributeError:
+            # upgrade indexed_count to Length object
+            self.indexed_count = Length.Length(len(self._docweight))
+        return count
+
     # A subclass may wish to extend or override this.  This is for adjusting
     # to a new version of a doc that already exists.  The goal is to be
     # faster than simply unindexing the old version in its entirety and then
     # adding the new version in its entirety.
     def reindex_doc(self, docid, text):
+        new_wids = self._lexicon.sourceToWordIds(text)
+        new_docwords = widcode.encode(new_wids)
+        old_docwords = self._docwords[docid]
+        if new_docwords == old_docwords:
+            # Same words in the same order:  nothing to do.
+            return len(new_wids)
+
         # Touch as few docid->w(docid, score) maps in ._wordinfo as possible.
-        old_wids = self.get_words(docid)
+        old_wids = widcode.decode(old_docwords)
         old_wid2w, old_docw = self._get_frequencies(old_wids)
-
-        new_wids = self._lexicon.sourceToWordIds(text)
         new_wid2w, new_docw = self._get_frequencies(new_wids)
 
         old_widset = self.family.IF.TreeSet(old_wid2w.keys())
@@ -164,8 +258,13 @@ class BaseIndex(Persistent):
             if old_wid2w[wid] != newscore:
                 self._add_wordinfo(wid, newscore, docid)
 
+        if self._positions is not None:
+            for wid in only_old_widset.keys():
+                self._del_positions(wid, docid)
+            self._add_positions(new_wids, docid)
+
         self._docweight[docid] = new_docw
-        self._docwords[docid] = widcode.encode(new_wids)
+        self._docwords[docid] = new_docwords
         return len(new_wids)
 
     # Subclass must override.
@@ -188,6 +287,8 @@ class BaseIndex(Persistent):
             return
         for wid in self.family.IF.TreeSet(self.get_words(docid)).keys():
             self._del_wordinfo(wid, docid)
+            if self._positions is not None:
+                self._del_positions(wid, docid)
         del self._docwords[docid]
         del self._docweight[docid]
         try:
@@ -206,6 +307,11 @@ class BaseIndex(Persistent):
     def search_glob(self, pattern):
         wids = self._lexicon.globToWordIds(pattern)
         wids = self._remove_oov_wids(wids)
+        limit = self.max_glob_words
+        if limit is not None and len(wids) > limit:
+            wordinfo = self._wordinfo
+            wids = heapq.nlargest(limit, wids,
+                                  key=lambda wid: len(wordinfo[wid]))
         return mass_weightedUnion(self._search_wids(wids), self.family)
 
     def search_phrase(self, phrase):
@@ -218,25 +324,138 @@ class BaseIndex(Persistent):
         hits = mass_weightedIntersection(scores, self.family)
         if not hits:
             return hits
-        code = widcode.encode(wids)
         result = self.family.IF.BTree()
+        if self._positions is not None:
+            for docid, weight in hits.items():
+                if self._phrase_starts(wids, docid):
+                    result[docid] = weight
+            return result
+        code = widcode.encode(wids)
         for docid, weight in hits.items():
             docwords = self._docwords[docid]
             if docwords.find(code) >= 0:
                 result[docid] = weight
         return result
 
+    def search_near(self, words, distance):
+        wids = []
+        for word in words:
+            wids.extend(self._lexicon.termToWordIds(word))
+        if not wids:
+            return None # All docs match
+        cleaned_wids = self._remove_oov_wids(wids)
+        if len(wids) != len(cleaned_wids):
+            # At least one wid was OOV:  can't possibly find it.
+            return self.family.IF.BTree()
+        hits = mass_weightedIntersection(self._search_wids(wids),
+                                         self.family)
+        result = self.family.IF.BTree()
+        for docid, weight in hits.items():
+            span = _min_span(self._word_positions(wids, docid))
+            if span is None:
+                # a repeated word isn't repeated in the document
+                continue
+            # the number of other words in the smallest window containing
+            # all the words
+            gap = span - len(wids) + 1
+            if gap <= distance:
+                result[docid] = self._near_weight(weight, gap)
+        return result
+
+    # A subclass may override this to score documents in which the words of
+    # a NEAR query are closer higher.
+    def _near_weight(self, weight, gap):
+        return weight
+
+    def _word_positions(self, wids, docid):
+        # The sorted positions of each of ``wids`` in the document
+        # ``docid``.
+        if self._positions is not None:
+            positions = self._positions
+            return [decode_positions(positions[wid][docid]) for wid in wids]
+        wid2positions = dict([(wid, []) for wid in wids])
+        for position, wid in enumerate(self.get_words(docid)):
+            wid_positions = wid2positions.get(wid)
+            if wid_positions is not None:
+                wid_positions.append(position)
+        return [wid2positions[wid] for wid in wids]
+
+    def _phrase_starts(self, wids, docid):
+        # The positions at which the words of ``wids`` follow each other in
+        # the document ``docid``, which contains all of them.
+        positions = self._positions
+        starts = None
+        for i, wid in enumerate(wids):
+            wid_positions = decode_positions(positions[wid][docid])
+            if i:
+                wid_positions = map((-i).__add__, wid_positions)
+            if starts is None:
+                starts = set(wid_positions)
+            else:
+                starts.intersection_update(wid_positions)
+            if not starts:
+                break
+        return starts
+
+    def search_top(self, terms, count):
+        # MaxScore:  the terms are scored from the one with the highest
+        # upper bound to the lowest, accumulating the scores of the docids
+        # they match.  Once the sum of the upper bounds of the terms left
+        # is lower than the count'th best accumulated score, a docid which
+        # hasn't been seen yet can't be one of the best, so the remaining
+        # terms are only scored for the docids already seen:  long
+        # postings of common words aren't scored in full.
+        wids = []
+        for term in terms:
+            wids.extend(self._lexicon.termToWordIds(term))
+        wids = self._remove_oov_wids(wids)
+        IF = self.family.IF
+        if not wids or count < 1:
+            return IF.BTree()
+        ranked = sorted(zip(self._upper_bounds(wids), wids), reverse=True)
+        scores = IF.Bucket()
+        pruning = False
+        for i, (bound, wid) in enumerate(ranked):
+            if pruning:
+                [(result, weight)] = self._search_wids([wid], scores)
+            else:
+                [(result, weight)] = self._search_wids([wid])
+            dummy, scores = IF.weightedUnion(scores, result, 1, weight)
+            if not pruning and len(scores) >= count:
+                remaining = sum(bound for bound, wid in ranked[i + 1:])
+                # no accumulated score can exceed the bounds seen so far
+                if remaining < sum(bound for bound, wid in ranked[:i + 1]):
+                    kth = heapq.nlargest(count, scores.values())[-1]
+                    pruning = remaining < kth
+        return IF.BTree(heapq.nlargest(count, scores.items(),
+                                       key=lambda item: item[1]))
+
     def _remove_oov_wids(self, wids):
         return [wid for wid in wids if wid in self._wordinfo]
 
     # Subclass must override.
     # The workhorse.  Return a list of (IFBucket, weight) pairs, one pair
     # for each wid t in wids.  The IFBucket, times the weight, maps D to
-    # TF(D,t) * IDF(t) for every docid D containing t.  wids must not
-    # contain any OOV words.
-    def _search_wids(self, wids):
+    # TF(D,t) * IDF(t) for every docid D containing t (and in docids, a set
+    # or mapping, if it isn't None).  wids must not contain any OOV words.
+    def _search_wids(self, wids, docids=None):
+        raise NotImplementedError
+
+    # Subclass must override to support search_top.
+    # Return, for each wid t in wids, an upper bound of the scores, times
+    # their weight, _search_wids would return for t.
+    def _upper_bounds(self, wids):
         raise NotImplementedError
 
+    def _restrict(self, d2w, docids):
+        # The part of the docid-to-weight map d2w for the docids in
+        # ``docids``.
+        if isinstance(d2w, dict):
+            d2w = self.family.IF.Bucket(d2w)
+        dummy, result = self.family.IF.weightedIntersection(
+            d2w, docids, 1, 0)
+        return result
+
     # Subclass must override.
     # It's not clear what it should do.  It must return an upper bound on
     # document scores for the query.  It would be nice if a document score
@@ -321,6 +540,66 @@ class BaseIndex(Persistent):
             # upgrade word_count to Length object
             self.word_count = Length.Length(len(self._wordinfo))
 
+    # Bulk version of _mass_add_wordinfo, for a mapping of wids to sequences
+    # of (docid, weight) pairs.
+    def _mass_add_wordinfos(self, wid2docweights):
+        dicttype = type({})
+        wordinfo = self._wordinfo
+        get_doc2score = wordinfo.get
+        IFBTree = self.family.IF.BTree
+        new_word_count = 0
+        for wid in sorted(wid2docweights):
+            docweights = wid2docweights[wid]
+            doc2score = get_doc2score(wid)
+            if doc2score is None:
+                doc2score = {}
+                new_word_count += 1
+            if (isinstance(doc2score, dicttype) and
+                    len(doc2score) + len(docweights) > self.DICT_CUTOFF):
+                doc2score = IFBTree(doc2score)
+            doc2score.update(docweights)
+            wordinfo[wid] = doc2score # not redundant:  Persistency!
+        try:
+            self.word_count.change(new_word_count)
+        except AttributeError:
+            # upgrade word_count to Length object
+            self.word_count = Length.Length(len(self._wordinfo))
+
+    def _add_positions(self, wids, docid):
+        # Store the positions of the words of ``wids`` in the document
+        # ``docid``.
+        wid2docpositions = {}
+        _add_docpositions(wid2docpositions, docid, wids)
+        self._mass_add_positions(wid2docpositions)
+
+    def _mass_add_positions(self, wid2docpositions):
+        # Store the positions of wids in documents, given as a mapping of
+        # wids to sequences of (docid, positions) pairs.
+        dicttype = type({})
+        positions = self._positions
+        get_doc2positions = positions.get
+        BTree = self.family.IO.BTree
+        for wid in sorted(wid2docpositions):
+            docpositions = wid2docpositions[wid]
+            doc2positions = get_doc2positions(wid)
+            if doc2positions is None:
+                doc2positions = {}
+            if (isinstance(doc2positions, dicttype) and
+                    len(doc2positions) + len(docpositions) > self.DICT_CUTOFF):
+                doc2positions = BTree(doc2positions)
+            doc2positions.update(
+                [(docid, encode_positions(wid_positions))
+                 for docid, wid_positions in docpositions])
+            positions[wid] = doc2positions # not redundant:  Persistency!
+
+    def _del_positions(self, wid, docid):
+        doc2positions = self._positions[wid]
+        del doc2positions[docid]
+        if doc2positions:
+            self._positions[wid] = doc2positions # Persistency!
+        else:
+            del self._positions[wid]
+
     def _del_wordinfo(self, wid, docid):
         doc2score = self._wordinfo[wid]
         del doc2score[docid]
@@ -334,6 +613,80 @@ class BaseIndex(Persistent):
                 # upgrade word_count to Length object
                 self.word_count = Length.Length(len(self._wordinfo))
 
+def _add_docpositions(wid2docpositions, docid, wids):
+    # Add (docid, positions) to the list of wid2docpositions for each wid
+    # in the document's ``wids``.
+    wid2positions = {}
+    for position, wid in enumerate(wids):
+        wid_positions = wid2positions.get(wid)
+        if wid_positions is None:
+            wid2positions[wid] = wid_positions = []
+        wid_positions.append(position)
+    for wid, wid_positions in wid2positions.items():
+        docpositions = wid2docpositions.get(wid)
+        if docpositions is None:
+            wid2docpositions[wid] = docpositions = []
+        docpositions.append((docid, wid_positions))
+
+def _min_span(word_positions):
+    # The smallest difference between the last and the first position of
+    # a window containing a position from each of the non-empty sorted
+    # lists of ``word_positions``, or None if there is none.  The lists
+    # of a word given several times are equal: the window must then
+    # contain as many of its positions.  Found by sliding the window over
+    # the merged lists.
+    needed = {}
+    for positions in word_positions:
+        key = tuple(positions)
+        needed[key] = needed.get(key, 0) + 1
+    merged = sorted((position, key) for key in needed for position in key)
+    found = dict.fromkeys(needed, 0)
+    missing = len(needed)
+    smallest = len(word_positions) - 1
+    best = None
+    first = 0
+    for last, key in merged:
+        found[key] += 1
+        if found[key] == needed[key]:
+            missing -= 1
+        while not missing:
+            position, dropped = merged[first]
+            if best is None or last - position < best:
+                best = last - position
+                if best == smallest:
+                    return best
+            found[dropped] -= 1
+            if found[dropped] < needed[dropped]:
+                missing += 1
+            first += 1
+    return best
+
+def encode_positions(positions):
+    """Encode a sorted list of positions as bytes.
+
+    The differences between consecutive positions are stored as an array
+    of the smallest unsigned integer type holding all of them, preceded
+    by its type code; they're little-endian.
+    """
+    deltas = [b - a for a, b in zip([0] + positions, positions)]
+    typecode = 'B'
+    biggest = max(deltas, default=0)
+    if biggest > 0xFFFF:
+        typecode = 'I'
+    elif biggest > 0xFF:
+        typecode = 'H'
+    deltas = array(typecode, deltas)
+    if sys.byteorder == 'big': #pragma NO COVERAGE
+        deltas.byteswap()
+    return typecode.encode('ascii') + deltas.tobytes()
+
+def decode_positions(code):
+    """Decode bytes made by encode_positions into a list of positions."""
+    deltas = array(chr(code[0]), code[1:])
+    if sys.byteorder == 'big': #pragma NO COVERAGE
+        deltas.byteswap()
+    return list(accumulate(deltas))
+
 def inverse_doc_frequency(term_count, num_items):
     """Return the inverse doc frequency for a term,
 
@@ -59,7 +59,7 @@ class CosineIndex(BaseIndex):
     #    W(q) = sqrt(sum(for t in q: w(q, t) ** 2))
     #        computed by self.query_weight()
 
-    def _search_wids(self, wids):
+    def _search_wids(self, wids, docids=None):
         if not wids:
             return []
         N = float(len(self._docweight))
@@ -70,11 +70,19 @@ class CosineIndex(BaseIndex):
             d2w = self._wordinfo[wid] # maps docid to w(docid, wid)
             idf = inverse_doc_frequency(len(d2w), N)  # an unscaled float
             #print "idf = %.3f" % idf
-            if isinstance(d2w, DictType):
+            if docids is not None:
+                d2w = self._restrict(d2w, docids)
+            elif isinstance(d2w, DictType):
                 d2w = self.family.IF.Bucket(d2w)
             L.append((d2w, idf))
         return L
 
+    def _upper_bounds(self, wids):
+        # w(d, t) / W(d) is at most 1, so a score is at most its weight.
+        N = float(len(self._docweight))
+        return [inverse_doc_frequency(len(self._wordinfo[wid]), N)
+                for wid in wids]
+
     def query_weight(self, terms):
         wids = []
         for term in terms:
@@ -122,7 +122,8 @@ class IQueryParseTree(Interface):
     def nodeType():
         """Return the node type.
 
-        This is one of 'AND', 'OR', 'NOT', 'ATOM', 'PHRASE' or 'GLOB'.
+        This is one of 'AND', 'OR', 'NOT', 'ATOM', 'PHRASE', 'NEAR' or
+        'GLOB'.
         """
 
     def getValue():
@@ -134,6 +135,7 @@ class IQueryParseTree(Interface):
         'NOT'             a parse tree
         'ATOM'            a string (representing a single search term)
         'PHRASE'          a string (representing a search phrase)
+        'NEAR'            a list of words, which must be near each other
         'GLOB'            a string (representing a pattern, e.g. "foo*")
         """
 
@@ -198,6 +200,13 @@ class IExtendedQuerying(Interface):
         Return an IFBtree mapping docid to score.
         """
 
+    def search_near(words, distance):
+        """Execute a search for documents containing all of ``words``,
+        in any order, with at most ``distance`` other words between them.
+
+        Return an IFBTree mapping docid to score.
+        """
+
     def search_glob(pattern):
         """Execute a pattern search.
 
@@ -208,6 +217,14 @@ class IExtendedQuerying(Interface):
         Return an IFBTree mapping docid to score.
         """
 
+    def search_top(terms, count):
+        """Execute a search for the documents matching any of ``terms``.
+
+        Return an IFBTree mapping the ``count`` best scoring docids to
+        their score, which is the sum of their scores for each term, as
+        for an "OR" of the terms.
+        """
+
     def query_weight(terms):
         """Return the weight for a set of query terms.
 
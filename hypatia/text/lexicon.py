@@ -13,12 +13,16 @@
 ##############################################################################
 """Lexicon
 """
+import collections
 import re
 
 from zope.interface import implementer
 
+from BTrees.IIBTree import IITreeSet
+from BTrees.IIBTree import intersection
 from BTrees.IOBTree import IOBTree
 from BTrees.OIBTree import OIBTree
+from BTrees.OOBTree import OOBTree
 from BTrees.Length import Length
 
 from persistent import Persistent
@@ -33,6 +37,17 @@ from .parsetree import QueryError
 @implementer(ILexicon)
 class Lexicon(Persistent):
 
+    # trigram -> IITreeSet of the wids of the words containing it, or None
+    # if there is no trigram index (see enable_trigrams).  Words are padded
+    # with _BOUNDARY, so "foo" has the trigrams "\0fo", "foo" and "oo\0".
+    _trigrams = None
+
+    # number of glob patterns whose expansion is cached (see globToWordIds)
+    glob_cache_size = 128
+
+    # number of query terms whose processing is cached (see termToWordIds)
+    term_cache_size = 256
+
     def __init__(self, *pipeline):
         self._wids = OIBTree()  # word -> wid
         self._words = IOBTree() # wid -> word
@@ -61,9 +76,13 @@ class Lexicon(Persistent):
     def sourceToWordIds(self, text):
         if text is None:
             text = ''
-        last = _text2list(text)
-        for element in self._pipeline:
-            last = element.process(last)
+        if isinstance(text, Words):
+            # already processed by this lexicon's pipeline
+            last = text
+        else:
+            last = _text2list(text)
+            for element in self._pipeline:
+                last = element.process(last)
         if not isinstance(self.word_count, Length):
             # Make sure word_count is overridden with a BTrees.Length.Length
             self.word_count = Length(self.word_count())        
@@ -74,22 +93,70 @@ class Lexicon(Persistent):
         self.word_count._p_deactivate()
         return [self._getWordIdCreate(x) for x in last]
 
+    def processor(self):
+        """ Return a callable which accepts a text and returns the
+        :class:`Words` this lexicon's pipeline produces for it, without using
+        the lexicon; ``sourceToWordIds`` accepts them in place of the text.
+        """
+        return Pipeline(self._pipeline)
+
     def termToWordIds(self, text):
-        last = _text2list(text)
-        for element in self._pipeline:
-            last = element.process(last)
-        wids = []
-        for word in last:
-            wids.append(self._wids.get(word, 0))
-        return wids
+        entry = self._termEntry(text, False)
+        generation = self._generation()
+        if generation is None or entry[2] != generation:
+            entry[2] = generation
+            entry[3] = tuple([self._wids.get(word, 0) for word in entry[0]])
+        return list(entry[3])
 
     def parseTerms(self, text):
-        last = _text2list(text)
-        for element in self._pipeline:
-            process = getattr(element, "processGlob", element.process)
-            last = process(last)
+        last = list(self._termEntry(text, True)[1])
+        if self._trigrams is None:
+            # Leading glob characters are only supported with a trigram
+            # index:  ignore them.
+            last = [term.lstrip("*?") for term in last]
+            last = [term for term in last if term]
         return last
 
+    def enable_trigrams(self):
+        """Maintain an index of the trigrams of the words in the lexicon.
+
+        Glob patterns are then matched by intersecting the sets of words
+        containing their trigrams instead of scanning the words starting
+        with their prefix, and may start with a glob character (e.g.
+        ``*foo*`` or ``?ar``).  The words already in the lexicon are
+        indexed, so existing lexicons can be migrated by calling this
+        method.
+        """
+        if self._trigrams is not None:
+            return
+        trigram2wids = {}
+        for word, wid in self._wids.items():
+            for trigram in _word_trigrams(word):
+                wids = trigram2wids.get(trigram)
+                if wids is None:
+                    trigram2wids[trigram] = wids = []
+                wids.append(wid)
+        self._trigrams = OOBTree()
+        for trigram, wids in trigram2wids.items():
+            self._trigrams[trigram] = IITreeSet(wids)
+        self.clear_glob_cache()
+
+    def disable_trigrams(self):
+        """Drop the trigram index of the words in the lexicon."""
+        self._trigrams = None
+        self.clear_glob_cache()
+
+    def clear_glob_cache(self):
+        """Forget the cached expansions of glob patterns."""
+        self._v_glob_cache = None
+
+    def clear_term_cache(self):
+        """Forget the cached words and wids of query terms.
+
+        Call it after changing the pipeline, e.g. its stop words.
+        """
+        self._v_term_cache = None
+
     def isGlob(self, word):
         return "*" in word or "?" in word
 
@@ -100,8 +167,86 @@ class Lexicon(Persistent):
         return self._wids.get(word, 0)
 
     def globToWordIds(self, pattern):
+        # The expansions of the most recently used patterns are cached
+        # until words are added to the lexicon, but not while added words
+        # aren't committed.  The cache is volatile:  it isn't stored, and
+        # each connection has its own.
+        if not self.isGlob(pattern):
+            return self._globToWordIds(pattern)
+        generation = self._generation()
+        if generation is None or not self.glob_cache_size:
+            return self._globToWordIds(pattern)
+        cache = getattr(self, '_v_glob_cache', None)
+        if cache is None or cache[0] != generation:
+            cache = self._v_glob_cache = (
+                generation, collections.OrderedDict())
+        entries = cache[1]
+        wids = entries.get(pattern)
+        if wids is None:
+            wids = entries[pattern] = tuple(self._globToWordIds(pattern))
+            while len(entries) > self.glob_cache_size:
+                entries.popitem(last=False)
+        else:
+            entries.move_to_end(pattern)
+        return list(wids)
+
+    def _termEntry(self, text, glob):
+        # Return [words, globwords, generation, wids] for ``text``:  the
+        # words the pipeline produces for it, using processGlob for
+        # globwords, and their wids when the lexicon was at ``generation``.
+        # Only the words asked for (``glob``) are sure to be there:  the
+        # two are processed separately, as pipeline elements may process
+        # words differently in processGlob even without glob characters.
+        # The wids are None until termToWordIds looks them up.  Like glob
+        # expansions, the entries of the most recently used texts are
+        # cached.
+        if not isinstance(text, str) or not self.term_cache_size:
+            words = self._process(text, glob)
+            return [words, words, None, None]
+        cache = getattr(self, '_v_term_cache', None)
+        if cache is None:
+            cache = self._v_term_cache = collections.OrderedDict()
+        entry = cache.get(text)
+        if entry is None:
+            entry = cache[text] = [None, None, None, None]
+            while len(cache) > self.term_cache_size:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(text)
+        i = 1 if glob else 0
+        if entry[i] is None:
+            entry[i] = self._process(text, glob)
+        return entry
+
+    def _process(self, text, glob):
+        last = _text2list(text)
+        for element in self._pipeline:
+            process = element.process
+            if glob:
+                process = getattr(element, "processGlob", process)
+            last = process(last)
+        return tuple(last)
+
+    def _generation(self):
+        # A value which changes when words are added, or None if there is
+        # no cheap way to tell or words were added but aren't committed
+        # yet (an abort would revert the count to a value it has had
+        # before, with other words).
+        count = self.word_count
+        if not isinstance(count, Length):
+            return None
+        if count._p_changed or (
+                count._p_oid is None and
+                getattr(self, '_p_oid', None) is not None):
+            return None
+        return count()
+
+    def _globToWordIds(self, pattern):
         # Implement * and ? just as in the shell, except the pattern
-        # must not start with either of these
+        # must not start with either of these unless there is a trigram
+        # index
+        if self._trigrams is not None and self.isGlob(pattern):
+            return self._trigramGlobToWordIds(pattern)
         prefix = ""
         while pattern and pattern[0] not in "*?":
             prefix += pattern[0]
@@ -118,16 +263,7 @@ class Lexicon(Persistent):
             # This is too efficient, so we raise an exception.
             raise QueryError(
                 "pattern %r shouldn't start with glob character" % pattern)
-        pat = prefix
-        for c in pattern:
-            if c == "*":
-                pat += ".*"
-            elif c == "?":
-                pat += "."
-            else:
-                pat += re.escape(c)
-        pat += "$"
-        prog = re.compile(pat)
+        prog = _globToRegex(prefix + pattern)
         keys = self._wids.keys(prefix) # Keys starting at prefix
         wids = []
         for key in keys:
@@ -137,14 +273,52 @@ class Lexicon(Persistent):
                 wids.append(self._wids[key])
         return wids
 
+    def _trigramGlobToWordIds(self, pattern):
+        # Intersect the sets of words containing the trigrams of the
+        # literal parts of the pattern, then check the candidates
+        trigrams = set()
+        fragments = re.split(r"[*?]+", pattern)
+        fragments[0] = _BOUNDARY + fragments[0]
+        fragments[-1] += _BOUNDARY
+        for fragment in fragments:
+            trigrams.update(_word_trigrams(fragment, pad=False))
+        prog = _globToRegex(pattern)
+        if not trigrams:
+            # e.g. "*a*":  no trigram to narrow the search with
+            return [wid for word, wid in self._wids.items()
+                    if prog.match(word)]
+        sets = []
+        for trigram in trigrams:
+            wids = self._trigrams.get(trigram)
+            if wids is None:
+                return []
+            sets.append(wids)
+        sets.sort(key=len)
+        candidates = sets[0]
+        for wids in sets[1:]:
+            candidates = intersection(candidates, wids)
+            if not candidates:
+                return []
+        words = self._words
+        return [wid for wid in candidates if prog.match(words[wid])]
+
     def _getWordIdCreate(self, word):
         wid = self._wids.get(word)
         if wid is None:
             wid = self._new_wid()
             self._wids[word] = wid
             self._words[wid] = word
+            if self._trigrams is not None:
+                self._add_trigrams(word, wid)
         return wid
 
+    def _add_trigrams(self, word, wid):
+        for trigram in _word_trigrams(word):
+            wids = self._trigrams.get(trigram)
+            if wids is None:
+                self._trigrams[trigram] = wids = IITreeSet()
+            wids.add(wid)
+
     def _new_wid(self):
         count = self.word_count
         count.change(1)
@@ -153,6 +327,45 @@ class Lexicon(Persistent):
             count.change(1)
         return count()
 
+class Words(list):
+    """ Words produced by a lexicon pipeline. """
+
+class Pipeline(object):
+    """ See ``Lexicon.processor``. """
+
+    def __init__(self, elements):
+        self.elements = elements
+
+    def __call__(self, text):
+        if text is None:
+            text = ''
+        last = _text2list(text)
+        for element in self.elements:
+            last = element.process(last)
+        return Words(last)
+
+_BOUNDARY = "\0"
+
+def _word_trigrams(word, pad=True):
+    # The trigrams of ``word``, padded with _BOUNDARY at both ends
+    if pad:
+        word = _BOUNDARY + word + _BOUNDARY
+    return set([word[i:i + 3] for i in range(len(word) - 2)])
+
+def _globToRegex(pattern):
+    # Compile a regular expression matching the words matched by a glob
+    # pattern
+    pat = ""
+    for c in pattern:
+        if c == "*":
+            pat += ".*"
+        elif c == "?":
+            pat += "."
+        else:
+            pat += re.escape(c)
+    pat += "$"
+    return re.compile(pat)
+
 def _text2list(text):
     # Helper: splitter input may be a string or a list of strings
     try:
@@ -168,7 +381,7 @@ def _text2list(text):
 class Splitter(object):
 
     rx = re.compile(r"(?u)\w+")
-    rxGlob = re.compile(r"(?u)\w+[\w*?]*") # See globToWordIds() above
+    rxGlob = re.compile(r"(?u)[*?]*\w+[\w*?]*") # See globToWordIds() above
 
     def process(self, lst):
         result = []
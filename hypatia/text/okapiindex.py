@@ -211,6 +211,11 @@ class OkapiIndex(BaseIndex):
     assert K1 >= 0.0
     assert 0.0 <= B <= 1.0
 
+    # How much more a document matching a NEAR query scores when its words
+    # are next to each other than when they are far apart.
+    PROXIMITY = 1.0
+    assert PROXIMITY >= 0.0
+
     def __init__(self, lexicon, family=None):
         BaseIndex.__init__(self, lexicon, family=family)
 
@@ -229,13 +234,23 @@ class OkapiIndex(BaseIndex):
         self._totaldoclen = Length(0)
 
     def index_doc(self, docid, text):
+        if docid in self._docwords:
+            return self.reindex_doc(docid, text)
         count = BaseIndex.index_doc(self, docid, text)
         self._change_doc_len(count)
         return count
 
+    def _index_new_docs(self, docs):
+        count = BaseIndex._index_new_docs(self, docs)
+        self._change_doc_len(count)
+        return count
+
     def reindex_doc(self, docid, text):
-        self._change_doc_len(-self._docweight[docid])
-        return BaseIndex.reindex_doc(self, docid, text)
+        old_count = self._docweight[docid]
+        count = BaseIndex.reindex_doc(self, docid, text)
+        if count != old_count:
+            self._change_doc_len(count - old_count)
+        return count
 
     def unindex_doc(self, docid):
         if docid not in self._docwords:
@@ -257,88 +272,78 @@ class OkapiIndex(BaseIndex):
     # TF(D,t) * IDF(t) for every docid D containing t.
     # As currently written, the weights are always 1, and the IFBucket maps
     # D to TF(D,t)*IDF(t) directly, where the product is computed as a float.
-    # NOTE:  This may be overridden below, by a function that computes the
-    # same thing but with the inner scoring loop in C.
-    if score is None: #pragma NO COVERAGE
-        def _search_wids(self, wids):
-            if not wids:
-                return []
-            N = float(self.indexed_count())  # total # of docs
-            try:
-                doclen = self._totaldoclen()
-            except TypeError:
-                # _totaldoclen has not yet been upgraded
-                doclen = self._totaldoclen
-            meandoclen = doclen / N
-            K1 = self.K1
-            B = self.B
-            K1_plus1 = K1 + 1.0
-            B_from1 = 1.0 - B
-
-            #                           f(D, t) * (k1 + 1)
-            #   TF(D, t) =  -------------------------------------------
-            #               f(D, t) + k1 * ((1-b) + b*len(D)/E(len(D)))
-
-            L = []
-            docid2len = self._docweight
-            for t in wids:
-                d2f = self._wordinfo[t] # map {docid -> f(docid, t)}
-                idf = inverse_doc_frequency(len(d2f), N)  # an unscaled float
-                result = self.family.IF.Bucket()
-                for docid, f in d2f.items():
-                    lenweight = B_from1 + B * docid2len[docid] / meandoclen
-                    tf = f * K1_plus1 / (f + K1 * lenweight)
-                    result[docid] = tf * idf
-                L.append((result, 1))
-            return L
-
-            # Note about the above: the result is tf * idf.  tf is
-            # small -- it can't be larger than k1+1 = 2.2.  idf is
-            # formally unbounded, but is less than 14 for a term that
-            # appears in only 1 of a million documents.  So the
-            # product is probably less than 32, or 5 bits before the
-            # radix point.  If we did the scaled-int business on both
-            # of them, we'd be up to 25 bits.  Add 64 of those and
-            # we'd be in overflow territory.  That's pretty unlikely,
-            # so we *could* just store scaled_int(tf) in
-            # result[docid], and use scaled_int(idf) as an invariant
-            # weight across the whole result.  But besides skating
-            # near the edge, it's not a speed cure, since the
-            # computation of tf would still be done at Python speed,
-            # and it's a lot more work than just multiplying by idf.
-    else:
-        # The same function as _search_wids above, but with the inner scoring
-        # loop written in C (module okascore, function score()).
-        # Cautions:  okascore hardcodes the values of K, B1, and the scaled_int
-        # function.
-        def _search_wids(self, wids):
-            if not wids:
-                return []
-            N = float(self.indexed_count())  # total # of docs
-            try:
-                doclen = self._totaldoclen()
-            except TypeError:
-                # _totaldoclen has not yet been upgraded
-                doclen = self._totaldoclen
-            meandoclen = doclen / N
-            #K1 = self.K1
-            #B = self.B
-            #K1_plus1 = K1 + 1.0
-            #B_from1 = 1.0 - B
-
-            #                           f(D, t) * (k1 + 1)
-            #   TF(D, t) =  -------------------------------------------
-            #               f(D, t) + k1 * ((1-b) + b*len(D)/E(len(D)))
-
-            L = []
-            docid2len = self._docweight
-            for t in wids:
-                d2f = self._wordinfo[t] # map {docid -> f(docid, t)}
-                idf = inverse_doc_frequency(len(d2f), N)  # an unscaled float
-                result = self.family.IF.Bucket()
-                score(result, list(d2f.items()), docid2len, idf, meandoclen)
-                L.append((result, 1))
-            return L
+    def _search_wids(self, wids, docids=None):
+        if not wids:
+            return []
+        N = float(self.indexed_count())  # total # of docs
+        try:
+            doclen = self._totaldoclen()
+        except TypeError:
+            # _totaldoclen has not yet been upgraded
+            doclen = self._totaldoclen
+        meandoclen = doclen / N
+        L = []
+        for t in wids:
+            d2f = self._wordinfo[t] # map {docid -> f(docid, t)}
+            idf = inverse_doc_frequency(len(d2f), N)  # an unscaled float
+            if docids is not None:
+                d2f = self._restrict(d2f, docids)
+            L.append((self._score(d2f, idf, meandoclen), 1))
+        return L
+
+    def _upper_bounds(self, wids):
+        # TF(D, t) is bounded above by 1+K1 (see query_weight).
+        N = float(self.indexed_count())
+        tfmax = 1.0 + self.K1
+        return [inverse_doc_frequency(len(self._wordinfo[t]), N) * tfmax
+                for t in wids]
+
+    def _score(self, d2f, idf, meandoclen):
+        # Return an IFBucket mapping each docid in d2f to TF(D,t) * IDF(t).
+        # The inner loop in C (module okascore, function score()) is used
+        # unless the BM25 parameters of this index differ from the values
+        # it hardcodes.
+        result = self.family.IF.Bucket()
+        if score is not None and self.K1 == 1.2 and self.B == 0.75:
+            score(result, list(d2f.items()), self._docweight, idf, meandoclen)
+            return result
+        K1 = self.K1
+        B = self.B
+        K1_plus1 = K1 + 1.0
+        B_from1 = 1.0 - B
+
+        #                           f(D, t) * (k1 + 1)
+        #   TF(D, t) =  -------------------------------------------
+        #               f(D, t) + k1 * ((1-b) + b*len(D)/E(len(D)))
+
+        docid2len = self._docweight
+        for docid, f in d2f.items():
+            lenweight = B_from1 + B * docid2len[docid] / meandoclen
+            tf = f * K1_plus1 / (f + K1 * lenweight)
+            result[docid] = tf * idf
+        return result
+
+        # Note about the above: the result is tf * idf.  tf is
+        # small -- it can't be larger than k1+1 = 2.2.  idf is
+        # formally unbounded, but is less than 14 for a term that
+        # appears in only 1 of a million documents.  So the
+        # product is probably less than 32, or 5 bits before the
+        # radix point.  If we did the scaled-int business on both
+        # of them, we'd be up to 25 bits.  Add 64 of those and
+        # we'd be in overflow territory.  That's pretty unlikely,
+        # so we *could* just store scaled_int(tf) in
+        # result[docid], and use scaled_int(idf) as an invariant
+        # weight across the whole result.  But besides skating
+        # near the edge, it's not a speed cure, since the
+        # computation of tf would still be done at Python speed,
+        # and it's a lot more work than just multiplying by idf.
+
+    def _near_weight(self, weight, gap):
+        # The weight is scaled by a factor from 1, when no other word is
+        # between the words, down to 1 / (1 + PROXIMITY) for large gaps,
+        # which keeps query_weight an upper bound of scores.
+        PROXIMITY = self.PROXIMITY
+        return weight * (1.0 + PROXIMITY / (1.0 + gap)) / (1.0 + PROXIMITY)
 
     def query_weight(self, terms):
         # Get the wids.
@@ -122,6 +122,24 @@ class PhraseNode(AtomNode):
     def executeQuery(self, index):
         return index.search_phrase(self.getValue())
 
+class NearNode(AtomNode):
+
+    _nodeType = "NEAR"
+
+    def __init__(self, value, distance):
+        AtomNode.__init__(self, value)
+        self._distance = distance
+
+    def getDistance(self):
+        return self._distance
+
+    def __repr__(self):
+        return "%s(%r, %r)" % (self.__class__.__name__, self.getValue(),
+                               self.getDistance())
+
+    def executeQuery(self, index):
+        return index.search_near(self.getValue(), self.getDistance())
+
 class GlobNode(AtomNode):
 
     _nodeType = "GLOB"
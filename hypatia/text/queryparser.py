@@ -19,9 +19,10 @@ Start = OrExpr
 OrExpr = AndExpr ('OR' AndExpr)*
 AndExpr = Term ('AND' NotExpr | 'NOT' AndExpr)*
 NotExpr = ['NOT'] Term
-Term = '(' OrExpr ')' | ATOM+
+Term = '(' OrExpr ')' | NearExpr+
+NearExpr = ATOM ('NEAR/n' ATOM)*
 
-The key words (AND, OR, NOT) are recognized in any mixture of case.
+The key words (AND, OR, NOT, NEAR/n) are recognized in any mixture of case.
 
 An ATOM is either:
 
@@ -33,7 +34,11 @@ An ATOM is either:
   string can contain whitespace, parentheses and key words, but not
   quotes.
 
-+ A hyphen followed by one of the two forms above, meaning that it
++ A string enclosed in double quotes followed by a tilde and a number,
+  e.g. ``"foo bar"~3'', meaning that its words must be found in any
+  order with at most that many other words between them.
+
++ A hyphen followed by one of the forms above, meaning that it
   must not be present.
 
 An unquoted ATOM may also contain globbing characters.  Globbing
@@ -50,6 +55,11 @@ Summarizing the default operator rules:
 - double-quoted text implies phrase search, e.g. ``"foo bar"''
 - words connected by punctuation implies phrase search, e.g. ``foo-bar''
 - a leading hyphen implies NOT, e.g. ``foo -bar''
+- NEAR/n requires words to be found in any order with at most n other
+  words between them, e.g. ``foo NEAR/3 bar''; a chain of NEAR/n must
+  use the same n, e.g. ``foo NEAR/3 bar NEAR/3 baz'' is like
+  ``"foo bar baz"~3''; NEAR/n is an ordinary word unless it is between
+  two words, e.g. in ``NEAR/3 foo''
 - these can be combined, e.g. ``foo -"foo bar"'' or ``foo -foo-bar''
 - * and ? are used for globbing (i.e. prefix search), e.g. ``foo*''
 """
@@ -68,6 +78,7 @@ _OR     = sys.intern("OR")
 _NOT    = sys.intern("NOT")
 _LPAREN = sys.intern("(")
 _RPAREN = sys.intern(")")
+_NEAR   = sys.intern("NEAR")
 _ATOM   = sys.intern("ATOM")
 _EOF    = sys.intern("EOF")
 
@@ -80,6 +91,21 @@ _keywords = {
     _RPAREN:    _RPAREN,
 }
 
+# NEAR/n, and a quoted string followed by ~n.
+_near_regex = re.compile(r"NEAR/(\d+)$", re.IGNORECASE)
+_proximity_regex = re.compile(r'(-?".*")~(\d+)$')
+
+def _tokentypes(tokens):
+    # NEAR/n is only a key word between two other words; elsewhere it is a
+    # word, as it was before NEAR/n was recognized.
+    tokentypes = [_keywords.get(token.upper(), _ATOM) for token in tokens]
+    words = [tokentype is _ATOM and not _near_regex.match(token)
+             for token, tokentype in zip(tokens, tokentypes)]
+    for i in range(1, len(tokens) - 1):
+        if words[i - 1] and words[i + 1] and _near_regex.match(tokens[i]):
+            tokentypes[i] = _NEAR
+    return tokentypes
+
 # Regular expression to tokenize.
 _tokenizer_regex = re.compile(r"""
     # a paren
@@ -89,7 +115,7 @@ _tokenizer_regex = re.compile(r"""
     # followed by
     (?:
         # a string inside double quotes (and not containing these)
-        " [^"]* "
+        " [^"]* " (?:~\d+)?
         # or a non-empty stretch w/o whitespace, parens or double quotes
     |    [^()\s"]+
     )
@@ -112,8 +138,7 @@ class QueryParser(object):
         tokens = _tokenizer_regex.findall(query)
         self._tokens = tokens
         # classify tokens
-        self._tokentypes = [_keywords.get(token.upper(), _ATOM)
-                            for token in tokens]
+        self._tokentypes = _tokentypes(tokens)
         # add _EOF
         self._tokens.append(_EOF)
         self._tokentypes.append(_EOF)
@@ -217,9 +242,9 @@ class QueryParser(object):
             self._require(_RPAREN)
         else:
             nodes = []
-            nodes = [self._parseAtom()]
+            nodes = [self._parseNearExpr()]
             while self._peek(_ATOM):
-                nodes.append(self._parseAtom())
+                nodes.append(self._parseNearExpr())
             nodes = [x for x in  nodes if x]
             if not nodes:
                 return None # Only stopwords
@@ -235,13 +260,45 @@ class QueryParser(object):
             tree = parsetree.AndNode(nodes)
         return tree
 
+    def _parseNearExpr(self):
+        nodes = [self._parseAtom()]
+        distances = []
+        while self._peek(_NEAR):
+            token = self._get(_NEAR)
+            distances.append(int(_near_regex.match(token).group(1)))
+            nodes.append(self._parseAtom())
+        if not distances:
+            return nodes[0]
+        if len(set(distances)) > 1:
+            # the distance applies to all the words of the chain
+            raise parsetree.ParseError(
+                "a chain of NEAR/n must use the same distance")
+        nodes = [x for x in nodes if x]
+        if not nodes:
+            return None # Only stopwords
+        for node in nodes:
+            if node.nodeType() != "ATOM":
+                raise parsetree.ParseError(
+                    "NEAR can only be used between words")
+        if len(nodes) == 1:
+            return nodes[0]
+        return parsetree.NearNode([node.getValue() for node in nodes],
+                                  distances[0])
+
     def _parseAtom(self):
         term = self._get(_ATOM)
+        distance = None
+        match = _proximity_regex.match(term)
+        if match is not None:
+            term = match.group(1)
+            distance = int(match.group(2))
         words = self._lexicon.parseTerms(term)
         if not words:
             self._ignored.append(term)
             return None
-        if len(words) > 1:
+        if len(words) > 1 and distance is not None:
+            tree = parsetree.NearNode(words, distance)
+        elif len(words) > 1:
             tree = parsetree.PhraseNode(words)
         elif self._lexicon.isGlob(words[0]):
             tree = parsetree.GlobNode(words[0])
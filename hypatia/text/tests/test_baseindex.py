@@ -136,6 +136,49 @@ class BaseIndexTestBase:
         self.assertTrue(index._lexicon._wids['two'] in wids)
         self.assertTrue(index._lexicon._wids['three'] in wids)
 
+    def test_index_docs(self):
+        def _faux_get_frequencies(wids):
+            return dict([(y, x) for x, y in enumerate(wids)]), len(wids)
+        texts = ['one two', 'two three', 'one', 'four five six']
+        docs = [(docid, texts[docid % 4] + ' common')
+                for docid in range(20, 2, -1)]
+        docs.append((1, 'seven'))
+        index = self._makeOne()
+        index._get_frequencies = _faux_get_frequencies
+        index.index_doc(1, 'one two')
+        other = self._makeOne()
+        other._get_frequencies = _faux_get_frequencies
+        other.index_doc(1, 'one two')
+        for docid, text in docs:
+            other.index_doc(docid, text)
+        index.index_docs(docs)
+        def _words(index):
+            return dict(
+                (index._lexicon.get_word(wid),
+                 (type(doc2score), dict(doc2score)))
+                for wid, doc2score in index._wordinfo.items())
+        self.assertEqual(_words(index), _words(other))
+        self.assertEqual(list(index._docweight.items()),
+                         list(other._docweight.items()))
+        self.assertEqual(
+            [(docid, index.document_repr(docid)) for docid in index._docwords],
+            [(docid, other.document_repr(docid)) for docid in other._docwords])
+        self.assertEqual(index.word_count(), other.word_count())
+        self.assertEqual(index.indexed_count(), 19)
+        self.assertTrue(isinstance(
+            index._wordinfo[index._lexicon._wids['common']],
+            index.family.IF.BTree))
+
+    def test_index_docs_upgrades_word_count_indexed_count(self):
+        index = self._makeOne()
+        index._get_frequencies = lambda wids: (dict.fromkeys(wids, 1), 1)
+        # Simulate old instances which didn't have these as attributes
+        del index.word_count
+        del index.indexed_count
+        index.index_docs([(1, 'one two'), (2, 'three')])
+        self.assertEqual(index.word_count(), 3)
+        self.assertEqual(index.indexed_count(), 2)
+
     def test_index_doc_existing_docid(self):
         index = self._makeOne()
 
@@ -206,6 +249,25 @@ class BaseIndexTestBase:
         self.assertTrue(index._lexicon._wids['two'] in wids)
         self.assertTrue(index._lexicon._wids['three'] in wids)
 
+    def test_reindex_doc_unchanged_does_nothing(self):
+        index = self._makeOne()
+        index._get_frequencies = lambda wids: (dict.fromkeys(wids, 1), 1)
+        index.index_doc(1, 'one two three')
+        def _dont_go_here(*args, **kw): # pragma: no cover
+            assert 0
+        index._get_frequencies = _dont_go_here
+        index._docweight = DummyMapping(index._docweight)
+        index._docwords = DummyMapping(index._docwords)
+        count = index.reindex_doc(1, 'one  two three')
+        self.assertEqual(count, 3)
+
+    def test_reindex_doc_reordered(self):
+        index = self._makeOne()
+        index._get_frequencies = lambda wids: (dict.fromkeys(wids, 1), 1)
+        index.index_doc(1, 'one two three')
+        index.reindex_doc(1, 'three two one')
+        self.assertEqual(index.document_repr(1), 'three two one')
+
     def test_reindex_doc_disjoint(self):
         index = self._makeOne()
         def _faux_get_frequencies(wids):
@@ -382,6 +444,26 @@ class BaseIndexTestBase:
         index.index_doc(1, 'hitter')
         self.assertEqual(dict(index.search_glob('hit*')), {1: 1.0})
 
+    def test_search_glob_w_max_glob_words(self):
+        index = self._makeOne()
+        index.max_glob_words = 2
+        def _faux_get_frequencies(wids):
+            return dict([(wid, 1) for wid in wids]), 1
+        index._get_frequencies = _faux_get_frequencies
+        searched = []
+        def _faux_search_wids(wids):
+            searched.append(sorted(wids))
+            return []
+        index._search_wids = _faux_search_wids
+        index.index_doc(1, 'hits hitter hit')
+        index.index_doc(2, 'hitter hit')
+        index.index_doc(3, 'hit hitch')
+        wids = index._lexicon._wids
+        index.search_glob('hit*')
+        index.search_glob('hitc*')
+        self.assertEqual(searched, [sorted([wids['hit'], wids['hitter']]),
+                                    [wids['hitch']]])
+
     def test_search_phrase_w_empty_term(self):
         index = self._makeOne()
         def _faux_search_wids(wids):
@@ -411,10 +493,154 @@ class BaseIndexTestBase:
         index.index_doc(1, 'hit the nail on the head')
         self.assertEqual(dict(index.search_phrase('hit the nail')), {1: 1.0})
 
+    def _makePhraseIndex(self):
+        index = self._makeOne()
+        def _faux_get_frequencies(wids):
+            return dict([(y, x) for x, y in enumerate(wids)]), 1
+        index._get_frequencies = _faux_get_frequencies
+        def _faux_search_wids(wids):
+            L = []
+            for wid in wids:
+                result = index.family.IF.Bucket()
+                for docid in index._wordinfo[wid]:
+                    result[docid] = 1.0
+                L.append((result, 1))
+            return L
+        index._search_wids = _faux_search_wids
+        return index
+
+    def _positions(self, index):
+        from ..baseindex import decode_positions
+        return dict(
+            (index._lexicon.get_word(wid),
+             dict((docid, decode_positions(code))
+                  for docid, code in doc2positions.items()))
+            for wid, doc2positions in index._positions.items())
+
+    def test_enable_positions_migrates_indexed_docs(self):
+        index = self._makePhraseIndex()
+        index.index_doc(1, 'hit the nail on the head')
+        index.index_doc(2, 'the head')
+        self.assertEqual(index._positions, None)
+        index.enable_positions()
+        self.assertEqual(self._positions(index),
+                         {'hit': {1: [0]},
+                          'the': {1: [1, 4], 2: [0]},
+                          'nail': {1: [2]},
+                          'on': {1: [3]},
+                          'head': {1: [5], 2: [1]}})
+        index.enable_positions()
+        self.assertEqual(len(self._positions(index)), 5)
+
+    def test_positions_follow_changes(self):
+        index = self._makePhraseIndex()
+        index.DICT_CUTOFF = 2
+        index.enable_positions()
+        index.index_doc(1, 'hit the nail on the head')
+        index.index_docs([(2, 'the head'), (3, 'the nail'), (4, 'a nail')])
+        index.reindex_doc(1, 'the nail hit the head')
+        index.unindex_doc(4)
+        other = self._makePhraseIndex()
+        other.enable_positions()
+        for docid, text in [(1, 'the nail hit the head'), (2, 'the head'),
+                            (3, 'the nail')]:
+            other.index_doc(docid, text)
+        self.assertEqual(self._positions(index), self._positions(other))
+        the = index._lexicon._wids['the']
+        self.assertTrue(isinstance(index._positions[the],
+                                   index.family.IO.BTree))
+        index.reset()
+        self.assertEqual(len(index._positions), 0)
+        index.disable_positions()
+        index.reset()
+        self.assertEqual(index._positions, None)
+
+    def test_encode_positions(self):
+        from ..baseindex import decode_positions
+        from ..baseindex import encode_positions
+        for positions, typecode in (([], b'B'),
+                                    ([0, 3, 255], b'B'),
+                                    ([1, 300, 301], b'H'),
+                                    ([2, 70000, 70001], b'I')):
+            code = encode_positions(positions)
+            self.assertEqual(code[:1], typecode)
+            self.assertEqual(decode_positions(code), positions)
+
+    def test_search_phrase_w_positions(self):
+        index = self._makePhraseIndex()
+        index.index_doc(1, 'hit the nail on the head')
+        index.index_doc(2, 'the nail hit the head')
+        index.index_doc(3, 'nail the hit')
+        index.enable_positions()
+        # phrases are matched without the words of the documents
+        index._docwords = DummyMapping({1: None, 2: None, 3: None})
+        self.assertEqual(dict(index.search_phrase('hit the nail')), {1: 3.0})
+        self.assertEqual(dict(index.search_phrase('the head')),
+                         {1: 2.0, 2: 2.0})
+        self.assertEqual(dict(index.search_phrase('the hit')), {3: 2.0})
+        self.assertEqual(dict(index.search_phrase('nail the head')), {})
+
+    def _assertSearchNear(self, index):
+        self.assertEqual(dict(index.search_near(['hit', 'head'], 4)),
+                         {1: 2.0, 2: 2.0})
+        self.assertEqual(dict(index.search_near(['hit', 'head'], 1)),
+                         {2: 2.0})
+        self.assertEqual(dict(index.search_near(['hit', 'head'], 0)), {})
+        self.assertEqual(dict(index.search_near(['head', 'nail', 'hit'], 1)),
+                         {2: 3.0})
+        self.assertEqual(dict(index.search_near(['the', 'nail'], 0)),
+                         {1: 2.0, 2: 2.0, 3: 2.0})
+        # a repeated word must be found as many times
+        self.assertEqual(dict(index.search_near(['the', 'the'], 2)),
+                         {1: 2.0, 2: 2.0})
+        self.assertEqual(dict(index.search_near(['the', 'the'], 1)), {})
+        self.assertEqual(dict(index.search_near(['hit', 'hit'], 5)), {})
+        self.assertEqual(dict(index.search_near(['hit', 'nonesuch'], 3)), {})
+        self.assertEqual(index.search_near([], 3), None)
+
+    def test_search_near(self):
+        index = self._makePhraseIndex()
+        index.index_doc(1, 'hit the nail on the head')
+        index.index_doc(2, 'the nail hit the head')
+        index.index_doc(3, 'nail the hit')
+        self._assertSearchNear(index)
+
+    def test_search_near_w_positions(self):
+        index = self._makePhraseIndex()
+        index.index_doc(1, 'hit the nail on the head')
+        index.index_doc(2, 'the nail hit the head')
+        index.index_doc(3, 'nail the hit')
+        index.enable_positions()
+        index._docwords = DummyMapping({1: None, 2: None, 3: None})
+        self._assertSearchNear(index)
+
+    def test__min_span(self):
+        from ..baseindex import _min_span
+        self.assertEqual(_min_span([[3]]), 0)
+        self.assertEqual(_min_span([[0, 10], [5, 20]]), 5)
+        self.assertEqual(_min_span([[0, 10, 30], [4, 28], [8, 13]]), 6)
+        self.assertEqual(_min_span([[0, 100], [50, 99], [2, 101]]), 2)
+        self.assertEqual(_min_span([[3, 7, 20], [3, 7, 20], [5]]), 4)
+        self.assertEqual(_min_span([[3, 7], [3, 7], [3, 7]]), None)
+        self.assertEqual(_min_span([[3], [3], [5]]), None)
+
     def test__search_wids_raises_NotImplementedError(self):
         index = self._makeOne()
         self.assertRaises(NotImplementedError, index._search_wids, ())
 
+    def test__upper_bounds_raises_NotImplementedError(self):
+        index = self._makeOne()
+        self.assertRaises(NotImplementedError, index._upper_bounds, ())
+
+    def test__restrict(self):
+        index = self._makeOne()
+        docids = index.family.IF.Set([1, 3])
+        for d2w in ({1: 2, 2: 4, 3: 6}, index.family.IF.Bucket({1: 2, 2: 4})):
+            result = index._restrict(d2w, docids)
+            self.assertEqual(dict(result.items()),
+                             dict((docid, d2w[docid]) for docid in d2w
+                                  if docid in docids))
+
     def test_query_weight_raises_NotImplementedError(self):
         index = self._makeOne()
         self.assertRaises(NotImplementedError, index.query_weight, ())
@@ -479,6 +705,15 @@ class BaseIndexTestBase:
         index._del_wordinfo(123, 1)
         self.assertEqual(index.word_count(), 0)
 
+class DummyMapping(object):
+    # a read-only mapping
+
+    def __init__(self, mapping):
+        self._mapping = mapping
+
+    def __getitem__(self, key):
+        return self._mapping[key]
+
 class BaseIndexTest32(BaseIndexTestBase, unittest.TestCase):
 
     def _getBTreesFamily(self):
@@ -85,6 +85,37 @@ class CosineIndexTestBase:
             self.assertTrue(isinstance(relevance[0][1], float))
             self.assertTrue(isinstance(relevance[1], float))
 
+    def _indexTopDocs(self, index):
+        # 'rare' is in 3 docs, 'mid' in 10 and 'common' in all 40;  the
+        # filler gives each doc a different length.
+        for i in range(40):
+            words = ['common'] * (i % 3 + 1) + ['filler'] * i
+            if i < 3:
+                words.append('rare')
+            if i % 4 == 0:
+                words.append('mid')
+            index.index_doc(i, ' '.join(words))
+
+    def _assertTop(self, index, terms, count):
+        import heapq
+        from ..setops import mass_weightedUnion
+        wids = []
+        for term in terms:
+            wids.extend(index._lexicon.termToWordIds(term))
+        full = mass_weightedUnion(index._search_wids(wids), index.family)
+        expected = heapq.nlargest(count, full.items(), key=lambda x: x[1])
+        top = index.search_top(terms, count)
+        self.assertEqual(sorted(top.keys()),
+                         sorted(docid for docid, score in expected))
+        for docid, score in expected:
+            self.assertAlmostEqual(top[docid], score, places=5)
+
+    def test_search_top(self):
+        index = self._makeOne()
+        self._indexTopDocs(index)
+        for count in (1, 2, 5, 40, 100):
+            self._assertTop(index, ['rare', 'mid', 'common'], count)
+
     def test_query_weight_empty_wids(self):
         index = self._makeOne()
         index.index_doc(1, 'one two three')
@@ -71,6 +71,25 @@ class LexiconTests(unittest.TestCase):
         self.assertEqual(lexicon.get_word(1), 'cats')
         self.assertEqual(lexicon.get_wid('cats'), 1)
 
+    def test_processor(self):
+        import pickle
+        from ..lexicon import CaseNormalizer
+        from ..lexicon import Words
+        lexicon = self._makeOne(CaseNormalizer())
+        processor = pickle.loads(pickle.dumps(lexicon.processor()))
+        words = processor('Cats and Dogs')
+        self.assertTrue(isinstance(words, Words))
+        self.assertEqual(words, ['cats', 'and', 'dogs'])
+        self.assertEqual(processor(None), [])
+        self.assertEqual(len(lexicon.words()), 0)
+
+    def test_sourceToWordIds_words(self):
+        from ..lexicon import Words
+        lexicon = self._makeOne()
+        wids = lexicon.sourceToWordIds(Words(['cats and', 'dogs']))
+        self.assertEqual(wids, [1, 2])
+        self.assertEqual(lexicon.get_word(1), 'cats and')
+
     def test_sourceToWordIds_promotes_word_count_attr(self):
         from BTrees.Length import Length
         lexicon = self._makeOne()
@@ -129,6 +148,86 @@ class LexiconTests(unittest.TestCase):
         wids = lexicon.termToWordIds('hsif')
         self.assertEqual(wids, [2])
 
+    def test_termToWordIds_cached(self):
+        counter = CountingPipelineElement()
+        lexicon = self._makeOne(counter)
+        lexicon.sourceToWordIds('cats and dogs')
+        self.assertEqual(counter.count, 1)
+        self.assertEqual(lexicon.termToWordIds('cats birds'), [1, 0])
+        self.assertEqual(lexicon.termToWordIds('cats birds'), [1, 0])
+        self.assertEqual(counter.count, 2)
+        # new words refresh the wids, not the words
+        lexicon.sourceToWordIds('birds')
+        self.assertEqual(lexicon.termToWordIds('cats birds'), [1, 4])
+        self.assertEqual(counter.count, 3)
+        # parsing them processes the text for globs, once
+        self.assertEqual(lexicon.parseTerms('cats birds'), ['cats', 'birds'])
+        self.assertEqual(lexicon.parseTerms('cats birds'), ['cats', 'birds'])
+        self.assertEqual(counter.count, 4)
+        lexicon.clear_term_cache()
+        self.assertEqual(lexicon.termToWordIds('cats birds'), [1, 4])
+        self.assertEqual(counter.count, 5)
+
+    def test_termToWordIds_cached_w_processGlob(self):
+        lexicon = self._makeOne(StemmingPipelineElement())
+        lexicon.sourceToWordIds('cats and dogs')
+        self.assertEqual(lexicon.termToWordIds('cats'), [1])
+        self.assertEqual(lexicon.parseTerms('cats'), ['cats'])
+        self.assertEqual(lexicon.parseTerms('dogs'), ['dogs'])
+        self.assertEqual(lexicon.termToWordIds('dogs'), [3])
+
+    def test_termToWordIds_cached_w_glob(self):
+        lexicon = self._makeOne()
+        lexicon.sourceToWordIds('cats and dogs')
+        self.assertEqual(lexicon.parseTerms('ca* dogs'), ['ca*', 'dogs'])
+        self.assertEqual(lexicon.termToWordIds('ca* dogs'), [0, 3])
+        self.assertEqual(lexicon.parseTerms('ca* dogs'), ['ca*', 'dogs'])
+        self.assertEqual(list(lexicon._v_term_cache), ['ca* dogs'])
+        self.assertEqual(lexicon._v_term_cache['ca* dogs'][:2],
+                         [('ca', 'dogs'), ('ca*', 'dogs')])
+
+    def test_termToWordIds_cache_w_abort(self):
+        import transaction
+        from ZODB import DB
+        from ZODB.MappingStorage import MappingStorage
+        db = DB(MappingStorage())
+        try:
+            conn = db.open()
+            conn.root()['lexicon'] = lexicon = self._makeOne()
+            lexicon.sourceToWordIds('cats and dogs')
+            transaction.commit()
+            lexicon.sourceToWordIds('ants')
+            self.assertEqual(lexicon.termToWordIds('ants'), [4])
+            transaction.abort()
+            # the word count is back to 3, and goes to 4 again
+            lexicon.sourceToWordIds('bees')
+            self.assertEqual(lexicon.termToWordIds('ants'), [0])
+            transaction.commit()
+            self.assertEqual(lexicon.termToWordIds('ants'), [0])
+            self.assertEqual(lexicon._v_term_cache['ants'][2:], [4, (0,)])
+            transaction.abort()
+        finally:
+            db.close()
+
+    def test_termToWordIds_cache_bounded(self):
+        counter = CountingPipelineElement()
+        lexicon = self._makeOne(counter)
+        lexicon.term_cache_size = 2
+        lexicon.termToWordIds('cats')
+        lexicon.termToWordIds('dogs')
+        lexicon.termToWordIds('cats')
+        lexicon.termToWordIds('birds')
+        self.assertEqual(list(lexicon._v_term_cache), ['cats', 'birds'])
+        self.assertEqual(counter.count, 3)
+
+    def test_termToWordIds_list_not_cached(self):
+        counter = CountingPipelineElement()
+        lexicon = self._makeOne(counter)
+        lexicon.sourceToWordIds('cats and dogs')
+        self.assertEqual(lexicon.termToWordIds(['cats', 'dogs']), [1, 3])
+        self.assertEqual(lexicon.termToWordIds(['cats', 'dogs']), [1, 3])
+        self.assertEqual(counter.count, 3)
+
     def test_parseTerms_tuple(self):
         TERMS = ('a', 'b*c', 'de?f')
         lexicon = self._makeOne()
@@ -185,6 +284,136 @@ class LexiconTests(unittest.TestCase):
         lexicon.sourceToWordIds('cats and dogs are enemies')
         self.assertEqual(lexicon.globToWordIds('are'), [4])
 
+    def test_globToWordIds_w_trigrams(self):
+        lexicon = self._makeOne()
+        lexicon.sourceToWordIds('cats and dogs are enemies')
+        lexicon.enable_trigrams()
+        lexicon.sourceToWordIds('scare car')
+        # cats=1, and=2, dogs=3, are=4, enemies=5, scare=6, car=7
+        self.assertEqual(lexicon.globToWordIds('*s'), [1, 3, 5])
+        self.assertEqual(sorted(lexicon.globToWordIds('*ar*')), [4, 6, 7])
+        self.assertEqual(lexicon.globToWordIds('?ar'), [7])
+        self.assertEqual(sorted(lexicon.globToWordIds('?a*')), [1, 7])
+        self.assertEqual(lexicon.globToWordIds('a*'), [2, 4])
+        self.assertEqual(lexicon.globToWordIds('*e*e*'), [5])
+        self.assertEqual(lexicon.globToWordIds('*x*'), [])
+        self.assertEqual(lexicon.globToWordIds('are'), [4])
+
+    def test_globToWordIds_w_trigrams_intersected(self):
+        lexicon = self._makeOne()
+        lexicon.enable_trigrams()
+        lexicon.sourceToWordIds('cats and dogs are enemies')
+        self.assertEqual(lexicon.globToWordIds('*nemi*'), [5])
+        self.assertEqual(lexicon.globToWordIds('*do?s'), [3])
+        # no word has all the trigrams
+        self.assertEqual(lexicon.globToWordIds('*cat*dog*'), [])
+        # no word has this trigram
+        self.assertEqual(lexicon.globToWordIds('*xyz*'), [])
+
+    def test_globToWordIds_w_trigrams_no_trigram_in_pattern(self):
+        lexicon = self._makeOne()
+        lexicon.enable_trigrams()
+        lexicon.sourceToWordIds('cats and dogs')
+        self.assertEqual(sorted(lexicon.globToWordIds('*a*')), [1, 2])
+        self.assertEqual(lexicon.globToWordIds('???'), [2])
+
+    def test_enable_trigrams_matches_incremental_index(self):
+        lexicon = self._makeOne()
+        lexicon.sourceToWordIds('cats and dogs are enemies')
+        lexicon.enable_trigrams()
+        other = self._makeOne()
+        other.enable_trigrams()
+        other.sourceToWordIds('cats and dogs are enemies')
+        self.assertEqual(
+            [(trigram, list(wids))
+             for trigram, wids in lexicon._trigrams.items()],
+            [(trigram, list(wids))
+             for trigram, wids in other._trigrams.items()])
+        self.assertEqual(list(lexicon._trigrams['\0ca']), [1])
+        lexicon.enable_trigrams()
+        self.assertEqual(list(lexicon._trigrams['\0ca']), [1])
+        lexicon.disable_trigrams()
+        self.assertEqual(lexicon._trigrams, None)
+
+    def test_parseTerms_leading_glob(self):
+        lexicon = self._makeOne()
+        self.assertEqual(lexicon.parseTerms('*foo* ?ar *'), ['foo*', 'ar'])
+        lexicon.enable_trigrams()
+        self.assertEqual(lexicon.parseTerms('*foo* ?ar *'), ['*foo*', '?ar'])
+
+    def test_globToWordIds_cached(self):
+        lexicon = self._makeOne()
+        lexicon.sourceToWordIds('cats and dogs are enemies')
+        calls = []
+        def _globToWordIds(pattern, orig=lexicon._globToWordIds):
+            calls.append(pattern)
+            return orig(pattern)
+        lexicon._globToWordIds = _globToWordIds
+        self.assertEqual(lexicon.globToWordIds('a*'), [2, 4])
+        self.assertEqual(lexicon.globToWordIds('a*'), [2, 4])
+        self.assertEqual(lexicon.globToWordIds('are'), [4])
+        self.assertEqual(lexicon.globToWordIds('are'), [4])
+        self.assertEqual(calls, ['a*', 'are', 'are'])
+        lexicon.sourceToWordIds('cats')
+        self.assertEqual(lexicon.globToWordIds('a*'), [2, 4])
+        self.assertEqual(calls, ['a*', 'are', 'are'])
+        # new words invalidate the cache
+        lexicon.sourceToWordIds('ants')
+        self.assertEqual(lexicon.globToWordIds('a*'), [2, 6, 4])
+        self.assertEqual(calls, ['a*', 'are', 'are', 'a*'])
+
+    def test_globToWordIds_cache_bounded(self):
+        lexicon = self._makeOne()
+        lexicon.glob_cache_size = 2
+        lexicon.sourceToWordIds('cats and dogs are enemies')
+        lexicon.globToWordIds('a*')
+        lexicon.globToWordIds('c*')
+        lexicon.globToWordIds('a*')
+        lexicon.globToWordIds('d*')
+        self.assertEqual(list(lexicon._v_glob_cache[1]), ['a*', 'd*'])
+        lexicon.clear_glob_cache()
+        self.assertEqual(lexicon._v_glob_cache, None)
+
+    def test_globToWordIds_not_cached_wo_Length(self):
+        lexicon = self._makeOne()
+        lexicon.sourceToWordIds('cats and dogs are enemies')
+        # Simulate old instances whose word_count isn't a Length
+        del lexicon.word_count
+        self.assertEqual(lexicon.globToWordIds('a*'), [2, 4])
+        self.assertEqual(getattr(lexicon, '_v_glob_cache', None), None)
+
+    def test_globToWordIds_cache_w_abort(self):
+        import transaction
+        from ZODB import DB
+        from ZODB.MappingStorage import MappingStorage
+        db = DB(MappingStorage())
+        try:
+            conn = db.open()
+            conn.root()['lexicon'] = lexicon = self._makeOne()
+            lexicon.sourceToWordIds('cats and dogs')
+            transaction.commit()
+            lexicon.sourceToWordIds('ants')
+            self.assertEqual(lexicon.globToWordIds('a*'), [2, 4])
+            transaction.abort()
+            # the word count is back to 3, and goes to 4 again
+            lexicon.sourceToWordIds('bees')
+            self.assertEqual(lexicon.globToWordIds('a*'), [2])
+            transaction.commit()
+            lexicon.globToWordIds('a*')
+            self.assertEqual(list(lexicon._v_glob_cache[1]), ['a*'])
+            transaction.abort()
+        finally:
+            db.close()
+
+    def test_globToWordIds_cache_cleared_by_trigrams(self):
+        from ..parsetree import QueryError
+        lexicon = self._makeOne()
+        lexicon.sourceToWordIds('cats and dogs')
+        lexicon.enable_trigrams()
+        self.assertEqual(lexicon.globToWordIds('*s'), [1, 3])
+        lexicon.disable_trigrams()
+        self.assertRaises(QueryError, lexicon.globToWordIds, '*s')
+
     def test_getWordIdCreate_new(self):
         lexicon = self._makeOne()
         wid = lexicon._getWordIdCreate('nonesuch')
@@ -272,6 +501,11 @@ class SplitterTests(unittest.TestCase):
         splitter = self._makeOne()
         self.assertEqual(splitter.processGlob(['abc def']), ['abc', 'def'])
 
+    def test_processGlob_w_leading_glob(self):
+        splitter = self._makeOne()
+        self.assertEqual(splitter.processGlob(['*abc ?de* * f']),
+                         ['*abc', '?de*', 'f'])
+
     def test_processGlob_w_glob(self):
         splitter = self._makeOne()
         self.assertEqual(splitter.processGlob(['abc?def hij*klm nop* qrs?']),
@@ -404,3 +638,18 @@ class StopWordPipelineElement(object):
                 res.append(term)
         return res
 
+
+class StemmingPipelineElement(object):
+    # leaves the words of glob patterns alone, glob or not
+    def process(self, seq):
+        return [term.rstrip('s') for term in seq]
+
+    def processGlob(self, seq):
+        return seq
+
+class CountingPipelineElement(object):
+    count = 0
+
+    def process(self, seq):
+        self.count += 1
+        return seq
@@ -85,6 +85,27 @@ class OkapiIndexTestBase:
         index.index_doc(1, 'two three four')
         self.assertEqual(index._totaldoclen(), 3)
 
+    def test_index_docs_updates_totaldoclen(self):
+        index = self._makeOne()
+        index.index_doc(1, 'one two three')
+        index.index_docs([(1, 'two three four five'), (2, 'two'), (3, 'a b')])
+        self.assertEqual(index._totaldoclen(), 7)
+
+    def test_reindex_doc_unchanged_keeps_totaldoclen(self):
+        index = self._makeOne()
+        index.index_doc(1, 'one two three')
+        index._change_doc_len = lambda delta: self.fail('changed')
+        self.assertEqual(index.index_doc(1, 'one two three'), 3)
+        self.assertEqual(index.reindex_doc(1, 'three two one'), 3)
+        self.assertEqual(index._totaldoclen(), 3)
+
+    def test_reindex_doc_updates_totaldoclen(self):
+        index = self._makeOne()
+        index.index_doc(1, 'one two three')
+        index.index_doc(2, 'four')
+        self.assertEqual(index.reindex_doc(1, 'one'), 1)
+        self.assertEqual(index._totaldoclen(), 2)
+
     def test_index_doc_upgrades_totaldoclen(self):
         index = self._makeOne()
 
@@ -144,6 +165,110 @@ class OkapiIndexTestBase:
 
         self.assertTrue(isinstance(index._totaldoclen, int))
 
+    def _search_all(self, index):
+        wids = list(index._wordinfo.keys())
+        return [dict(bucket.items()) for bucket, weight
+                in index._search_wids(wids)]
+
+    def _makeScoredIndex(self):
+        index = self._makeOne()
+        for i in range(23):
+            index.index_doc(i, ' '.join(['one two'] * (i % 5 + 1) + ['three']))
+        return index
+
+    def _assertScoresEqual(self, got, expected):
+        self.assertEqual(len(got), len(expected))
+        for g, e in zip(got, expected):
+            self.assertEqual(sorted(g), sorted(e))
+            for docid in g:
+                self.assertAlmostEqual(g[docid], e[docid], places=5)
+
+    def test__search_wids_pure_python_matches_okascore(self):
+        from .. import okapiindex
+        index = self._makeScoredIndex()
+        expected = self._search_all(index)
+        with mock.patch.object(okapiindex, 'score', None):
+            got = self._search_all(index)
+        self._assertScoresEqual(got, expected)
+
+    def test__search_wids_honors_K1_and_B(self):
+        import math
+        index = self._makeScoredIndex()
+        index.K1 = 2.0
+        index.B = 0.5
+        relevances = index._search_wids([index._lexicon._wids['three']])
+        bucket = relevances[0][0]
+        N = 23.0
+        meandoclen = index._totaldoclen() / N
+        idf = math.log(1.0 + N / N)
+        for docid in range(23):
+            lenweight = 0.5 + 0.5 * index._docweight[docid] / meandoclen
+            expected = 3.0 / (1.0 + 2.0 * lenweight) * idf
+            self.assertAlmostEqual(bucket[docid], expected, places=5)
+
+    def _indexTopDocs(self, index):
+        # 'rare' is in 3 docs, 'mid' in 10 and 'common' in all 40;  the
+        # filler gives each doc a different length.
+        for i in range(40):
+            words = ['common'] * (i % 3 + 1) + ['filler'] * i
+            if i < 3:
+                words.append('rare')
+            if i % 4 == 0:
+                words.append('mid')
+            index.index_doc(i, ' '.join(words))
+
+    def _assertTop(self, index, terms, count):
+        import heapq
+        from ..setops import mass_weightedUnion
+        wids = []
+        for term in terms:
+            wids.extend(index._lexicon.termToWordIds(term))
+        full = mass_weightedUnion(index._search_wids(wids), index.family)
+        expected = heapq.nlargest(count, full.items(), key=lambda x: x[1])
+        top = index.search_top(terms, count)
+        self.assertEqual(sorted(top.keys()),
+                         sorted(docid for docid, score in expected))
+        for docid, score in expected:
+            self.assertAlmostEqual(top[docid], score, places=5)
+
+    def test_search_top(self):
+        index = self._makeOne()
+        self._indexTopDocs(index)
+        for count in (1, 2, 5, 40, 100):
+            self._assertTop(index, ['rare', 'mid', 'common'], count)
+
+    def test_search_top_prunes_common_words(self):
+        index = self._makeOne()
+        self._indexTopDocs(index)
+        with mock.patch.object(index, '_search_wids',
+                               wraps=index._search_wids) as search_wids:
+            self._assertTop(index, ['common', 'mid', 'rare'], 2)
+        common = index._lexicon._wids['common']
+        (wids, docids), kw = search_wids.call_args_list[-1]
+        self.assertEqual(wids, [common])
+        self.assertTrue(docids is not None)
+        self.assertTrue(len(docids) < 40)
+
+    def test_search_top_no_wids(self):
+        index = self._makeOne()
+        self._indexTopDocs(index)
+        self.assertEqual(len(index.search_top(['nonesuch'], 2)), 0)
+        self.assertEqual(len(index.search_top(['rare'], 0)), 0)
+
+    def test_search_near_scores_closer_words_higher(self):
+        index = self._makeOne()
+        index.index_doc(1, 'one two three four five')
+        index.index_doc(2, 'one three four five six two')
+        index.index_doc(3, 'two three four five one')
+        scores = index.search_near(['one', 'two'], 3)
+        self.assertEqual(sorted(scores.keys()), [1, 3])
+        phrase = index.search_phrase('one two')
+        self.assertAlmostEqual(scores[1], phrase[1], places=5)
+        self.assertTrue(scores[1] > scores[3])
+        index.PROXIMITY = 0.0
+        scores = index.search_near(['one', 'two'], 3)
+        self.assertAlmostEqual(scores[1], scores[3], places=5)
+
     def test_query_weight_empty_wids(self):
         index = self._makeOne()
         index.index_doc(1, 'one two three')
@@ -201,6 +201,40 @@ class PhraseNodeTests(unittest.TestCase, ConformsToIQueryParseTree):
         self.assertEqual(node.executeQuery(index), [])
         self.assertEqual(_called_with[0], (('XXX YYY',), {}))
 
+class NearNodeTests(unittest.TestCase, ConformsToIQueryParseTree):
+
+    def _getTargetClass(self):
+        from ..parsetree import NearNode
+        return NearNode
+
+    def _makeOne(self, value=None, distance=2):
+        if value is None:
+            value = ['XXX', 'YYY']
+        return self._getTargetClass()(value, distance)
+
+    def test_nodeType(self):
+        node = self._makeOne()
+        self.assertEqual(node.nodeType(), 'NEAR')
+
+    def test_getDistance(self):
+        node = self._makeOne()
+        self.assertEqual(node.getDistance(), 2)
+
+    def test___repr__(self):
+        node = self._makeOne()
+        self.assertEqual(repr(node), "NearNode(['XXX', 'YYY'], 2)")
+
+    def test_executeQuery(self):
+        _called_with = []
+        def _search(*args, **kw):
+            _called_with.append((args, kw))
+            return []
+        index = FauxIndex()
+        index.search_near = _search
+        node = self._makeOne()
+        self.assertEqual(node.executeQuery(index), [])
+        self.assertEqual(_called_with[0], ((['XXX', 'YYY'], 2), {}))
+
 class GlobNodeTests(unittest.TestCase, ConformsToIQueryParseTree):
 
     def _getTargetClass(self):
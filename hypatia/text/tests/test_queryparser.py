@@ -54,6 +54,7 @@ class TestQueryParserBase(unittest.TestCase):
         from ..parsetree import AndNode
         from ..parsetree import AtomNode
         from ..parsetree import GlobNode
+        from ..parsetree import NearNode
         from ..parsetree import NotNode
         from ..parsetree import OrNode
         from ..parsetree import ParseTreeNode
@@ -62,7 +63,11 @@ class TestQueryParserBase(unittest.TestCase):
             msg = repr(got)
         self.assertEqual(isinstance(got, ParseTreeNode), 1)
         self.assertEqual(got.__class__, expected.__class__, msg)
-        if isinstance(got, PhraseNode):
+        if isinstance(got, NearNode):
+            self.assertEqual(got.nodeType(), "NEAR", msg)
+            self.assertEqual(got.getValue(), expected.getValue(), msg)
+            self.assertEqual(got.getDistance(), expected.getDistance(), msg)
+        elif isinstance(got, PhraseNode):
             self.assertEqual(got.nodeType(), "PHRASE", msg)
             self.assertEqual(got.getValue(), expected.getValue(), msg)
         elif isinstance(got, GlobNode):
@@ -254,6 +259,56 @@ class TestQueryParser(TestQueryParserBase):
         self._expect(parser, "foo* bar",
                      AndNode([GlobNode("foo*"), AtomNode("bar")]))
 
+    def test030(self):
+        from ..parsetree import NearNode
+        parser = self._makeOne()
+        self._expect(parser, "foo NEAR/3 bar", NearNode(["foo", "bar"], 3))
+
+    def test031(self):
+        from ..parsetree import NearNode
+        parser = self._makeOne()
+        self._expect(parser, "foo near/3 bar NEAR/3 baz",
+                     NearNode(["foo", "bar", "baz"], 3))
+
+    def test032(self):
+        from ..parsetree import NearNode
+        parser = self._makeOne()
+        self._expect(parser, '"foo bar"~2', NearNode(["foo", "bar"], 2))
+
+    def test033(self):
+        from ..parsetree import AndNode
+        from ..parsetree import AtomNode
+        from ..parsetree import NearNode
+        from ..parsetree import NotNode
+        parser = self._makeOne()
+        self._expect(parser, 'foo NEAR/0 bar baz -"qux quux"~1',
+                     AndNode([NearNode(["foo", "bar"], 0),
+                              AtomNode("baz"),
+                              NotNode(NearNode(["qux", "quux"], 1))]))
+
+    def test034(self):
+        from ..parsetree import AndNode
+        from ..parsetree import AtomNode
+        parser = self._makeOne()
+        # a bare "near" is a word
+        self._expect(parser, "foo near bar",
+                     AndNode([AtomNode("foo"), AtomNode("near"),
+                              AtomNode("bar")]))
+
+    def test035(self):
+        from ..parsetree import AndNode
+        from ..parsetree import AtomNode
+        from ..parsetree import PhraseNode
+        parser = self._makeOne()
+        # NEAR/n which isn't between two words is a word
+        self._expect(parser, "NEAR/3 foo",
+                     AndNode([PhraseNode(["NEAR", "3"]), AtomNode("foo")]))
+        self._expect(parser, "foo NEAR/3",
+                     AndNode([AtomNode("foo"), PhraseNode(["NEAR", "3"])]))
+        self._expect(parser, "foo NEAR/2 NEAR/3 bar",
+                     AndNode([AtomNode("foo"), PhraseNode(["NEAR", "2"]),
+                              PhraseNode(["NEAR", "3"]), AtomNode("bar")]))
+
     def test101(self):
         parser = self._makeOne()
         self._failure(parser, "")
@@ -342,6 +397,21 @@ class TestQueryParser(TestQueryParserBase):
         parser = self._makeOne()
         self._failure(parser, "foo AND -bar")
 
+    def test123(self):
+        parser = self._makeOne()
+        self._failure(parser, 'foo NEAR/3 "bar baz"')
+
+    def test125(self):
+        parser = self._makeOne()
+        self._failure(parser, 'foo NEAR/3 bar*')
+
+    def test126(self):
+        # one distance can't constrain some words of the chain and not
+        # others
+        parser = self._makeOne()
+        self._failure(parser, 'foo NEAR/1 bar NEAR/10 baz')
+        self._failure(parser, 'foo NEAR/2 bar near/3 baz NEAR/2 qux')
+
 
 class StopWordTestQueryParser(TestQueryParserBase):
 
@@ -386,6 +456,17 @@ class StopWordTestQueryParser(TestQueryParserBase):
         self._expect(parser, 'foo AND bar NOT stop',
                      AndNode([AtomNode("foo"), AtomNode("bar")]), ["stop"])
 
+    def test208(self):
+        from ..parsetree import AtomNode
+        parser = self._makeOne()
+        self._expect(parser, 'foo NEAR/2 stop', AtomNode("foo"), ["stop"])
+
+    def test209(self):
+        from ..parsetree import AtomNode
+        parser = self._makeOne()
+        self._expect(parser, 'foo stop NEAR/2 stop', AtomNode("foo"),
+                     ["stop", "stop"])
+
     def test301(self):
         parser = self._makeOne()
         self._failure(parser, 'stop')
@@ -201,6 +201,60 @@ class TextIndexTests(unittest.TestCase):
         index.unindex_doc = lambda *args, **kw: 1/0
         index.reindex_doc(5, 'now is the time')
 
+    def test_index_docs(self):
+        index = self._makeOne()
+        index.index_doc(1, 'cats and dogs')
+        index.index_docs(
+            [(1, 'cats'), (2, 'dogs and cats'), (3, _marker), (4, 'birds')])
+        self.assertEqual(list(index.applyContains('cats')), [1, 2])
+        self.assertEqual(list(index.applyContains('dogs')), [2])
+        self.assertEqual(list(index.not_indexed()), [3])
+        self.assertEqual(list(index.docids()), [1, 2, 3, 4])
+        self.assertEqual(index.indexed_count(), 3)
+
+    def test_extractor(self):
+        from ..lexicon import Words
+        index = self._makeOne()
+        extracted = index.extractor()('Cats and Dogs')
+        self.assertTrue(isinstance(extracted.value, Words))
+        self.assertEqual(extracted.value, ['cats', 'dogs'])
+        index.index_doc(1, extracted)
+        self.assertEqual(list(index.applyContains('cats')), [1])
+        self.assertEqual(index.extractor()(_marker).found, False)
+
+    def test_extractor_lexicon_without_processor(self):
+        lexicon = DummyLexicon()
+        index = self._makeOne(lexicon=lexicon, index=DummyOkapi(lexicon))
+        self.assertEqual(index.extractor()('cats').value, 'cats')
+
+    def test_index_docs_index_without_index_docs(self):
+        lexicon = object()
+        okapi = DummyOkapi(lexicon)
+        index = self._makeOne(lexicon=lexicon, index=okapi)
+        index.index_docs([(1, 'cats and dogs'), (2, _marker)])
+        self.assertEqual(okapi._indexed, [(1, 'cats and dogs')])
+        self.assertEqual(list(index.not_indexed()), [2])
+
+    def test_generation(self):
+        index = self._makeOne()
+        generation = index.generation()
+        index.index_doc(1, 'cats and dogs')
+        self.assertTrue(index.generation() > generation)
+        generation = index.generation()
+        index.reindex_doc(1, 'Cats and dogs')
+        self.assertEqual(index.generation(), generation)
+        index.reindex_doc(1, 'dogs and cats')
+        self.assertTrue(index.generation() > generation)
+        generation = index.generation()
+        index.index_doc(1, _marker)
+        self.assertTrue(index.generation() > generation)
+        generation = index.generation()
+        index.unindex_doc(1)
+        self.assertTrue(index.generation() > generation)
+        generation = index.generation()
+        index.reset()
+        self.assertTrue(index.generation() > generation)
+
     def test_reset(self):
         lexicon = object()
         okapi = DummyOkapi(lexicon)
@@ -208,6 +262,12 @@ class TextIndexTests(unittest.TestCase):
         index.reset()
         self.assertTrue(okapi._cleared)
 
+    def test_indexed(self):
+        index = self._makeOne()
+        index.index_doc(1, 'now is the time')
+        index.index_doc(2, _marker)
+        self.assertEqual(list(index.indexed()), [1])
+
     def test_indexed_count(self):
         lexicon = object()
         okapi = DummyOkapi(lexicon)
@@ -228,6 +288,14 @@ class TextIndexTests(unittest.TestCase):
         self.assertEqual(okapi._query_weighted, [])
         self.assertEqual(okapi._searched, ['anything'])
 
+    def test_apply_w_count_no_results(self):
+        lexicon = DummyLexicon()
+        okapi = DummyOkapi(lexicon)
+        okapi._search_results = None
+        index = self._makeOne(lexicon=lexicon, index=okapi)
+        self.assertEqual(index.apply('anything', count=2), None)
+        self.assertEqual(okapi._query_weighted, [])
+
     def test_apply_w_results(self):
         lexicon = DummyLexicon()
         okapi = DummyOkapi(lexicon)
@@ -266,6 +334,54 @@ class TextIndexTests(unittest.TestCase):
         self.assertEqual(okapi._query_weighted[0], ['anything'])
         self.assertEqual(okapi._searched, ['anything'])
 
+    def _indexRankedDocs(self, index):
+        index.index_doc(1, 'apple banana')
+        index.index_doc(2, 'apple apple banana cherry')
+        index.index_doc(3, 'banana cherry cherry cherry')
+        index.index_doc(4, 'apple banana banana date')
+
+    def _best(self, results, count, start=0):
+        ranked = sorted(results.items(), key=lambda item: -item[1])
+        return [docid for docid, score in ranked[start:start + count]]
+
+    def test_apply_w_count_or_query(self):
+        from unittest import mock
+        index = self._makeOne()
+        self._indexRankedDocs(index)
+        expected = index.apply('apple OR cherry')
+        with mock.patch.object(index.index, 'search_top',
+                               wraps=index.index.search_top) as search_top:
+            results = index.apply('apple OR cherry', count=2)
+        search_top.assert_called_once_with(['apple', 'cherry'], 2)
+        self.assertEqual(self._best(results, 2), self._best(expected, 2))
+        for docid, score in results.items():
+            self.assertAlmostEqual(score, expected[docid], places=5)
+
+    def test_apply_w_start_and_count(self):
+        index = self._makeOne()
+        self._indexRankedDocs(index)
+        expected = index.apply('apple banana')
+        results = index.apply('apple banana', start=1, count=1)
+        self.assertEqual(list(results.keys()), self._best(expected, 1, 1))
+        self.assertEqual(len(index.apply('apple banana', start=1, count=5)),
+                         2)
+
+    def test_apply_near(self):
+        index = self._makeOne()
+        index.index_doc(1, 'the cat sat on the mat')
+        index.index_doc(2, 'mat floor wall door window cat')
+        self.assertEqual(list(index.apply('cat NEAR/3 mat').keys()), [1])
+        self.assertEqual(list(index.apply('cat NEAR/0 cat').keys()), [])
+        self.assertEqual(list(index.apply('"mat cat"~4').keys()), [1, 2])
+
+    def test_apply_infix_glob_w_trigrams(self):
+        index = self._makeOne()
+        index.lexicon.enable_trigrams()
+        index.index_doc(1, 'part ab-1234-x')
+        index.index_doc(2, 'part cd-5123-y')
+        index.index_doc(3, 'part ef-9999-z')
+        self.assertEqual(sorted(index.apply('*123*').keys()), [1, 2])
+
     def test_applyNotContains(self):
         index = self._makeOne()
         index.index_doc(1, 'now is the time')
@@ -348,6 +464,28 @@ class TextIndexTests(unittest.TestCase):
         index.index_doc(2, _marker)
         self.assertEqual(set([1, 2]), set(index.docids()))
 
+    def test_docids_count(self):
+        index = self._makeOne()
+        index.index_doc(1, 'Am I rich yet?')
+        index.index_doc(2, _marker)
+        index.index_doc(2, 'Not yet')
+        self.assertEqual(index.docids_count(), 2)
+        index.unindex_doc(1)
+        self.assertEqual(index.docids_count(), 1)
+        self.assertEqual(list(index.docids()), [2])
+
+    def test_intersectNotContains(self):
+        index = self._makeOne()
+        index.index_doc(1, 'now is the time')
+        index.index_doc(2, 'in the now')
+        index.index_doc(3, 'nice hair')
+        index.index_doc(4, _marker)
+        # building the complement of the positive result would fail
+        index._negate = None
+        docids = index.family.IF.Set([1, 3, 4, 5])
+        self.assertEqual(
+            list(index.intersectNotContains(docids, 'now')), [3, 4])
+
     def test_contains(self):
         from .. import query
         index = self._makeOne()
@@ -381,6 +519,15 @@ class TextIndexTests(unittest.TestCase):
         self.assertTrue(index.check_query('abc'))
         self.assertFalse(index.check_query(','))
 
+    def test_validateContains(self):
+        from ..parsetree import ParseError
+        index = self._makeOne()
+        self.assertEqual(index.validateContains('abc'), None)
+        self.assertRaises(ParseError, index.validateContains, ',')
+        self.assertRaises(ParseError, index.validateNotContains, ',')
+        self.assertRaises(ParseError, index.validateEq, ',')
+        self.assertRaises(ParseError, index.validateNotEq, ',')
+
 class DummyOkapi:
 
     _cleared = False
@@ -1,13 +1,20 @@
+import heapq
 import itertools
 import BTrees
 
+from BTrees.Length import Length
 from persistent import Persistent
 from ZODB.broken import Broken
 from zope.interface import implementer
 
 _marker = object()
 
+# what ``sort_keys`` methods return for docids which aren't in their index
+# (see ``IResultSet.sort_by``)
+_MISSING_KEY = object()
+
 from .. import exc
+from .. import interfaces
 from ..interfaces import (
     IResultSet,
     STABLE,
@@ -15,65 +22,208 @@ from ..interfaces import (
 
 @implementer(IResultSet)
 class ResultSet(object):
-    """Implements :class:`hypatia.interfaces.IResultSet`"""
+    """Implements :class:`hypatia.interfaces.IResultSet`
+
+    Result sets are lazy: the query of a result set returned by
+    ``execute()`` is applied, and a sort is performed, only once the ids
+    or their number are needed.  Slicing a result set (``rs[20:40]``)
+    returns a result set of the docids in the slice; when the result set
+    is a sort which hasn't been performed yet, the sort is limited to the
+    end of the slice.
+
+    ``batch_resolver``, if not ``None``, is a callable which accepts a
+    sequence of document ids and which returns a sequence of the documents
+    they identify, in the same order.  It is used in preference to
+    ``resolver`` by ``all()`` (and iteration), which resolve the document ids
+    in chunks of ``batch_size``: the documents of a chunk are loaded
+    together when the first of them is needed.
+
+    ``docid_mapper``, if not ``None``, is the
+    :class:`hypatia.catalog.DocidMapper` of the catalog whose indexes
+    produced the ids:  ``ids`` are then internal ids, which are translated
+    into document ids before being resolved or returned by ``first()``,
+    ``one()`` and ``all()``.
+    """
 
     family = BTrees.family64
-
-    def __init__(self, ids, numids, resolver, sort_type=None):
-        self.ids = ids # only guaranteed to be iterable, not sliceable
-        self.numids = numids
+    batch_size = 100
+
+    def __init__(self, ids, numids, resolver, sort_type=None, query=None,
+                 names=None, batch_resolver=None, batch_size=None,
+                 docid_mapper=None):
+        # If ``ids`` is None, ``query`` is applied (with ``names``) the first
+        # time the ids or their number are needed; until then, a sort with
+        # a limit may be pushed down to the query's execution.
+        self._ids = _stream(ids) # only guaranteed to be iterable
+        self._numids = numids
         self.resolver = resolver
         self.sort_type = sort_type
-        
+        self.query = query
+        self.names = names
+        self.batch_resolver = batch_resolver
+        if batch_size is not None:
+            self.batch_size = batch_size
+        self.docid_mapper = docid_mapper
+        # (resultset, index, reverse, limit, sort_type, raise_unsortable) of
+        # a sort which hasn't been performed yet
+        self._sort = None
+
+    def _get_ids(self):
+        if self._ids is None:
+            if self._sort is None:
+                self._apply_query()
+            else:
+                limit = self._sort[3]
+                ids, numids = self._sorted(limit)
+                self._ids = _stream(ids)
+                if self._numids is None:
+                    self._numids = numids
+        return self._ids
+
+    def _set_ids(self, ids):
+        self._ids = _stream(ids)
+
+    ids = property(_get_ids, _set_ids)
+
+    def _get_numids(self):
+        if self._numids is None:
+            if self._sort is None:
+                self._apply_query()
+            else:
+                resultset, limit = self._sort[0], self._sort[3]
+                numids = resultset.numids
+                if limit:
+                    numids = min(numids, limit)
+                self._numids = numids
+        return self._numids
+
+    def _set_numids(self, numids):
+        self._numids = numids
+
+    numids = property(_get_numids, _set_numids)
+
+    def _apply_query(self):
+        ids = self.query._apply(self.names)
+        self._ids = ids
+        self._numids = len(ids)
+
     def __len__(self):
         return self.numids
 
     def sort(self, index, reverse=False, limit=None, sort_type=None,
              raise_unsortable=True):
+        resultset = self._derive(None, None, sort_type=STABLE)
+        resultset._sort = (
+            self, index, reverse, limit, sort_type, raise_unsortable)
+        return resultset
+
+    def sort_by(self, keys, limit=None, raise_unsortable=True):
+        resultset = self._derive(None, None, sort_type=STABLE)
+        resultset._sort = (
+            self, _MultiKeySort(keys), False, limit, None, raise_unsortable)
+        return resultset
+
+    def _sorted(self, limit):
+        # Perform the pending sort, up to ``limit`` docids.  Return the
+        # sorted docids and their number if it's known without applying the
+        # query, else None.
+        resultset, index, reverse, _, sort_type, raise_unsortable = self._sort
         if sort_type is None:
-            sort_type = self.sort_type
-        
-        ids = self.ids
+            sort_type = resultset.sort_type
+
+        if (resultset._ids is None and resultset._sort is None and limit
+                and sort_type in (None, interfaces.OPTIMAL)):
+            # the query hasn't been applied yet: an index which can walk
+            # its values in order may find the first ``limit`` matches
+            # without materializing all of them
+            sort_query = getattr(index, 'sort_query', None)
+            if sort_query is not None:
+                ids = sort_query(
+                    resultset.query, resultset.names, reverse=reverse,
+                    limit=limit, raise_unsortable=raise_unsortable)
+                if ids is not None:
+                    return ids, len(ids)
+
+        ids = resultset.ids
 
         if not hasattr(ids, '__len__'):
             # indexes have no obligation to be able to sort generators
             ids = list(ids)
-            self.ids = ids
+            resultset.ids = ids
 
         ids = index.sort(
-            self.ids,
+            ids,
             reverse=reverse,
             limit=limit,
             sort_type=sort_type,
             raise_unsortable=raise_unsortable,
             )
-
-        numids = self.numids
-
-        if limit:
-            numids = min(numids, limit)
-
-        return self.__class__(ids, numids, self.resolver, sort_type=STABLE)
+        return ids, None
+
+    def _ids_until(self, stop):
+        # Return an iterable of (at least) the first ``stop`` ids, sorting no
+        # more than needed when the sort hasn't been performed yet.
+        if self._ids is None and self._sort is not None:
+            limit = self._sort[3]
+            if limit:
+                stop = min(stop, limit)
+            ids, _ = self._sorted(stop)
+            return ids
+        return self.ids
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.start, item.stop, item.step
+            if ((start or 0) < 0 or stop is None or stop < 0 or
+                    step is not None):
+                ids = list(self.ids)[item]
+            elif stop <= (start or 0):
+                ids = []
+            else:
+                ids = list(
+                    itertools.islice(self._ids_until(stop), start, stop))
+            return self._derive(ids, len(ids), sort_type=STABLE)
+        if item < 0:
+            id_ = list(self.ids)[item]
+        else:
+            for id_ in itertools.islice(
+                    self._ids_until(item + 1), item, None):
+                break
+            else:
+                raise IndexError(item)
+        return self._resolve_one(id_)
+
+    def _derive(self, ids, numids, sort_type=None):
+        # a result set of other ids, resolved like this one
+        return self.__class__(
+            ids, numids, self.resolver, sort_type=sort_type,
+            batch_resolver=self.batch_resolver, batch_size=self.batch_size,
+            docid_mapper=self.docid_mapper)
+
+    def _external(self, ids):
+        # the document ids of internal ``ids``
+        if self.docid_mapper is None:
+            return ids
+        return map(self.docid_mapper.external, ids)
+
+    def _resolve_one(self, id_):
+        if self.docid_mapper is not None:
+            id_ = self.docid_mapper.external(id_)
+        if self.resolver is not None:
+            return self.resolver(id_)
+        if self.batch_resolver is not None:
+            for obj in self.batch_resolver([id_]):
+                return obj
+        return id_
 
     def first(self, resolve=True):
         # return the first object or None
-        resolver = self.resolver
-        if resolver is None or not resolve:
-            for id_ in self.ids:
-                # if self.ids is not a list or a tuple, allow this result set
-                # to be iterated after first() is called and allow first() to
-                # be idempotent
-                if not hasattr(self.ids, '__len__'):
-                    self.ids = itertools.chain([id_], self.ids)
-                return id_
-        else:
-            for id_ in self.ids:
-                # if self.ids is not a list or a tuple, allow this result set
-                # to be iterated after first() is called and allow first() to
-                # be idempotent
-                if not hasattr(self.ids, '__len__'):
-                    self.ids = itertools.chain([id_], self.ids)
-                return resolver(id_)
+        for id_ in self._ids_until(1):
+            if resolve:
+                return self._resolve_one(id_)
+            if self.docid_mapper is not None:
+                return self.docid_mapper.external(id_)
+            return id_
 
     def one(self, resolve=True):
         if self.numids == 1:
@@ -84,15 +234,26 @@ class ResultSet(object):
             raise exc.NoResults(self)
 
     def _resolve_all(self, resolver):
-        for id_ in self.ids:
+        for id_ in self._external(self.ids):
             yield resolver(id_)
 
+    def _resolve_batches(self, batch_resolver):
+        ids = iter(self._external(self.ids))
+        batch_size = self.batch_size
+        while True:
+            chunk = list(itertools.islice(ids, batch_size))
+            if not chunk:
+                return
+            yield from batch_resolver(chunk)
+
     def all(self, resolve=True):
-        resolver = self.resolver
-        if resolver is None or not resolve:
-            return self.ids
-        else:
-            return self._resolve_all(resolver)
+        if not resolve:
+            return self._external(self.ids)
+        if self.batch_resolver is not None:
+            return self._resolve_batches(self.batch_resolver)
+        if self.resolver is not None:
+            return self._resolve_all(self.resolver)
+        return self._external(self.ids)
 
     def __iter__(self):
         return iter(self.all())
@@ -104,39 +265,249 @@ class ResultSet(object):
         # self.ids may be a generator
         if isinstance(docids, ResultSet):
             docids = docids.ids
+        elif self.docid_mapper is not None:
+            docids = set(self.docid_mapper.to_internal(docids))
         filtered_ids = [ x for x in self.ids if x in docids ]
-        return self.__class__(filtered_ids, len(filtered_ids), self.resolver)
+        return self._derive(filtered_ids, len(filtered_ids))
+
+class Extracted(object):
+    """ The value extracted from a document by an index's ``extractor``;
+    ``found`` is false if the discriminator returned no value. """
+
+    __slots__ = ('found', 'value')
+
+    def __init__(self, found, value=None):
+        self.found = found
+        self.value = value
+
+class Extractor(object):
+    """ See ``BaseIndexMixin.extractor``.  ``process``, if not ``None``, is
+    applied to the values found. """
+
+    def __init__(self, discriminator, process=None):
+        self.discriminator = discriminator
+        self.process = process
+
+    def __call__(self, obj):
+        value = _discriminate(self.discriminator, obj, _marker)
+        if value is _marker:
+            return Extracted(False)
+        if self.process is not None:
+            value = self.process(value)
+        return Extracted(True, value)
+
+def _discriminate(discriminator, obj, default):
+    if callable(discriminator):
+        value = discriminator(obj, _marker)
+    else:
+        value = getattr(obj, discriminator, _marker)
+
+    if value is _marker:
+        return default
+
+    if isinstance(value, Persistent):
+        raise ValueError('Catalog cannot index persistent object %s' %
+                         value)
+
+    if isinstance(value, Broken):
+        raise ValueError('Catalog cannot index broken object %s' %
+                         value)
+
+    return value
+
+class _Stream(object):
+    """ Iterable over the items of an iterator, which can be iterated any
+    number of times: the items are consumed from the iterator as needed,
+    and kept. """
+
+    def __init__(self, iterator):
+        self._iterator = iterator
+        self._items = []
+
+    def __iter__(self):
+        items = self._items
+        i = 0
+        while True:
+            if i < len(items):
+                yield items[i]
+            else:
+                for item in self._iterator:
+                    items.append(item)
+                    break
+                else:
+                    return
+                yield item
+            i += 1
+
+class _MultiKeySort(object):
+    # Sorts docids by the values of several indexes, like an index sorts
+    # them by its own.
+
+    def __init__(self, keys):
+        self.keys = []
+        for key in keys:
+            if not isinstance(key, tuple):
+                key = (key, False)
+            self.keys.append(key)
+
+    def sort(self, docids, reverse=False, limit=None, sort_type=None,
+             raise_unsortable=True):
+        docids = list(docids)
+        columns = []
+        for index, index_reverse in self.keys:
+            sort_keys = getattr(index, 'sort_keys', None)
+            if sort_keys is None:
+                return self._chained_sort(docids, limit, raise_unsortable)
+            columns.append((sort_keys(docids), index_reverse))
+        return self._composite_sort(docids, columns, limit, raise_unsortable)
+
+    def _composite_sort(self, docids, columns, limit, raise_unsortable):
+        # Sort the positions of the docids by the values of each index in
+        # turn, from the last to the first (Python's sort is stable, even
+        # when reversed).  With a limit, only the positions whose value in
+        # the first index is among the ``limit`` best take part.
+        missing = set()
+        for values, reverse in columns:
+            missing.update(
+                [i for i, value in enumerate(values)
+                 if value is _MISSING_KEY])
+        order = [i for i in range(len(docids)) if i not in missing]
+        # indexes order None before other values
+        columns = [(_none_first(values, order), reverse)
+                   for values, reverse in columns]
+
+        if limit and limit < len(order):
+            first, reverse = columns[0]
+            if reverse:
+                bound = heapq.nlargest(limit, [first[i] for i in order])[-1]
+                order = [i for i in order if first[i] >= bound]
+            else:
+                bound = heapq.nsmallest(limit, [first[i] for i in order])[-1]
+                order = [i for i in order if first[i] <= bound]
+
+        for values, reverse in reversed(columns):
+            order.sort(key=values.__getitem__, reverse=reverse)
+
+        if limit:
+            order = order[:limit]
+        for i in order:
+            yield docids[i]
+
+        if limit and len(order) >= limit:
+            return
+        if raise_unsortable and missing:
+            raise exc.Unsortable([docids[i] for i in sorted(missing)])
+
+    def _chained_sort(self, docids, limit, raise_unsortable):
+        # Some index can't return its values: sort by each index in turn,
+        # from the last to the first, relying on the sorts being stable.
+        # Like ``_composite_sort``, the docids some index can't sort are
+        # left out, and reported once the others have been yielded.
+        keys = self.keys
+        sorted_docids = docids
+        for i in range(len(keys) - 1, -1, -1):
+            index, reverse = keys[i]
+            sorted_docids = list(index.sort(
+                sorted_docids,
+                reverse=reverse,
+                limit=limit if i == 0 else None,
+                sort_type=STABLE,
+                raise_unsortable=False,
+                ))
+        for docid in sorted_docids:
+            yield docid
+
+        if limit and len(sorted_docids) >= limit:
+            return
+        if raise_unsortable and len(sorted_docids) < len(docids):
+            found = set(sorted_docids)
+            raise exc.Unsortable(
+                [docid for docid in docids if docid not in found])
+
+def _none_first(values, order):
+    # Return the sort keys of ``values``, which are the values unless the
+    # positions in ``order`` include None.
+    for i in order:
+        if values[i] is None:
+            return [(value is not None, value) for value in values]
+    return values
+
+def _stream(ids):
+    # one-shot iterators (such as the generators returned by index sorts)
+    # are wrapped so that result sets can be iterated more than once
+    if hasattr(ids, '__next__'):
+        return _Stream(ids)
+    return ids
 
 class BaseIndexMixin(object):
     """ Mixin class for indexes that implements common behavior """
 
     family = BTrees.family64
 
-    def discriminate(self, obj, default):
-        """ See interface IIndexInjection """
-        if callable(self.discriminator):
-            value = self.discriminator(obj, _marker)
-        else:
-            value = getattr(obj, self.discriminator, _marker)
+    # Whether the results of the index's queries may be weighted (mappings
+    # of docids to relevance) rather than sets.
+    weighted = False
 
-        if value is _marker:
-            return default
-        
-        if isinstance(value, Persistent):
-            raise ValueError('Catalog cannot index persistent object %s' %
-                             value)
+    # The ``DocidMapper`` of the catalog holding the index, set by the
+    # catalog when it maps document ids (see ``enable_docid_mapping``).
+    docid_mapper = None
 
-        if isinstance(value, Broken):
-            raise ValueError('Catalog cannot index broken object %s' %
-                             value)
+    # The union of ``indexed()`` and ``not_indexed()``, maintained by
+    # ``_add_docid`` and ``_remove_docid`` as documents are (un)indexed;
+    # ``None`` until ``_reset_docids`` is called.
+    _all_docids = None
+    _all_docids_count = None
 
-        return value
+    # Counts the changes of the index (see ``generation``); ``None`` until
+    # the index first changes.
+    _generation = None
+
+    def discriminate(self, obj, default):
+        """ See interface IIndexInjection """
+        if isinstance(obj, Extracted):
+            # extracted ahead of indexing (see ``extractor``)
+            if obj.found:
+                return obj.value
+            return default
+        return _discriminate(self.discriminator, obj, default)
+
+    def extractor(self):
+        """ Return a callable which accepts a document object and returns
+        an :class:`Extracted` holding what ``discriminate`` would return for
+        it.  The callable doesn't use the index, so documents can be
+        discriminated concurrently (see ``Catalog.index_docs``); passing the
+        result to ``index_doc`` or ``index_docs`` in place of the document
+        indexes the extracted value.  The callable can be pickled if the
+        discriminator can. """
+        return Extractor(self.discriminator)
 
     def reindex_doc(self, docid, obj):
         """ See interface IIndexInjection """
         self.unindex_doc(docid)
         self.index_doc(docid, obj)
 
+    def index_docs(self, docs):
+        """ Index each ``(docid, obj)`` pair of the iterable ``docs``, as
+        ``index_doc`` would.  Indexes may override this to index documents
+        in bulk. """
+        for docid, obj in docs:
+            self.index_doc(docid, obj)
+
+    def _split_new_docs(self, docs):
+        # Split the ``(docid, obj)`` pairs of ``docs`` into a dict of the
+        # documents the index doesn't know about yet, which can be indexed
+        # in bulk (the last object of a docid wins), and a list of the
+        # others, which must be (re)indexed one by one.
+        all_docids = self._docid_set()
+        new = {}
+        known = []
+        for docid, obj in docs:
+            if docid in all_docids:
+                known.append((docid, obj))
+            else:
+                new[docid] = obj
+        return new, known
+
     def indexed_count(self):
         """ See IIndexedDocuments """
         return len(self.indexed())
@@ -147,6 +518,27 @@ class BaseIndexMixin(object):
 
     def docids(self):
         """ See IIndexedDocuments """
+        all_docids = self._all_docids
+        if all_docids is None:
+            return self._compute_docids()
+        return self.family.IF.Set(all_docids)
+
+    def docids_count(self):
+        """ See IIndexedDocuments """
+        if self._all_docids_count is None:
+            return len(self.docids())
+        return self._all_docids_count()
+
+    def _docid_set(self):
+        # Same as ``docids``, but returns the set of docids the index
+        # maintains, if any, rather than a copy:  callers must not mutate
+        # it.
+        all_docids = self._all_docids
+        if all_docids is None:
+            return self._compute_docids()
+        return all_docids
+
+    def _compute_docids(self):
         not_indexed = self.not_indexed()
         indexed = self.indexed()
         if len(not_indexed) == 0:
@@ -156,9 +548,72 @@ class BaseIndexMixin(object):
         indexed = self.family.IF.Set(indexed)
         return self.family.IF.union(not_indexed, indexed)
 
-    def docids_count(self):
-        """ See IIndexedDocuments """
-        return len(self.docids())
+    def _reset_docids(self):
+        # Called by ``reset`` of indexes which keep track of their docids.
+        self._all_docids = self.family.IF.TreeSet()
+        self._all_docids_count = Length(0)
+
+    def _add_docid(self, docid):
+        # Record that ``docid`` is now part of ``indexed()`` or
+        # ``not_indexed()``.  Must be called once the index reflects it.
+        if self._all_docids is None:
+            self._upgrade_docids()
+        if self._all_docids.add(docid):
+            self._all_docids_count.change(1)
+
+    def _add_docids(self, docids):
+        # Bulk version of ``_add_docid``.
+        if self._all_docids is None:
+            self._upgrade_docids()
+        all_docids = self._all_docids
+        # the pure-Python TreeSet.update doesn't return the number of keys
+        # it added: count them beforehand
+        new = [docid for docid in docids if docid not in all_docids]
+        if new:
+            all_docids.update(new)
+            self._all_docids_count.change(len(set(new)))
+
+    def _remove_docid(self, docid):
+        # Record that ``docid`` is in neither ``indexed()`` nor
+        # ``not_indexed()`` anymore.  Must be called once the index
+        # reflects it.
+        if self._all_docids is None:
+            self._upgrade_docids()
+        all_docids = self._all_docids
+        if docid in all_docids:
+            all_docids.remove(docid)
+            self._all_docids_count.change(-1)
+
+    def _upgrade_docids(self):
+        # indexes created before docids were tracked compute the set once,
+        # on their first change
+        all_docids = self.family.IF.TreeSet(self._compute_docids())
+        self._all_docids = all_docids
+        self._all_docids_count = Length(len(all_docids))
+
+    def generation(self):
+        """ Return a number which changes whenever the contents of the index
+        change, or ``None`` if the index has changes which aren't committed
+        yet, or doesn't count its changes (it never called
+        ``_bump_generation``).  Results computed from the index while its
+        generation stays the same are the same. """
+        generation = self._generation
+        if generation is None:
+            return None
+        if generation._p_changed or (
+                generation._p_oid is None and
+                getattr(self, '_p_oid', None) is not None):
+            # the counter doesn't reflect committed contents (an abort
+            # would revert it to a value it has had before)
+            return None
+        return generation()
+
+    def _bump_generation(self):
+        # Called by indexes whenever their contents change.  The counter
+        # is a Length so that concurrent changes don't conflict.
+        if self._generation is None:
+            self._generation = Length(0)
+        self._generation.change(1)
 
     def apply_intersect(self, query, docids):
         """ Default apply_intersect implementation """
@@ -169,11 +624,41 @@ class BaseIndexMixin(object):
 
     def _negate(self, apply_func, *args, **kw):
         positive = apply_func(*args, **kw)
-        all = self.docids()
+        all = self._docid_set()
         if len(positive) == 0:
-            return all
+            # don't hand out the index's own set
+            return self.family.IF.Set(all)
         return self.family.IF.difference(all, positive)
 
+    def _negate_intersect(self, docids, apply_func, *args, **kw):
+        # Same as intersecting ``_negate(apply_func, ...)`` with ``docids``,
+        # but removes the positive result from ``docids`` rather than from
+        # all the docids of the index.  The weights of ``docids`` are
+        # combined with the negated set as ``Query.intersect`` would.
+        IF = self.family.IF
+        positive = apply_func(*args, **kw)
+        remaining = docids
+        if len(positive):
+            remaining = IF.difference(docids, positive)
+        if not len(remaining):
+            return IF.Set()
+        all = self._docid_set()
+        if len(remaining) * 10 < self.docids_count():
+            # checking each docid beats walking all of them
+            keep = IF.Set([docid for docid in remaining if docid in all])
+        else:
+            keep = IF.intersection(remaining, all)
+        if not len(keep):
+            return IF.Set()
+        _, result = IF.weightedIntersection(docids, keep)
+        return result
+
+    def _estimate_negated(self, estimate_func, *args, **kw):
+        positive = estimate_func(*args, **kw)
+        if positive is None:
+            return None
+        return max(self.docids_count() - positive, 0)
+
     def qname(self):
         # used in query representations; __name__ should be set by
         # catalog __setitem__ but if it's not, we fall back to a generic
@@ -184,15 +669,17 @@ class BaseIndexMixin(object):
             str(self),
             )
         
-    def resultset_from_query(self, query, names=None, resolver=None):
+    def resultset_from_query(self, query, names=None, resolver=None,
+                             batch_resolver=None, docid_mapper=None):
         # default resultset factory; meant to be overridden by systems that
         # have a default resolver.  NB: although the default implementation
         # below does not access "self", so it would appear that this could be
         # turned into a classmeth or staticmethod, subclasses that override may
-        # expect self, so this is a plain method.
-        docids = query._apply(names)
-        numdocs = len(docids)
-        return ResultSet(docids, numdocs, resolver)
+        # expect self, so this is a plain method.  The query is applied once
+        # its results are needed (see ResultSet).
+        return ResultSet(
+            None, None, resolver, query=query, names=names,
+            batch_resolver=batch_resolver, docid_mapper=docid_mapper)
 
     def flush(self, *arg, **kw):
         """ Hookable by upstream systems"""
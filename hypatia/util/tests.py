@@ -28,6 +28,12 @@ class TestResultSet(unittest.TestCase):
         inst = self._makeOne([1], 1, None)
         self.assertEqual(len(inst), 1)
 
+    def test_numids_settable(self):
+        inst = self._makeOne([2, 1], 2, None)
+        inst.numids = 1
+        self.assertEqual(inst.numids, 1)
+        self.assertEqual(len(inst), 1)
+
     def test_sort(self):
         inst = self._makeOne([2, 1], 2, None)
         index = DummyIndex()
@@ -48,6 +54,165 @@ class TestResultSet(unittest.TestCase):
         self.assertEqual(index.reverse, True)
         self.assertEqual(index.limit, 1)
 
+    def _makeFieldIndexes(self):
+        from hypatia.field import FieldIndex
+        priority = FieldIndex(lambda obj, default: obj[0])
+        date = FieldIndex(lambda obj, default: obj[1])
+        docs = [(1, (1, 'b')), (2, (2, 'a')), (3, (1, 'a')),
+                (4, (2, 'c')), (5, (1, 'b')), (6, (3, 'a'))]
+        for docid, obj in docs:
+            priority.index_doc(docid, obj)
+            date.index_doc(docid, obj)
+        return priority, date
+
+    def test_sort_by(self):
+        priority, date = self._makeFieldIndexes()
+        inst = self._makeOne([1, 2, 3, 4, 5, 6], 6, None)
+        result = inst.sort_by([(priority, True), (date, False)])
+        self.assertEqual(list(result.ids), [6, 2, 4, 3, 1, 5])
+        self.assertEqual(len(result), 6)
+        result = inst.sort_by([date, (priority, True)])
+        self.assertEqual(list(result.ids), [6, 2, 3, 1, 5, 4])
+
+    def test_sort_by_w_limit(self):
+        priority, date = self._makeFieldIndexes()
+        inst = self._makeOne([5, 4, 3, 2, 1], 5, None)
+        result = inst.sort_by([(priority, False), (date, True)], limit=2)
+        self.assertEqual(list(result.ids), [5, 1])
+        self.assertEqual(len(result), 2)
+        result = inst.sort_by([(priority, False), (date, True)])
+        self.assertEqual(list(result[:3].ids), [5, 1, 3])
+
+    def test_sort_by_w_limit_reverse(self):
+        priority, date = self._makeFieldIndexes()
+        inst = self._makeOne([1, 2, 3, 4, 5, 6], 6, None)
+        # docids 2 and 4 tie at the bound: the second key decides
+        result = inst.sort_by([(priority, True), (date, True)], limit=2)
+        self.assertEqual(list(result.ids), [6, 4])
+        result = inst.sort_by([(priority, True), (date, False)], limit=2)
+        self.assertEqual(list(result.ids), [6, 2])
+        result = inst.sort_by([(priority, True), (date, True)], limit=4)
+        self.assertEqual(list(result.ids), [6, 4, 2, 1])
+
+    def test_sort_by_w_sort_column(self):
+        priority, date = self._makeFieldIndexes()
+        priority.sort_column = True
+        inst = self._makeOne([1, 2, 3, 4, 5, 6], 6, None)
+        result = inst.sort_by([(priority, True), (date, False)])
+        self.assertEqual(list(result.ids), [6, 2, 4, 3, 1, 5])
+
+    def test_sort_by_w_missing_docids(self):
+        from hypatia.exc import Unsortable
+        priority, date = self._makeFieldIndexes()
+        date.unindex_doc(3)
+        inst = self._makeOne([1, 2, 3, 7], 4, None)
+        result = inst.sort_by([priority, date])
+        self.assertRaises(Unsortable, list, result.ids)
+        result = inst.sort_by([priority, date], limit=2)
+        self.assertEqual(list(result.ids), [1, 2])
+        result = inst.sort_by([priority, date], raise_unsortable=False)
+        self.assertEqual(list(result.ids), [1, 2])
+
+    def test_sort_by_w_none_value(self):
+        priority, date = self._makeFieldIndexes()
+        priority.index_doc(7, (None, 'a'))
+        date.index_doc(7, (None, 'a'))
+        inst = self._makeOne([1, 2, 3, 7], 4, None)
+        result = inst.sort_by([priority, date])
+        self.assertEqual(list(result.ids), [7, 3, 1, 2])
+        result = inst.sort_by([(priority, True), date], limit=2)
+        self.assertEqual(list(result.ids), [2, 3])
+        self.assertEqual(list(priority.sort([1, 2, 3, 7])), [7, 1, 3, 2])
+
+    def test_sort_by_w_missing_docids_wo_sort_keys(self):
+        from hypatia.exc import Unsortable
+        priority, date = self._makeFieldIndexes()
+        date.unindex_doc(3)
+        inst = self._makeOne([1, 2, 3, 7], 4, None)
+        for sort_keys in (priority.sort_keys, None):
+            # without sort keys, the indexes sort in turn, but the docids
+            # they can't sort are still reported after the others
+            priority.sort_keys = sort_keys
+            ids = iter(inst.sort_by([priority, date]).ids)
+            self.assertEqual(next(ids), 1)
+            self.assertEqual(next(ids), 2)
+            try:
+                next(ids)
+            except Unsortable as e:
+                self.assertEqual(e.docids, [3, 7])
+            else: # pragma: no cover
+                self.fail('Unsortable not raised')
+            result = inst.sort_by([priority, date], limit=2)
+            self.assertEqual(list(result.ids), [1, 2])
+            result = inst.sort_by([priority, date], raise_unsortable=False)
+            self.assertEqual(list(result.ids), [1, 2])
+
+    def test_sort_by_wo_sort_keys(self):
+        from hypatia.interfaces import STABLE
+        priority, date = self._makeFieldIndexes()
+        index = DummyIndex()
+        inst = self._makeOne([3, 2, 1], 3, None)
+        result = inst.sort_by([(priority, True), index], limit=2)
+        self.assertEqual(list(result.ids), [2, 1])
+        self.assertEqual(index.ids, [3, 2, 1])
+        self.assertEqual(index.limit, None)
+        self.assertEqual(index.sort_type, STABLE)
+
+    def test_lazy(self):
+        query = DummyQuery([2, 1])
+        cls = self._getTargetClass()
+        inst = cls(None, None, None, query=query, names={'a': 1})
+        self.assertEqual(query.names, None)
+        self.assertEqual(len(inst), 2)
+        self.assertEqual(query.names, {'a': 1})
+        self.assertEqual(inst.ids, [2, 1])
+
+    def test_sort_lazy_pushed_down(self):
+        query = DummyQuery([2, 1])
+        cls = self._getTargetClass()
+        inst = cls(None, None, None, query=query, names={'a': 1})
+        index = DummyIndex()
+        index.sort_query = lambda *arg, **kw: [1]
+        result = inst.sort(index, limit=1)
+        self.assertEqual(result.ids, [1])
+        self.assertEqual(result.numids, 1)
+        self.assertEqual(query.names, None)
+        self.assertEqual(index.ids, None)
+
+    def test_sort_lazy_pushdown_declined(self):
+        query = DummyQuery([2, 1])
+        cls = self._getTargetClass()
+        inst = cls(None, None, None, query=query)
+        index = DummyIndex()
+        calls = []
+        def sort_query(query, names, reverse, limit, raise_unsortable):
+            calls.append((query, names, reverse, limit, raise_unsortable))
+        index.sort_query = sort_query
+        result = inst.sort(index, limit=1, reverse=True,
+                           raise_unsortable=False)
+        self.assertEqual(result.ids, [1, 2])
+        self.assertEqual(calls, [(query, None, True, 1, False)])
+        self.assertEqual(result.numids, 1)
+
+    def test_sort_lazy_stable_not_pushed_down(self):
+        from hypatia.interfaces import STABLE
+        query = DummyQuery([2, 1])
+        cls = self._getTargetClass()
+        inst = cls(None, None, None, query=query)
+        index = DummyIndex()
+        index.sort_query = lambda *arg, **kw: self.fail('pushed down')
+        result = inst.sort(index, limit=1, sort_type=STABLE)
+        self.assertEqual(result.ids, [1, 2])
+
+    def test_sort_lazy_without_limit_not_pushed_down(self):
+        query = DummyQuery([2, 1])
+        cls = self._getTargetClass()
+        inst = cls(None, None, None, query=query)
+        index = DummyIndex()
+        index.sort_query = lambda *arg, **kw: self.fail('pushed down')
+        result = inst.sort(index)
+        self.assertEqual(result.ids, [1, 2])
+
     def test_sort_generator(self):
         def mygen():
             yield 2
@@ -167,6 +332,75 @@ class TestResultSet(unittest.TestCase):
         inst = self._makeOne([2, 1], 2, resolver)
         self.assertEqual(inst.first(resolve=False), 2)
 
+    def test_sort_deferred(self):
+        inst = self._makeOne([2, 1], 2, None)
+        index = DummyIndex()
+        result = inst.sort(index, limit=1)
+        self.assertEqual(len(result), 1)
+        self.assertEqual(index.ids, None)
+
+    def test_first_sort_limited(self):
+        inst = self._makeOne([2, 1], 2, None)
+        index = DummyIndex()
+        result = inst.sort(index, limit=5)
+        self.assertEqual(result.first(), 1)
+        self.assertEqual(index.limit, 1)
+
+    def test___getitem___slice_sort_limited(self):
+        inst = self._makeOne([4, 3, 2, 1], 4, None)
+        index = DummyIndex()
+        result = inst.sort(index)[1:3]
+        self.assertEqual(index.limit, 3)
+        self.assertEqual(result.ids, [2, 3])
+        self.assertEqual(len(result), 2)
+
+    def test___getitem___slice_sort_limit_smaller(self):
+        inst = self._makeOne([4, 3, 2, 1], 4, None)
+        index = DummyIndex()
+        inst.sort(index, limit=2)[0:3]
+        self.assertEqual(index.limit, 2)
+
+    def test___getitem___slice_generator(self):
+        inst = self._makeOne(iter([4, 3, 2, 1]), 4, None)
+        result = inst[1:3]
+        self.assertEqual(list(result), [3, 2])
+        self.assertEqual(list(inst), [4, 3, 2, 1])
+
+    def test___getitem___slice_keeps_resolver(self):
+        def resolver(val):
+            return val * 10
+        inst = self._makeOne([4, 3, 2, 1], 4, resolver)
+        self.assertEqual(list(inst[:2]), [40, 30])
+
+    def test___getitem___slice_empty(self):
+        inst = self._makeOne([4, 3, 2, 1], 4, None)
+        self.assertEqual(inst[3:1].ids, [])
+
+    def test___getitem___slice_negative(self):
+        inst = self._makeOne(iter([4, 3, 2, 1]), 4, None)
+        self.assertEqual(inst[-3:-1].ids, [3, 2])
+        self.assertEqual(inst[::2].ids, [4, 2])
+        self.assertEqual(inst[1:].ids, [3, 2, 1])
+
+    def test___getitem___int(self):
+        def resolver(val):
+            return val * 10
+        inst = self._makeOne(iter([4, 3, 2, 1]), 4, resolver)
+        self.assertEqual(inst[1], 30)
+        self.assertEqual(inst[-1], 10)
+        self.assertRaises(IndexError, inst.__getitem__, 4)
+
+    def test___getitem___int_sort_limited(self):
+        inst = self._makeOne([4, 3, 2, 1], 4, None)
+        index = DummyIndex()
+        self.assertEqual(inst.sort(index)[2], 3)
+        self.assertEqual(index.limit, 3)
+
+    def test_generator_iterable_twice(self):
+        inst = self._makeOne(iter([2, 1]), 2, None)
+        self.assertEqual(list(inst), [2, 1])
+        self.assertEqual(list(inst), [2, 1])
+
     def test_one_no_docids(self):
         from ..exc import NoResults
         inst = self._makeOne([], 0, None)
@@ -212,12 +446,81 @@ class TestResultSet(unittest.TestCase):
         inst = self._makeOne([2, 1], 2, resolver)
         self.assertEqual(list(iter(inst)), ['a', 'a'])
 
+    def test_all_batch_resolver(self):
+        chunks = []
+        def batch_resolver(ids):
+            chunks.append(list(ids))
+            return [id_ * 10 for id_ in ids]
+        cls = self._getTargetClass()
+        inst = cls(iter([5, 4, 3, 2, 1]), 5, None,
+                   batch_resolver=batch_resolver, batch_size=2)
+        result = inst.all()
+        self.assertEqual(next(result), 50)
+        self.assertEqual(chunks, [[5, 4]])
+        self.assertEqual(list(result), [40, 30, 20, 10])
+        self.assertEqual(chunks, [[5, 4], [3, 2], [1]])
+
+    def test_all_batch_resolver_preferred(self):
+        cls = self._getTargetClass()
+        inst = cls([2, 1], 2, lambda id_: self.fail('resolved one'),
+                   batch_resolver=lambda ids: [id_ * 10 for id_ in ids])
+        self.assertEqual(list(inst), [20, 10])
+        self.assertEqual(inst.all(resolve=False), [2, 1])
+
+    def test_first_batch_resolver(self):
+        chunks = []
+        def batch_resolver(ids):
+            chunks.append(list(ids))
+            return [id_ * 10 for id_ in ids]
+        cls = self._getTargetClass()
+        inst = cls([2, 1], 2, None, batch_resolver=batch_resolver)
+        self.assertEqual(inst.first(), 20)
+        self.assertEqual(inst[1], 10)
+        self.assertEqual(chunks, [[2], [1]])
+
+    def test_batch_resolver_kept(self):
+        def batch_resolver(ids):
+            return [id_ * 10 for id_ in ids]
+        cls = self._getTargetClass()
+        inst = cls([3, 2, 1], 3, None, batch_resolver=batch_resolver,
+                   batch_size=2)
+        for result in (inst.sort(DummyIndex()), inst[:2], inst.intersect([1])):
+            self.assertTrue(result.batch_resolver is batch_resolver)
+            self.assertEqual(result.batch_size, 2)
+            self.assertEqual(result.first(), result.ids[0] * 10)
+
     def test_intersect_docids(self):
         inst = self._makeOne([3, 2, 1], 3, None)
         result = inst.intersect([1])
         self.assertEqual(result.__class__, inst.__class__)
         self.assertEqual(result.ids, [1])
 
+    def _makeMapped(self, ids, resolver=None, **kw):
+        from ..catalog import DocidMapper
+        mapper = DocidMapper()
+        for docid in (100, 200, 300):
+            mapper.add(docid)
+        cls = self._getTargetClass()
+        return cls(ids, len(ids), resolver, docid_mapper=mapper, **kw)
+
+    def test_docid_mapper(self):
+        inst = self._makeMapped([2, 0])
+        self.assertEqual(list(inst.ids), [2, 0])
+        self.assertEqual(list(inst.all(resolve=False)), [300, 100])
+        self.assertEqual(list(inst), [300, 100])
+        self.assertEqual(inst.first(resolve=False), 300)
+        self.assertEqual(inst[1], 100)
+        self.assertEqual(list(inst[1:]), [100])
+        self.assertEqual(list(inst.intersect([100, 400]).all()), [100])
+
+    def test_docid_mapper_resolvers(self):
+        inst = self._makeMapped([2, 0], resolver=str)
+        self.assertEqual(list(inst), ['300', '100'])
+        self.assertEqual(inst.first(), '300')
+        inst = self._makeMapped(
+            [2, 0], batch_resolver=lambda ids: [str(id_) for id_ in ids])
+        self.assertEqual(list(inst), ['300', '100'])
+
     def test_intersect_rs(self):
         inst = self._makeOne([3, 2, 1], 3, None)
         inst2 = self._makeOne([3, 2], 2, None)
@@ -259,6 +562,52 @@ class TestBaseIndexMixin(unittest.TestCase):
         self.assertEqual(index.value, 'abc')
         self.assertEqual(set(index.docids()), set([1]))
 
+    def test_index_doc_extracted(self):
+        index = self._makeIndex('abc')
+        class Dummy:
+            abc = 'abc'
+        extracted = index.extractor()(Dummy())
+        self.assertEqual(extracted.found, True)
+        self.assertEqual(extracted.value, 'abc')
+        index.discriminator = lambda *arg: self.fail('discriminated')
+        self.assertEqual(index.index_doc(1, extracted), 'abc')
+        self.assertEqual(index.value, 'abc')
+
+    def test_index_doc_extracted_missing_value(self):
+        from . import Extracted
+        index = self._makeIndex('abc')
+        self.assertEqual(index.index_doc(1, Extracted(False)), None)
+        self.assertEqual(set(index.not_indexed()), set([1]))
+
+    def test_index_docs(self):
+        index = self._makeIndex('abc')
+        indexed = []
+        index.index_doc = lambda docid, obj: indexed.append((docid, obj))
+        index.index_docs(iter([(1, 'a'), (2, 'b')]))
+        self.assertEqual(indexed, [(1, 'a'), (2, 'b')])
+
+    def test_extractor_missing_value(self):
+        index = self._makeIndex('abc')
+        self.assertEqual(index.extractor()(object()).found, False)
+
+    def test_extractor_persistent_value(self):
+        from persistent import Persistent
+        index = self._makeIndex(lambda obj, default: Persistent())
+        self.assertRaises(ValueError, index.extractor(), object())
+
+    def test_extractor_process(self):
+        from . import Extractor
+        extractor = Extractor(lambda obj, default: obj, process=str.upper)
+        self.assertEqual(extractor('abc').value, 'ABC')
+
+    def test_extractor_picklable(self):
+        import pickle
+        index = self._makeIndex('abc')
+        extractor = pickle.loads(pickle.dumps(index.extractor()))
+        class Dummy:
+            abc = 'abc'
+        self.assertEqual(extractor(Dummy()).value, 'abc')
+
     def test_index_doc_missing_value_unindexes(self):
         index = self._makeIndex('abc')
         class Dummy:
@@ -323,6 +672,119 @@ class TestBaseIndexMixin(unittest.TestCase):
         inst.docids = docids
         self.assertEqual(inst.docids_count(), 3)
 
+    def test_docids_tracked(self):
+        index = self._makeIndex('abc')
+        index._reset_docids()
+        index._add_docid(1)
+        index._add_docid(2)
+        index._add_docid(2)
+        self.assertEqual(list(index.docids()), [1, 2])
+        self.assertEqual(index.docids_count(), 2)
+        index._remove_docid(1)
+        index._remove_docid(3)
+        self.assertEqual(list(index.docids()), [2])
+        self.assertEqual(index.docids_count(), 1)
+
+    def test_docids_tracked_returns_copy(self):
+        index = self._makeIndex('abc')
+        index._reset_docids()
+        index._add_docid(1)
+        docids = index.docids()
+        self.assertFalse(docids is index._docid_set())
+        docids.add(2)
+        self.assertEqual(list(index.docids()), [1])
+        self.assertEqual(list(index._docid_set()), [1])
+
+    def test_docids_tracking_upgrades_on_first_change(self):
+        index = self._makeIndex('abc')
+        index._docids.add(1)
+        index._not_indexed.add(2)
+        index._docids.add(3)
+        self.assertEqual(list(index._docid_set()), [1, 2, 3])
+        index._add_docid(3)
+        self.assertEqual(list(index.docids()), [1, 2, 3])
+        self.assertEqual(index.docids_count(), 3)
+        del index._all_docids
+        del index._all_docids_count
+        index._not_indexed.remove(2)
+        index._remove_docid(2)
+        self.assertEqual(list(index.docids()), [1, 3])
+        self.assertEqual(index.docids_count(), 2)
+        del index._all_docids
+        del index._all_docids_count
+        index._docids.add(4)
+        index._docids.add(5)
+        index._add_docids([3, 4, 5, 5])
+        self.assertEqual(list(index.docids()), [1, 3, 4, 5])
+        self.assertEqual(index.docids_count(), 4)
+
+    def test_apply_intersect(self):
+        index = self._makeIndex('abc')
+        index.apply = lambda query: index.family.IF.Set([1, 2, 3])
+        self.assertEqual(list(index.apply_intersect('q', None)), [1, 2, 3])
+        docids = index.family.IF.Set([2, 3, 4])
+        self.assertEqual(list(index.apply_intersect('q', docids)), [2, 3])
+
+    def test_generation(self):
+        index = self._makeIndex('abc')
+        # the index doesn't count its changes until it first bumps
+        self.assertEqual(index.generation(), None)
+        index._bump_generation()
+        index._bump_generation()
+        self.assertEqual(index.generation(), 2)
+
+    def test_generation_uncommitted(self):
+        index = self._makeIndex('abc')
+        index._bump_generation()
+        index._generation = DummyPersistent(_p_changed=True, _p_oid=b'1')
+        self.assertEqual(index.generation(), None)
+        index._generation = DummyPersistent(_p_changed=False, _p_oid=None)
+        index._p_oid = b'2'
+        self.assertEqual(index.generation(), None)
+        index._generation._p_oid = b'1'
+        self.assertEqual(index.generation(), 1)
+
+    def test__negate_intersect(self):
+        index = self._makeIndex('abc')
+        IF = index.family.IF
+        index._reset_docids()
+        for docid in range(100):
+            index._add_docid(docid)
+        positive = IF.Set([1, 2, 3])
+        result = index._negate_intersect(IF.Set([1, 5, 200]), lambda: positive)
+        self.assertEqual(list(result), [5])
+        result = index._negate_intersect(
+            IF.Set(range(50, 150)), lambda: positive)
+        self.assertEqual(list(result), list(range(50, 100)))
+        result = index._negate_intersect(IF.Set([1, 2]), lambda: positive)
+        self.assertEqual(list(result), [])
+
+    def test__negate_intersect_weighted(self):
+        index = self._makeIndex('abc')
+        IF = index.family.IF
+        index._reset_docids()
+        for docid in range(100):
+            index._add_docid(docid)
+        positive = IF.Set([1])
+        docids = IF.Bucket({1: 0.5, 5: 0.25, 200: 1.0})
+        result = index._negate_intersect(docids, lambda: positive)
+        # weighed as the intersection with the negated set would be
+        self.assertEqual(list(result.items()), [(5, 1.25)])
+        docids = IF.Bucket([(docid, 0.5) for docid in range(50, 60)])
+        result = index._negate_intersect(docids, lambda: positive)
+        self.assertEqual(list(result.values()), [1.5] * 10)
+        result = index._negate_intersect(
+            IF.Bucket({200: 1.0}), lambda: positive)
+        self.assertEqual(list(result), [])
+
+    def test__negate_does_not_return_tracked_docids(self):
+        index = self._makeIndex('abc')
+        index._reset_docids()
+        index._add_docid(1)
+        result = index._negate(lambda: [])
+        self.assertEqual(list(result), [1])
+        self.assertFalse(result is index._docid_set())
+
     def test_index_doc_persistent_value_raises(self):
         from persistent import Persistent
         index = self._makeIndex('abc')
@@ -368,6 +830,21 @@ class TestBaseIndexMixin(unittest.TestCase):
         index = self._makeIndex('abc')
         self.assertEqual(index.flush(), None)
 
+    def test_resultset_from_query_is_lazy(self):
+        index = self._makeIndex('abc')
+        query = DummyQuery([1, 2])
+        rs = index.resultset_from_query(query, {'a': 1}, 'resolver')
+        self.assertEqual(query.names, None)
+        self.assertEqual(rs.resolver, 'resolver')
+        self.assertEqual(list(rs.ids), [1, 2])
+        self.assertEqual(query.names, {'a': 1})
+
+    def test_resultset_from_query_batch_resolver(self):
+        index = self._makeIndex('abc')
+        query = DummyQuery([1, 2])
+        rs = index.resultset_from_query(query, batch_resolver='batch')
+        self.assertEqual(rs.batch_resolver, 'batch')
+
 class RichComparisonMixinTest(unittest.TestCase):
 
     def setUp(self):
@@ -458,9 +935,30 @@ class RichComparer(RichComparisonMixin):
         return self.value < other.value
 
 
+class DummyQuery(object):
+
+    names = None
+
+    def __init__(self, ids):
+        self.ids = ids
+
+    def _apply(self, names):
+        self.names = names
+        return self.ids
+
+
+class DummyPersistent(object):
+
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+    def __call__(self):
+        return 1
+
 class DummyIndex(object):
 
     value = None
+    ids = None
 
     def index_doc(self, docid, value):
         value = self.discriminate(value, _marker)
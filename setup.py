@@ -113,7 +113,6 @@ setup(name='hypatia',
       tests_require = install_requires,
       install_requires = install_requires,
       extras_require = {
-        'benchmark': ['PyChart'],
         'testing': testing_extras,
         'docs': docs_extras,
         },